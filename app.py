@@ -1,15 +1,36 @@
 ﻿# app.py - COMPLETE FIXED VERSION (replace your current file with this)
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, make_response
+from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, make_response, g, has_request_context, session
 from flask_login import LoginManager, login_required, current_user, login_user, logout_user, UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date, timedelta
+from jinja2 import FileSystemBytecodeCache, TemplateError
 
 import sqlite3
 from pathlib import Path
 import io
+import math
 import csv
 import sys
 import traceback
+import threading
+import time
+import os
+import json
+import heapq
+import logging
+import random
+import re
+import cProfile
+import hashlib
+from functools import wraps
+import queue
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from invoices import render_document, render_batch
+from profiling import SamplingProfiler, collapse_pstats, merge_collapsed, top_functions
+from page_cache import PageCache, FragmentCacheExtension
+from assets import AssetManifest
+from compression import CompressionMiddleware
 
 
 # ----- Config -----
@@ -17,8 +38,10 @@ app = Flask(__name__)
 app.secret_key = 'dl-farm-secret-key-2025-change-in-production'
 
 BASE_DIR = Path(__file__).parent
-DB_PATH = BASE_DIR / 'database' / 'farm.db'
-DB_PATH.parent.mkdir(exist_ok=True)
+# DATABASE (a path or sqlite:/// URL, as production_db_path() reads it) points the app at another
+# database file, e.g. the scratch DB from scripts/generate_farm_data.py
+DB_PATH = Path(os.environ.get('DATABASE', '').split('sqlite:///', 1)[-1] or BASE_DIR / 'database' / 'farm.db')
+DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
 # ----- Login setup -----
 login_manager = LoginManager()
@@ -70,12 +93,538 @@ def load_user(user_id):
         return None
 
 
-def get_db_connection():
-    conn = sqlite3.connect(str(DB_PATH))
+# ----- SQL instrumentation -----
+# Every connection from get_db_connection()/production_get_conn() counts and times its statements
+# into a per-request record (flask.g). after_request turns that into a Server-Timing header and one
+# JSON log line; statements slower than SLOW_QUERY_MS go to SLOW_QUERY_LOG with their query plan.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG = BASE_DIR / 'logs' / 'slow_queries.log'
+SQL_STATS_TOP = 5
+
+# Write contention between workers: SQLite itself waits up to DB_BUSY_TIMEOUT_MS for a lock; if a
+# statement or commit still fails with "database is locked" it is retried DB_LOCK_RETRIES more
+# times with exponential backoff and jitter. A statement that failed on a lock had no effect, so
+# re-running it is safe. A transaction that has only read so far is rolled back before the retry:
+# under WAL its snapshot may be older than the last commit, and SQLite refuses to upgrade a stale
+# snapshot to a write no matter how long it waits. DB_JOURNAL_MODE (default WAL) lets readers run
+# alongside the writer.
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_LOCK_RETRIES = int(os.environ.get('DB_LOCK_RETRIES', 3))
+DB_RETRY_BACKOFF_MS = float(os.environ.get('DB_RETRY_BACKOFF_MS', 50))
+DB_JOURNAL_MODE = os.environ.get('DB_JOURNAL_MODE', 'wal')
+
+request_log = logging.getLogger('farm.requests')
+if not request_log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    request_log.addHandler(_handler)
+    request_log.setLevel(os.environ.get('REQUEST_LOG_LEVEL', 'INFO').upper())
+    request_log.propagate = False
+
+_slow_log_lock = threading.Lock()
+
+
+def _sql_stats():
+    """The current request's {'count', 'ms', 'slowest'} record, or None outside a request."""
+    if not has_request_context():
+        return None
+    stats = g.get('sql_stats')
+    if stats is None:
+        stats = g.sql_stats = _new_sql_stats()
+    return stats
+
+
+def _new_sql_stats():
+    return {'count': 0, 'ms': 0.0, 'slowest': [], 'lock_ms': 0.0, 'lock_retries': 0, 'lock_failures': 0}
+
+
+def _is_lock_error(e):
+    return getattr(e, 'sqlite_errorcode', None) in (5, 6) or 'locked' in str(e) or 'busy' in str(e)
+
+
+def with_lock_retry(fn, *args, conn=None):
+    """
+    Call fn(*args), retrying with exponential backoff while SQLite reports the database locked.
+    conn: the connection fn runs on; a read-only transaction open on it is rolled back before retrying.
+    """
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if not _is_lock_error(e):
+                raise
+            stats = _sql_stats()
+            waited = time.perf_counter() - started
+            if attempt >= DB_LOCK_RETRIES:
+                if stats is not None:
+                    stats['lock_ms'] += waited * 1000.0
+                    stats['lock_failures'] += 1
+                raise
+            if conn is not None and conn.in_transaction and conn.total_changes == conn.clean_changes:
+                conn.rollback()
+            delay = DB_RETRY_BACKOFF_MS / 1000.0 * (2 ** attempt) * random.uniform(0.5, 1.5)
+            time.sleep(delay)
+            if stats is not None:
+                stats['lock_ms'] += (waited + delay) * 1000.0
+                stats['lock_retries'] += 1
+            attempt += 1
+
+
+def _log_slow_query(conn, sql, params, ms):
+    try:
+        plan = [row[-1] for row in sqlite3.Cursor(conn).execute('EXPLAIN QUERY PLAN ' + sql, params or ())]
+    except sqlite3.Error:
+        plan = []
+    entry = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'route': request.endpoint if has_request_context() else None,
+        'ms': round(ms, 2),
+        'sql': ' '.join(sql.split()),
+        'params': repr(params)[:200] if params else None,
+        'plan': plan,
+    }
+    try:
+        with _slow_log_lock:
+            SLOW_QUERY_LOG.parent.mkdir(exist_ok=True)
+            with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as fh:
+                fh.write(json.dumps(entry) + '\n')
+    except OSError:
+        pass
+
+
+def _record_query(conn, sql, params, ms, explain=True):
+    stats = _sql_stats()
+    if stats is not None:
+        stats['count'] += 1
+        stats['ms'] += ms
+        entry = (ms, stats['count'], ' '.join(sql.split())[:200])
+        if len(stats['slowest']) < SQL_STATS_TOP:
+            heapq.heappush(stats['slowest'], entry)
+        elif ms > stats['slowest'][0][0]:
+            heapq.heapreplace(stats['slowest'], entry)
+    if ms >= SLOW_QUERY_MS and explain:
+        _log_slow_query(conn, sql, params, ms)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    sqlite3 cursor that reports each statement's wall time to the request's SQL stats.
+    SQLite steps through a result set while it is fetched, so fetch time counts towards the
+    statement as well; a query is recorded once its rows are exhausted, or when the cursor is
+    closed, re-executed or garbage-collected.
+    """
+
+    _pending = None  # [sql, params, ms] of the statement whose rows are still being read
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            _record_query(self.connection, *pending)
+
+    def _timed(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if self._pending is not None:
+                self._pending[2] += (time.perf_counter() - started) * 1000.0
+
+    def execute(self, sql, params=()):
+        self._finish()
+        self._pending = [sql, params, 0.0]
+        try:
+            return self._timed(with_lock_retry, super().execute, sql, params, conn=self.connection)
+        finally:
+            if self.description is None:  # no result set: nothing left to time
+                self._finish()
+
+    def executemany(self, sql, seq_of_params):
+        self._finish()
+        seq_of_params = list(seq_of_params)
+        self._pending = [sql, seq_of_params[0] if seq_of_params else (), 0.0]
+        try:
+            return self._timed(with_lock_retry, super().executemany, sql, seq_of_params, conn=self.connection)
+        finally:
+            self._finish()
+
+    def executescript(self, script):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            _record_query(self.connection, script, (), (time.perf_counter() - started) * 1000.0, explain=False)
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        return super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors (including conn.execute shortcuts) are InstrumentedCursor.
+    clean_changes is total_changes as of the last commit/rollback, so an open transaction that has
+    written nothing can be told apart from one holding uncommitted rows.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.clean_changes = 0
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        result = with_lock_retry(super().commit)
+        self.clean_changes = self.total_changes
+        return result
+
+    def rollback(self):
+        result = super().rollback()
+        self.clean_changes = self.total_changes
+        return result
+
+
+def connect_db(path):
+    """Open an instrumented connection with sqlite3.Row rows and the configured busy timeout."""
+    conn = sqlite3.connect(str(path), timeout=DB_BUSY_TIMEOUT_MS / 1000.0, factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _emit_sql_stats(response):
+    stats = g.get('sql_stats') or _new_sql_stats()
+    total_ms = (time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000.0
+    response.headers['Server-Timing'] = (
+        f'db;dur={stats["ms"]:.2f};desc="{stats["count"]} queries", app;dur={max(total_ms - stats["ms"], 0):.2f}, '
+        f'lock;dur={stats["lock_ms"]:.2f};desc="{stats["lock_retries"]} retries, {stats["lock_failures"]} failed"'
+    )
+    if request.endpoint != 'static':
+        request_log.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'ms': round(total_ms, 2),
+            'db_ms': round(stats['ms'], 2),
+            'queries': stats['count'],
+            'lock_ms': round(stats['lock_ms'], 2),
+            'lock_retries': stats['lock_retries'],
+            'lock_failures': stats['lock_failures'],
+            'slowest': [{'ms': round(ms, 2), 'sql': sql} for ms, _, sql in sorted(stats['slowest'], reverse=True)],
+        }))
+    return response
+
+
+def get_db_connection():
+    return connect_db(DB_PATH)
+
+
+# ----- Static assets -----
+# scripts/build_assets.py writes minified, fingerprinted copies to static/dist plus a manifest.
+# url_for('static', ...) resolves through the manifest and templates pull bundles with
+# asset_urls(); the fingerprinted files never change, so browsers may keep them for a year.
+STATIC_MAX_AGE = 365 * 24 * 3600
+asset_manifest = AssetManifest(BASE_DIR / 'static')
+
+
+@app.url_defaults
+def _fingerprint_static(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = asset_manifest.resolve(values['filename'])
+
+
+def asset_urls(bundle):
+    """URLs to include for a bundle: the built bundle, or its source files before the first build."""
+    return [url_for('static', filename=f) for f in asset_manifest.bundle_files(bundle)]
+
+
+@app.after_request
+def _static_cache_headers(response):
+    if request.endpoint == 'static' and asset_manifest.is_fingerprinted((request.view_args or {}).get('filename', '')):
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    return response
+
+
+app.jinja_env.globals['asset_urls'] = asset_urls
+
+
+# ----- Response compression -----
+# Text responses above COMPRESS_MIN_BYTES are gzip/brotli encoded on the way out (streamed CSVs
+# included); static files use the .br/.gz copies scripts/build_assets.py writes next to them.
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))  # gzip level; 0 disables compression
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+
+app.wsgi_app = CompressionMiddleware(app.wsgi_app, min_size=COMPRESS_MIN_BYTES, level=COMPRESS_LEVEL,
+                                     brotli_quality=COMPRESS_BROTLI_QUALITY, static_dir=BASE_DIR / 'static',
+                                     static_url_path=app.static_url_path)
+
+
+# ----- Templates -----
+# Compiled templates are kept in a bytecode cache on disk (scripts/compile_templates.py fills it on
+# deploy), so a new worker unmarshals code instead of parsing ~50 large templates, and
+# warm_templates() loads every template at startup so no request pays for a first compile.
+TEMPLATE_CACHE_DIR = Path(os.environ.get('TEMPLATE_CACHE_DIR') or BASE_DIR / 'cache' / 'templates')
+TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', '1') != '0'
+
+TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR))
+_template_names = None
+
+
+def template_names():
+    """Every name the app's template loader knows; the directory is walked once per process."""
+    global _template_names
+    if _template_names is None:
+        _template_names = frozenset(app.jinja_loader.list_templates())
+    return _template_names
+
+
+def warm_templates():
+    """Load every .html template into the environment's cache; returns {name: error} for those that fail."""
+    errors = {}
+    for name in sorted(n for n in template_names() if n.endswith('.html')):
+        try:
+            app.jinja_env.get_template(name)
+        except TemplateError as e:
+            errors[name] = e
+    return errors
+
+
+# ----- Page cache -----
+# Page data and rendered fragments are cached under keys that carry the data_version of each table
+# they read. Triggers bump a table's version on every insert/update/delete (any worker, any code
+# path), so a write is visible on the next view without explicit invalidation.
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 512))  # 0 disables the cache
+PAGE_CACHE_MAX_MB = float(os.environ.get('PAGE_CACHE_MAX_MB', 32))
+PAGE_CACHE_SHARED = os.environ.get('PAGE_CACHE_SHARED')  # SQLite file shared by the workers; unset = per process
+DATA_VERSION_EXCLUDE = ('data_version', 'profiling_state', 'staff_workload')
+
+page_cache = PageCache(PAGE_CACHE_MAX_ENTRIES, int(PAGE_CACHE_MAX_MB * 1024 * 1024), PAGE_CACHE_SHARED)
+
+
+def _data_version_rows():
+    """table -> (version, updated_at), read once per request."""
+    rows = g.get('data_versions') if has_request_context() else None
+    if rows is None:
+        conn = get_db_connection()
+        try:
+            rows = {r[0]: (r[1], r[2]) for r in conn.execute('SELECT table_name, version, updated_at FROM data_version')}
+        except sqlite3.Error:
+            rows = {}
+        finally:
+            conn.close()
+        if has_request_context():
+            g.data_versions = rows
+    return rows
+
+
+def data_versions(tables):
+    """Current data_version of each table; unknown tables read as 0."""
+    rows = _data_version_rows()
+    return tuple(rows.get(t, (0, None))[0] for t in tables)
+
+
+def data_last_modified(tables):
+    """Latest write (UTC) to any of the tables, or None when none has been recorded."""
+    rows = _data_version_rows()
+    stamps = [rows[t][1] for t in tables if t in rows and rows[t][1]]
+    if not stamps:
+        return None
+    return _dt.datetime.strptime(max(stamps), '%Y-%m-%d %H:%M:%S').replace(tzinfo=_dt.timezone.utc)
+
+
+def page_cache_key(name, tables, vary=()):
+    """(name, day, table versions) plus, inside a request, the endpoint, its arguments and the user's role."""
+    key = (name, date.today().isoformat(), asset_manifest.build, tuple(zip(tables, data_versions(tables))))
+    if has_request_context():
+        key += (request.endpoint, tuple(sorted(request.args.items(multi=True))), getattr(current_user, 'role', None))
+    return key + tuple(vary)
+
+
+def cached(name, tables, build, vary=()):
+    """build() once per key; the result must be picklable and is shared, so callers must not mutate it."""
+    return page_cache.get_or_build(page_cache_key(name, tables, vary), build)
+
+
+# ----- Conditional GET -----
+# Pages and exports that depend only on known tables get a strong ETag built from those tables'
+# data versions (plus arguments, user, role, day and the code/template/asset build), and a
+# Last-Modified from the tables' latest write. A matching revalidation is answered with 304
+# before the view runs, so it costs one data_version read instead of the queries and rendering.
+CODE_BUILD = max(int(p.stat().st_mtime) for p in [Path(__file__), *(BASE_DIR / 'templates').glob('*.html')])
+
+
+def conditional_view(*tables, roles=None):
+    """
+    Decorator (below @login_required) for GET views whose output depends only on `tables`.
+    roles: the roles the view serves; anyone else goes straight to the view (and its access-denied
+    redirect), so a 304 never tells them when the tables last changed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # a pending flash message is part of the next page, so that page must be sent in full
+            if (request.method not in ('GET', 'HEAD') or session.get('_flashes')
+                    or (roles is not None and getattr(current_user, 'role', None) not in roles)):
+                return view(*args, **kwargs)
+            etag = hashlib.sha1(repr((
+                CODE_BUILD, asset_manifest.build, request.endpoint, sorted(kwargs.items()), sorted(request.args.items(multi=True)),
+                getattr(current_user, 'id', None), getattr(current_user, 'role', None),
+                date.today().isoformat(), data_versions(tables),
+            )).encode('utf-8')).hexdigest()
+            midnight = _dt.datetime.combine(date.today(), _dt.time()).astimezone(_dt.timezone.utc)
+            last_modified = max(filter(None, (
+                data_last_modified(tables), midnight, _dt.datetime.fromtimestamp(CODE_BUILD, _dt.timezone.utc))))
+
+            if request.headers.get('If-None-Match'):
+                # weak comparison: compressed responses carry the ETag as W/"..."
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                # Last-Modified has one-second resolution: only trust it once that second is over
+                since = request.if_modified_since
+                not_modified = (since is not None and last_modified <= since
+                                and last_modified < _dt.datetime.now(_dt.timezone.utc) - timedelta(seconds=1))
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = page_cache
+app.jinja_env.fragment_cache_key = page_cache_key
+
+
+# ----- Profiling (admin: /settings/profiling) -----
+# profiling_state (one row, shared by every worker) arms cProfile for the next `remaining` requests
+# whose path matches `pattern`, and switches the always-on sampler. Workers re-read it at most once
+# per PROFILE_STATE_TTL seconds, so an idle switch costs nothing per request.
+PROFILE_DIR = BASE_DIR / 'logs' / 'profiles'
+PROFILE_STATE_TTL = 1.0
+sampler = SamplingProfiler(interval=float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.02)))
+_profile_state_cache = {'at': 0.0, 'state': {'pattern': None, 'remaining': 0, 'sampling': 0}}
+
+
+def _profiling_state(refresh=False):
+    now = time.monotonic()
+    if refresh or now - _profile_state_cache['at'] > PROFILE_STATE_TTL:
+        try:
+            conn = sqlite3.connect(str(DB_PATH))
+            try:
+                row = conn.execute('SELECT pattern, remaining, sampling FROM profiling_state WHERE id = 1').fetchone()
+            finally:
+                conn.close()
+            if row:
+                _profile_state_cache['state'] = {'pattern': row[0], 'remaining': row[1] or 0, 'sampling': row[2] or 0}
+        except sqlite3.Error:
+            pass
+        _profile_state_cache['at'] = now
+    return _profile_state_cache['state']
+
+
+def _claim_profile_slot():
+    """Take one of the armed captures (atomic across workers); False once they are used up."""
+    conn = sqlite3.connect(str(DB_PATH))
+    try:
+        cur = conn.execute('UPDATE profiling_state SET remaining = remaining - 1 WHERE id = 1 AND remaining > 0')
+        conn.commit()
+        claimed = cur.rowcount == 1
+    finally:
+        conn.close()
+    _profiling_state(refresh=True)
+    return claimed
+
+
+@app.before_request
+def _start_profiling():
+    state = _profiling_state()
+    if state['sampling'] and not sampler.running:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        sampler.start(PROFILE_DIR / f'samples-{os.getpid()}.txt')
+    elif not state['sampling'] and sampler.running:
+        sampler.stop()
+    if sampler.running:
+        sampler.track(threading.get_ident())
+    if (state['remaining'] > 0 and request.endpoint != 'static' and not request.path.startswith('/settings/profiling')
+            and re.search(state['pattern'] or '', request.path) and _claim_profile_slot()):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.teardown_request
+def _finish_profiling(exc):
+    sampler.untrack(threading.get_ident())
+    prof = g.pop('profiler', None)
+    if prof is None:
+        return
+    prof.disable()
+    ms = (time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000.0
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        prof.dump_stats(str(PROFILE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'none'}-{ms:.0f}ms-{os.getpid()}.prof"))
+    except OSError as e:
+        app.logger.warning('could not write profile: %s', e)
+
+
 # ----- DB init + migration helper -----
 def ensure_task_columns(conn):
     """If older DB lacked priority/category columns, add them safely."""
@@ -126,8 +675,1060 @@ def ensure_reports_table(conn):
         print("Warning creating reports table:", e)
 
 
+def ensure_medical_followup_schema(conn):
+    """
+    Follow-up queue + drug withdrawal support on the medical table.
+    - withdrawal_days / withdrawal_until columns (withdrawal_until = treatment_date + days, set at write time)
+    - idx_medical_followup (next_checkup, animal_id) so upcoming checkups are a range scan
+    - idx_medical_withdrawal (withdrawal_until, animal_id) so only open withdrawals are loaded
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(medical)")
+        cols = {r[1] for r in cur.fetchall()}
+        if 'withdrawal_days' not in cols:
+            cur.execute("ALTER TABLE medical ADD COLUMN withdrawal_days INTEGER DEFAULT 0")
+            print("✓ Added 'withdrawal_days' column to medical")
+        if 'withdrawal_until' not in cols:
+            cur.execute("ALTER TABLE medical ADD COLUMN withdrawal_until DATE")
+            print("✓ Added 'withdrawal_until' column to medical")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_medical_followup ON medical(next_checkup, animal_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_medical_withdrawal ON medical(withdrawal_until, animal_id)")
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_medical_followup_schema):", e)
+
+
+def ensure_animal_profile_indexes(conn):
+    """
+    Indexes behind the per-animal profile: every related table is read with one query keyed by tag.
+    Also adds the optional sale.animal_tag column so live-animal sales can be tied to an animal.
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(sale)")
+        if 'animal_tag' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE sale ADD COLUMN animal_tag TEXT")
+            print("✓ Added 'animal_tag' column to sale")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_medical_animal ON medical(animal_id, treatment_date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_breeding_female ON breeding(female_id, breeding_date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_breeding_male ON breeding(male_id, breeding_date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_feed_group ON feed(animal_group, created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sale_animal ON sale(animal_tag, sale_date)")
+        # production is created lazily by the production routes; index it here when it already exists
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='production'")
+        if cur.fetchone():
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_production_animal ON production(animal_tag, production_date)")
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_animal_profile_indexes):", e)
+
+
+# day expressions shared by the feed analytics refresh queries and their expression indexes
+FEED_DAY_EXPR = "substr(created_at, 1, 10)"
+MILK_DAY_EXPR = "substr(COALESCE(NULLIF(production_date, ''), created_at), 1, 10)"
+
+
+def ensure_feed_analytics_schema(conn):
+    """
+    Precomputed daily aggregates for feed efficiency reporting.
+    feed_daily_agg: feed quantity + cost per (day, animal group, feed type)
+    milk_daily_agg: milk litres per (day, animal group)
+    Group keys are LOWER(TRIM(...)) of feed.animal_group / production.category.
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS feed_daily_agg (
+                day TEXT NOT NULL,
+                group_key TEXT NOT NULL,
+                feed_type TEXT NOT NULL,
+                feed_qty REAL DEFAULT 0,
+                feed_cost REAL DEFAULT 0,
+                entries INTEGER DEFAULT 0,
+                PRIMARY KEY (day, group_key, feed_type)
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS milk_daily_agg (
+                day TEXT NOT NULL,
+                group_key TEXT NOT NULL,
+                milk_liters REAL DEFAULT 0,
+                entries INTEGER DEFAULT 0,
+                PRIMARY KEY (day, group_key)
+            )
+        ''')
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_feed_day ON feed({FEED_DAY_EXPR})")
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='production'")
+        if cur.fetchone():
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_production_day ON production({MILK_DAY_EXPR})")
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_feed_analytics_schema):", e)
+
+
+def ensure_feed_stock_schema(conn):
+    """
+    Feed <-> inventory ledger link.
+    - feed.inventory_item_id: the stock item a feed entry was drawn from ('out' movement ref FEED-<id>)
+    - inventory_transactions: created up front so movements can be posted inside a caller's transaction
+    - feed_cover: days of cover per feed type (stock / trailing daily consumption), refreshed per touched type
+    - indexes resolving a feed type to its linked item and an item to the feed types drawing on it
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(feed)")
+        if 'inventory_item_id' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE feed ADD COLUMN inventory_item_id INTEGER")
+            print("✓ Added 'inventory_item_id' column to feed")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS inventory_transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                item_id INTEGER,
+                tx_type TEXT,
+                quantity INTEGER,
+                reference TEXT,
+                notes TEXT,
+                performed_by TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS feed_cover (
+                feed_key TEXT PRIMARY KEY,
+                item_id INTEGER,
+                stock REAL DEFAULT 0,
+                daily_rate REAL DEFAULT 0,
+                days_of_cover REAL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_feed_type_key ON feed(LOWER(TRIM(feed_type)), id)')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_feed_inventory_item ON feed(inventory_item_id)')
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_feed_stock_schema):", e)
+
+
+REORDER_WINDOW_DAYS = 30   # trailing window of 'out' movements used for the consumption rate
+REORDER_COVER_DAYS = 30    # a suggested reorder restores min_level plus this many days of consumption
+
+
+def refresh_low_stock(cur, item_ids=None):
+    """
+    Maintain inventory_low_stock (items whose on-hand quantity is below min_level) for the given
+    item ids, or for every item when item_ids is None. Reorder quantity = shortfall below min_level
+    + REORDER_COVER_DAYS of trailing consumption from inventory_transactions. Caller commits.
+    """
+    if item_ids is not None:
+        item_ids = sorted({int(i) for i in item_ids if i})
+        if not item_ids:
+            return
+        marks = ','.join('?' for _ in item_ids)
+        flag_filter = f'AND item_id IN ({marks})'
+        item_filter = f'AND i.id IN ({marks})'
+        tx_filter = f'AND item_id IN ({marks})'
+        params = tuple(item_ids)
+    else:
+        flag_filter = item_filter = tx_filter = ''
+        params = ()
+    since = (date.today() - timedelta(days=REORDER_WINDOW_DAYS)).isoformat()
+    cur.execute(f'''
+        DELETE FROM inventory_low_stock
+        WHERE item_id NOT IN (SELECT id FROM inventory
+                              WHERE COALESCE(min_level, 0) > 0 AND COALESCE(quantity, 0) < min_level)
+        {flag_filter}
+    ''', params)
+    cur.execute(f'''
+        INSERT INTO inventory_low_stock (item_id, name, unit, on_hand, min_level, daily_rate, reorder_qty)
+        SELECT i.id, i.name, i.unit, COALESCE(i.quantity, 0), i.min_level,
+               COALESCE(t.out_qty, 0) / {float(REORDER_WINDOW_DAYS)},
+               (i.min_level - COALESCE(i.quantity, 0)) + COALESCE(t.out_qty, 0) * {REORDER_COVER_DAYS / REORDER_WINDOW_DAYS}
+        FROM inventory i
+        LEFT JOIN (SELECT item_id, SUM(quantity) AS out_qty FROM inventory_transactions
+                   WHERE tx_type = 'out' AND created_at >= ? {tx_filter}
+                   GROUP BY item_id) t ON t.item_id = i.id
+        WHERE COALESCE(i.min_level, 0) > 0 AND COALESCE(i.quantity, 0) < i.min_level {item_filter}
+        ON CONFLICT(item_id) DO UPDATE SET
+            name = excluded.name, unit = excluded.unit, on_hand = excluded.on_hand, min_level = excluded.min_level,
+            daily_rate = excluded.daily_rate, reorder_qty = excluded.reorder_qty, updated_at = CURRENT_TIMESTAMP
+    ''', (since,) + params + params)
+
+
+def ensure_inventory_reorder_schema(conn):
+    """
+    Reorder points for the raw inventory table (models.Inventory.min_level was never carried over).
+    - inventory.min_level: reorder point; 0 disables alerts for the item
+    - inventory_low_stock: one row per item currently below its reorder point, so alert reads are O(alerts)
+    - idx_inventory_tx_item: trailing consumption per item is a range scan
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='inventory'")
+        if not cur.fetchone():
+            return
+        cur.execute("PRAGMA table_info(inventory)")
+        if 'min_level' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE inventory ADD COLUMN min_level REAL DEFAULT 0")
+            print("✓ Added 'min_level' column to inventory")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS inventory_low_stock (
+                item_id INTEGER PRIMARY KEY,
+                name TEXT,
+                unit TEXT,
+                on_hand REAL DEFAULT 0,
+                min_level REAL DEFAULT 0,
+                daily_rate REAL DEFAULT 0,
+                reorder_qty REAL DEFAULT 0,
+                flagged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_inventory_tx_item ON inventory_transactions(item_id, tx_type, created_at)")
+        refresh_low_stock(cur)
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_inventory_reorder_schema):", e)
+
+
+# --- general ledger: financial.transaction_type is free text; it is normalized once at write time ---
+FINANCIAL_INCOME_LABELS = ("income", "sale", "sales", "payment", "payment_received", "receipt")
+FINANCIAL_EXPENSE_LABELS = ("expense", "purchase", "purchases", "cost", "payment_made", "expense_paid")
+TXN_KIND_SQL = (
+    "CASE WHEN LOWER(TRIM(transaction_type)) IN (" + ",".join(f"'{l}'" for l in FINANCIAL_INCOME_LABELS) + ") THEN 'income' "
+    "WHEN LOWER(TRIM(transaction_type)) IN (" + ",".join(f"'{l}'" for l in FINANCIAL_EXPENSE_LABELS) + ") THEN 'expense' "
+    "ELSE 'other' END"
+)
+FIN_DAY_EXPR = "substr(COALESCE(NULLIF(transaction_date, ''), created_at), 1, 10)"
+GL_CASH_ACCOUNT = '1000'
+
+
+def financial_txn_kind(label):
+    """Normalize a financial transaction_type label to 'income', 'expense' or 'other'."""
+    label = (label or '').strip().lower()
+    if label in FINANCIAL_INCOME_LABELS:
+        return 'income'
+    if label in FINANCIAL_EXPENSE_LABELS:
+        return 'expense'
+    return 'other'
+
+
+def gl_account_code(kind, category):
+    return ('INC:' if kind == 'income' else 'EXP:') + (category or '').strip().lower()
+
+
+def rebuild_general_ledger(cur):
+    """
+    Rebuild journals, lines and monthly balances from the financial table in a few set-based
+    statements. Income posts Dr Cash / Cr Income:<category>; expense posts Dr Expense:<category> / Cr Cash.
+    Rows whose type is 'other' are not posted. Caller commits.
+    """
+    cur.execute('DELETE FROM gl_period_balance')
+    cur.execute('DELETE FROM gl_line')
+    cur.execute('DELETE FROM gl_journal')
+    cur.execute("INSERT OR IGNORE INTO gl_account (code, name, account_type) VALUES (?, 'Cash & Bank', 'asset')", (GL_CASH_ACCOUNT,))
+    cur.execute('''
+        INSERT OR IGNORE INTO gl_account (code, name, account_type)
+        SELECT CASE txn_kind WHEN 'income' THEN 'INC:' ELSE 'EXP:' END || LOWER(TRIM(COALESCE(category, ''))), MIN(TRIM(COALESCE(category, ''))), txn_kind
+        FROM financial WHERE txn_kind IN ('income', 'expense')
+        GROUP BY 1, 3
+    ''')
+    cur.execute(f'''
+        INSERT INTO gl_journal (financial_id, entry_date, description)
+        SELECT id, {FIN_DAY_EXPR}, description FROM financial WHERE txn_kind IN ('income', 'expense')
+    ''')
+    for side, income_code, expense_code in (
+        ('debit', f"'{GL_CASH_ACCOUNT}'", "'EXP:' || LOWER(TRIM(COALESCE(f.category, '')))"),
+        ('credit', "'INC:' || LOWER(TRIM(COALESCE(f.category, '')))", f"'{GL_CASH_ACCOUNT}'"),
+    ):
+        amounts = 'ABS(f.amount), 0' if side == 'debit' else '0, ABS(f.amount)'
+        cur.execute(f'''
+            INSERT INTO gl_line (journal_id, account_id, debit, credit)
+            SELECT j.id, a.id, {amounts}
+            FROM gl_journal j
+            JOIN financial f ON f.id = j.financial_id
+            JOIN gl_account a ON a.code = CASE f.txn_kind WHEN 'income' THEN {income_code} ELSE {expense_code} END
+        ''')
+    cur.execute('''
+        INSERT INTO gl_period_balance (account_id, period, debit, credit, closing_balance)
+        SELECT account_id, period, debit, credit,
+               SUM(debit - credit) OVER (PARTITION BY account_id ORDER BY period)
+        FROM (SELECT l.account_id, substr(j.entry_date, 1, 7) AS period, SUM(l.debit) AS debit, SUM(l.credit) AS credit
+              FROM gl_line l JOIN gl_journal j ON j.id = l.journal_id
+              GROUP BY 1, 2)
+    ''')
+
+
+def ensure_general_ledger_schema(conn):
+    """
+    Double-entry ledger behind the financial views.
+    - financial.txn_kind: 'income' | 'expense' | 'other', set at write time (indexed with the date)
+    - gl_account / gl_journal / gl_line: one journal (two lines) per posted financial row
+    - gl_period_balance: per account and month, the period debits/credits and the signed closing balance
+      (debit - credit), updated incrementally on every post
+    Existing rows are classified and posted once, on first start.
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(financial)")
+        if 'txn_kind' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE financial ADD COLUMN txn_kind TEXT")
+            print("✓ Added 'txn_kind' column to financial")
+        cur.execute(f"UPDATE financial SET txn_kind = {TXN_KIND_SQL} WHERE txn_kind IS NULL")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_financial_kind_date ON financial(txn_kind, transaction_date)")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS gl_account (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE NOT NULL,
+                name TEXT NOT NULL,
+                account_type TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS gl_journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                financial_id INTEGER UNIQUE,
+                entry_date DATE NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS gl_line (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                journal_id INTEGER NOT NULL REFERENCES gl_journal(id),
+                account_id INTEGER NOT NULL REFERENCES gl_account(id),
+                debit REAL DEFAULT 0,
+                credit REAL DEFAULT 0
+            )
+        ''')
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_gl_line_journal ON gl_line(journal_id)")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS gl_period_balance (
+                account_id INTEGER NOT NULL,
+                period TEXT NOT NULL,
+                debit REAL DEFAULT 0,
+                credit REAL DEFAULT 0,
+                closing_balance REAL DEFAULT 0,
+                PRIMARY KEY (account_id, period)
+            )
+        ''')
+        cur.execute("SELECT 1 FROM gl_journal LIMIT 1")
+        if cur.fetchone() is None:
+            cur.execute("SELECT 1 FROM financial WHERE txn_kind IN ('income', 'expense') LIMIT 1")
+            if cur.fetchone():
+                rebuild_general_ledger(cur)
+                print("✓ Posted existing financial records to the general ledger")
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_general_ledger_schema):", e)
+
+
+def ensure_sales_posting_schema(conn):
+    """
+    Sales post their revenue to financial under reference SALE-<sale id>; the reference index makes
+    the per-sale lookup and the sales/financial reconciliation join index reads.
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_financial_reference ON financial(reference)")
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_sales_posting_schema):", e)
+
+
+# a sale counts toward receivables until its payment_status says paid
+SALE_UNPAID_SQL = "LOWER(TRIM(COALESCE(payment_status, ''))) != 'paid'"
+
+
+def refresh_customer_totals(cur, customer_ids=None):
+    """
+    Recompute customer.total_spent / outstanding_balance / last_purchase_date from sale for the
+    given customers (all when None) with one grouped UPDATE. Caller commits.
+    """
+    if customer_ids is not None:
+        customer_ids = sorted({int(i) for i in customer_ids if i})
+        if not customer_ids:
+            return
+        where = 'WHERE id IN (' + ','.join('?' for _ in customer_ids) + ')'
+        params = tuple(customer_ids)
+    else:
+        where, params = '', ()
+    cur.execute(f'''
+        UPDATE customer SET
+            total_spent = COALESCE((SELECT SUM(total_amount) FROM sale WHERE customer_id = customer.id), 0),
+            outstanding_balance = COALESCE((SELECT SUM(total_amount) FROM sale
+                                            WHERE customer_id = customer.id AND {SALE_UNPAID_SQL}), 0),
+            last_purchase_date = (SELECT MAX(sale_date) FROM sale WHERE customer_id = customer.id)
+        {where}
+    ''', params)
+
+
+def ensure_customer_ledger_schema(conn):
+    """
+    Customer accounts (the running totals models.Customer defines, on the raw tables).
+    - sale.customer_id -> customer.id, backfilled by case-insensitive name match
+    - customer.outstanding_balance / total_spent / last_purchase_date, maintained on every sale write
+    - idx_sale_unpaid: partial index over unpaid sales by date, used by the aging report
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(sale)")
+        if 'customer_id' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE sale ADD COLUMN customer_id INTEGER REFERENCES customer(id)")
+            print("✓ Added 'customer_id' column to sale")
+        cur.execute("PRAGMA table_info(customer)")
+        cols = {r[1] for r in cur.fetchall()}
+        for col, ddl in (('outstanding_balance', 'REAL DEFAULT 0'), ('total_spent', 'REAL DEFAULT 0'),
+                         ('last_purchase_date', 'DATE')):
+            if col not in cols:
+                cur.execute(f"ALTER TABLE customer ADD COLUMN {col} {ddl}")
+                print(f"✓ Added '{col}' column to customer")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_customer_name ON customer(LOWER(TRIM(customer_name)))")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sale_customer ON sale(customer_id, sale_date)")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_sale_unpaid ON sale(sale_date, customer_id) WHERE {SALE_UNPAID_SQL}")
+        cur.execute('''
+            UPDATE sale SET customer_id = (SELECT MIN(c.id) FROM customer c
+                                           WHERE LOWER(TRIM(c.customer_name)) = LOWER(TRIM(sale.customer_name)))
+            WHERE customer_id IS NULL
+        ''')
+        if cur.rowcount:
+            refresh_customer_totals(cur)
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_customer_ledger_schema):", e)
+
+
+# one row per sale with the attributes the sales cube is keyed on (shared by the rebuild and the deltas)
+SALE_SUMMARY_SELECT = '''
+    SELECT s.id,
+           substr(COALESCE(NULLIF(s.sale_date, ''), s.created_at), 1, 10) AS day,
+           LOWER(TRIM(s.product)) AS product_key,
+           TRIM(s.product) AS product,
+           CASE WHEN s.customer_id IS NULL THEN 'walk-in'
+                ELSE COALESCE(NULLIF(LOWER(TRIM(c.customer_type)), ''), 'retail') END AS customer_type,
+           CASE WHEN s.customer_id IS NULL THEN 'name:' || LOWER(TRIM(s.customer_name))
+                ELSE 'id:' || s.customer_id END AS customer_key,
+           s.customer_id,
+           COALESCE(c.customer_name, TRIM(s.customer_name)) AS customer_name,
+           COALESCE(s.total_amount, 0) AS revenue,
+           COALESCE(s.quantity, 0) AS quantity
+    FROM sale s LEFT JOIN customer c ON c.id = s.customer_id
+'''
+
+
+def rebuild_sales_summary(cur):
+    """Rebuild sales_summary and sales_customer_daily from sale (set-based). Caller commits."""
+    cur.execute('DELETE FROM sales_summary')
+    cur.execute('DELETE FROM sales_customer_daily')
+    cur.execute(f'''
+        INSERT INTO sales_summary (day, product_key, customer_type, product, revenue, quantity, sales_count)
+        SELECT day, product_key, customer_type, MIN(product), SUM(revenue), SUM(quantity), COUNT(*)
+        FROM ({SALE_SUMMARY_SELECT}) GROUP BY day, product_key, customer_type
+    ''')
+    cur.execute(f'''
+        INSERT INTO sales_customer_daily (day, customer_key, customer_id, customer_name, customer_type, revenue, quantity, sales_count)
+        SELECT day, customer_key, MAX(customer_id), MIN(customer_name), MIN(customer_type), SUM(revenue), SUM(quantity), COUNT(*)
+        FROM ({SALE_SUMMARY_SELECT}) GROUP BY day, customer_key
+    ''')
+
+
+def ensure_sales_summary_schema(conn):
+    """
+    Sales analytics cube, maintained by deltas on every sale/customer write.
+    - sales_summary: revenue, quantity and count per (day, product, customer type)
+    - sales_customer_daily: the same measures per (day, customer) for top-N customer queries
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sales_summary (
+                day TEXT NOT NULL,
+                product_key TEXT NOT NULL,
+                customer_type TEXT NOT NULL,
+                product TEXT,
+                revenue REAL DEFAULT 0,
+                quantity REAL DEFAULT 0,
+                sales_count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, product_key, customer_type)
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sales_customer_daily (
+                day TEXT NOT NULL,
+                customer_key TEXT NOT NULL,
+                customer_id INTEGER,
+                customer_name TEXT,
+                customer_type TEXT,
+                revenue REAL DEFAULT 0,
+                quantity REAL DEFAULT 0,
+                sales_count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, customer_key)
+            )
+        ''')
+        cur.execute("SELECT 1 FROM sales_summary LIMIT 1")
+        if cur.fetchone() is None:
+            cur.execute("SELECT 1 FROM sale LIMIT 1")
+            if cur.fetchone():
+                rebuild_sales_summary(cur)
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_sales_summary_schema):", e)
+
+
+def parse_movement_reference(reference):
+    """
+    Split a stock movement reference as written by the check-in dialog ("From: Agro Ltd | Ref: PO-12")
+    into (party, purchase_ref). A bare reference is taken as the purchase ref; purchase refs are
+    normalised (trimmed, lower-case) so they match the reference typed on the expense.
+    """
+    party, code = None, None
+    for part in (reference or '').split('|'):
+        label, sep, value = part.partition(':')
+        label = label.strip().lower()
+        if sep and label in ('from', 'to'):
+            party = value.strip() or None
+        elif sep and label == 'ref':
+            code = value.strip()
+        elif part.strip() and code is None:
+            code = part.strip()
+    return party, (code.lower() if code else None)
+
+
+def supplier_id_by_name(cur, name):
+    if not name:
+        return None
+    cur.execute('SELECT id FROM supplier WHERE LOWER(TRIM(company_name)) = ? ORDER BY id LIMIT 1', (name.strip().lower(),))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def refresh_supplier_stats(cur, supplier_ids=None):
+    """
+    Recompute supplier.total_spent / order_count / last_order_date / delivery_lead_time /
+    reliability_score for the given suppliers (all when None). Caller commits.
+    Spend comes from expense rows in financial; deliveries from 'in' movements. A delivery's lead
+    time is the days between the first expense and the first receipt sharing its purchase_ref, and
+    reliability is the share of those deliveries that arrived within supplier.quoted_lead_time.
+    """
+    if supplier_ids is None:
+        cur.execute('SELECT id FROM supplier')
+        supplier_ids = [r[0] for r in cur.fetchall()]
+    for sid in sorted({int(i) for i in supplier_ids if i}):
+        cur.execute("SELECT COALESCE(SUM(amount), 0), MAX(" + FIN_DAY_EXPR + ") FROM financial "
+                    "WHERE supplier_id = ? AND txn_kind = 'expense'", (sid,))
+        spent, last_expense = cur.fetchone()
+        cur.execute("SELECT COUNT(DISTINCT COALESCE(purchase_ref, 'tx:' || id)), MAX(substr(created_at, 1, 10)) "
+                    "FROM inventory_transactions WHERE supplier_id = ? AND tx_type = 'in'", (sid,))
+        orders, last_receipt = cur.fetchone()
+        cur.execute(f'''
+            SELECT julianday(r.day) - julianday(f.day)
+            FROM (SELECT purchase_ref, MIN(substr(created_at, 1, 10)) AS day FROM inventory_transactions
+                  WHERE supplier_id = ? AND tx_type = 'in' AND purchase_ref IS NOT NULL GROUP BY purchase_ref) r
+            JOIN (SELECT purchase_ref, MIN({FIN_DAY_EXPR}) AS day FROM financial
+                  WHERE supplier_id = ? AND txn_kind = 'expense' AND purchase_ref IS NOT NULL GROUP BY purchase_ref) f
+              ON f.purchase_ref = r.purchase_ref
+            WHERE r.day >= f.day
+        ''', (sid, sid))
+        leads = [r[0] for r in cur.fetchall()]
+        cur.execute('SELECT quoted_lead_time FROM supplier WHERE id = ?', (sid,))
+        row = cur.fetchone()
+        if not row:
+            continue
+        quoted = row[0]
+        avg_lead = round(sum(leads) / len(leads), 1) if leads else None
+        reliability = round(100.0 * sum(1 for d in leads if d <= quoted) / len(leads), 1) if leads and quoted else None
+        cur.execute('''UPDATE supplier SET total_spent = ?, order_count = ?, last_order_date = ?,
+                       delivery_lead_time = ?, reliability_score = ? WHERE id = ?''',
+                    (spent, orders or 0, max(filter(None, (last_expense, last_receipt)), default=None),
+                     avg_lead, reliability, sid))
+
+
+def ensure_supplier_stats_schema(conn):
+    """
+    Supplier performance (the columns models.Supplier defines, on the raw tables).
+    - inventory_transactions / financial: supplier_id + purchase_ref, set when a receipt or expense is posted
+    - supplier: total_spent, order_count, last_order_date, delivery_lead_time, reliability_score
+      (maintained per touched supplier) and quoted_lead_time (entered on the supplier)
+    """
+    try:
+        cur = conn.cursor()
+        added = False
+        for table in ('inventory_transactions', 'financial'):
+            cur.execute(f"PRAGMA table_info({table})")
+            cols = {r[1] for r in cur.fetchall()}
+            if 'supplier_id' not in cols:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN supplier_id INTEGER REFERENCES supplier(id)")
+                added = True
+            if 'purchase_ref' not in cols:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN purchase_ref TEXT")
+                added = True
+        cur.execute("PRAGMA table_info(supplier)")
+        cols = {r[1] for r in cur.fetchall()}
+        for col, ddl in (('total_spent', 'REAL DEFAULT 0'), ('order_count', 'INTEGER DEFAULT 0'),
+                         ('last_order_date', 'DATE'), ('delivery_lead_time', 'REAL'),
+                         ('reliability_score', 'REAL'), ('quoted_lead_time', 'INTEGER')):
+            if col not in cols:
+                cur.execute(f"ALTER TABLE supplier ADD COLUMN {col} {ddl}")
+                print(f"✓ Added '{col}' column to supplier")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_inventory_tx_supplier ON inventory_transactions(supplier_id, purchase_ref)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_financial_supplier ON financial(supplier_id, purchase_ref)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_financial_purchase_ref ON financial(purchase_ref)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_supplier_name ON supplier(LOWER(TRIM(company_name)))")
+        if added:
+            # backfill from the references already on file
+            cur.execute("SELECT id, reference FROM inventory_transactions WHERE tx_type = 'in'")
+            for tx_id, reference in cur.fetchall():
+                party, ref = parse_movement_reference(reference)
+                cur.execute('UPDATE inventory_transactions SET supplier_id = ?, purchase_ref = ? WHERE id = ?',
+                            (supplier_id_by_name(cur, party), ref, tx_id))
+            cur.execute("UPDATE financial SET purchase_ref = LOWER(TRIM(reference)) WHERE TRIM(COALESCE(reference, '')) != ''")
+            cur.execute('''
+                UPDATE financial SET supplier_id = (
+                    SELECT MIN(t.supplier_id) FROM inventory_transactions t
+                    WHERE t.purchase_ref = financial.purchase_ref AND t.supplier_id IS NOT NULL)
+                WHERE txn_kind = 'expense' AND purchase_ref IS NOT NULL
+            ''')
+            refresh_supplier_stats(cur)
+            print("✓ Linked existing receipts and expenses to suppliers")
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_supplier_stats_schema):", e)
+
+
+def ensure_document_schema(conn):
+    """
+    Sale documents (invoices and receipts).
+    - document_counter: one row per series (e.g. INV-2026); numbers are taken by an UPDATE inside
+      the issuing transaction, so concurrent requests can never share a number
+    - sale_document: the number issued for each (sale, kind), so re-printing reuses it
+    - sale.invoice_number, as models.Sale defines
+    - idx_sale_date: month ranges for the invoice batch
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sale_date ON sale(sale_date)")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS document_counter (
+                series TEXT PRIMARY KEY,
+                last_value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sale_document (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sale_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                number TEXT NOT NULL UNIQUE,
+                issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (sale_id, kind)
+            )
+        ''')
+        cur.execute("PRAGMA table_info(sale)")
+        if 'invoice_number' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE sale ADD COLUMN invoice_number TEXT")
+            print("✓ Added 'invoice_number' column to sale")
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_document_schema):", e)
+
+
+def ensure_payroll_schema(conn):
+    """
+    Attendance and payroll.
+    - staff.salary: monthly base pay (models.Staff.salary)
+    - attendance: one row per (staff_id, work_date), clock-in/out times and the hours between them
+    - pay_run / payslip: a month's payroll computed once and stored; triggers keep both immutable
+      (a run can only be voided, which frees its period for a new run)
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(staff)")
+        if 'salary' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE staff ADD COLUMN salary REAL DEFAULT 0")
+            print("✓ Added 'salary' column to staff")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS attendance (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                staff_id INTEGER NOT NULL REFERENCES staff(id),
+                work_date DATE NOT NULL,
+                status TEXT NOT NULL DEFAULT 'present',
+                clock_in TEXT,
+                clock_out TEXT,
+                hours REAL DEFAULT 0,
+                notes TEXT,
+                UNIQUE (staff_id, work_date)
+            )
+        ''')
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(work_date)")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS pay_run (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                period TEXT NOT NULL,
+                working_days INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'final',
+                created_by TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_pay_run_period ON pay_run(period) WHERE status != 'void'")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS payslip (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pay_run_id INTEGER NOT NULL REFERENCES pay_run(id),
+                staff_id INTEGER NOT NULL,
+                staff_name TEXT,
+                position TEXT,
+                department TEXT,
+                base_salary REAL DEFAULT 0,
+                days_present INTEGER DEFAULT 0,
+                days_leave INTEGER DEFAULT 0,
+                days_absent INTEGER DEFAULT 0,
+                hours_worked REAL DEFAULT 0,
+                overtime_hours REAL DEFAULT 0,
+                overtime_pay REAL DEFAULT 0,
+                absence_deduction REAL DEFAULT 0,
+                gross_pay REAL DEFAULT 0,
+                net_pay REAL DEFAULT 0,
+                UNIQUE (pay_run_id, staff_id)
+            )
+        ''')
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_payslip_staff ON payslip(staff_id)")
+        for name, sql in (
+            ('payslip_no_update', "BEFORE UPDATE ON payslip BEGIN SELECT RAISE(ABORT, 'payslips are immutable'); END"),
+            ('payslip_no_delete', "BEFORE DELETE ON payslip BEGIN SELECT RAISE(ABORT, 'payslips are immutable'); END"),
+            ('pay_run_no_delete', "BEFORE DELETE ON pay_run BEGIN SELECT RAISE(ABORT, 'pay runs are immutable'); END"),
+            ('pay_run_void_only', "BEFORE UPDATE ON pay_run WHEN NEW.period != OLD.period OR NEW.working_days != OLD.working_days "
+                                  "OR NEW.status != 'void' BEGIN SELECT RAISE(ABORT, 'pay runs can only be voided'); END"),
+        ):
+            cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {sql}")
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_payroll_schema):", e)
+
+
+TASK_SCHEDULE_HORIZON_DAYS = 14    # recurring tasks are materialised this far ahead
+TASK_FREQUENCIES = ('daily', 'weekly', 'monthly')
+DEFAULT_TASK_TEMPLATES = [
+    # title, description, category, frequency, interval, weekday (0 = Monday), day_of_month
+    ('Morning milking', 'Milk the herd and record yields', 'milking', 'daily', 1, None, None),
+    ('Feed animals', 'Morning feeding', 'feeding', 'daily', 1, None, None),
+    ('Cattle dipping', 'Weekly tick control dip', 'health', 'weekly', 1, 0, None),
+]
+
+
+def task_template_dates(tpl, start, end):
+    """Due dates of a template falling within [start, end]."""
+    anchor = date.fromisoformat(tpl['start_date'])
+    if tpl['end_date']:
+        end = min(end, date.fromisoformat(tpl['end_date']))
+    start = max(start, anchor)
+    if start > end:
+        return []
+    step = max(int(tpl['interval'] or 1), 1)
+    if tpl['frequency'] == 'monthly':
+        out, month = [], start.replace(day=1)
+        while month <= end:
+            nxt = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+            due = month.replace(day=min(int(tpl['day_of_month'] or anchor.day), (nxt - timedelta(days=1)).day))
+            if start <= due <= end:
+                out.append(due)
+            month = nxt
+        return out
+    if tpl['frequency'] == 'weekly':
+        anchor += timedelta(days=((tpl['weekday'] if tpl['weekday'] is not None else anchor.weekday()) - anchor.weekday()) % 7)
+        step *= 7
+    # jump straight to the first occurrence on/after start
+    first = anchor + timedelta(days=-(-max((start - anchor).days, 0) // step) * step)
+    return [first + timedelta(days=i) for i in range(0, (end - first).days + 1, step)]
+
+
+def expand_task_templates(cur, today=None, template_ids=None):
+    """
+    Materialise active templates into task rows up to TASK_SCHEDULE_HORIZON_DAYS ahead in one
+    executemany. The (template_id, due_date) unique index makes re-running harmless. Caller commits.
+    Returns the number of new tasks.
+    """
+    today = today or date.today()
+    horizon = today + timedelta(days=TASK_SCHEDULE_HORIZON_DAYS)
+    sql = 'SELECT * FROM task_template WHERE active = 1 AND (generated_until IS NULL OR generated_until < ?)'
+    params = [horizon.isoformat()]
+    if template_ids:
+        sql += ' AND id IN (' + ','.join('?' for _ in template_ids) + ')'
+        params += list(template_ids)
+    cur.execute(sql, params)
+    rows, done = [], []
+    for tpl in cur.fetchall():
+        start = today
+        if tpl['generated_until']:
+            start = max(start, date.fromisoformat(tpl['generated_until']) + timedelta(days=1))
+        rows += [(tpl['title'], tpl['description'], tpl['assigned_to'], 'Pending', tpl['priority'] or 'Normal',
+                  due.isoformat(), tpl['category'] or 'general', tpl['id'])
+                 for due in task_template_dates(tpl, start, horizon)]
+        done.append((horizon.isoformat(), tpl['id']))
+    if not done:
+        return 0  # nothing due: stay out of a write transaction
+    cur.executemany('''INSERT OR IGNORE INTO task (title, description, assigned_to, status, priority, due_date, category, template_id)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    added = max(cur.rowcount, 0)  # rows actually inserted; unlike total_changes it leaves out trigger writes
+    cur.executemany('UPDATE task_template SET generated_until = ? WHERE id = ?', done)
+    return added
+
+
+def ensure_task_schedule_schema(conn):
+    """
+    Recurring tasks.
+    - task_template: daily / weekly / monthly jobs, expanded into task rows ahead of time
+    - task.template_id with a unique (template_id, due_date) index so each occurrence exists once
+    - idx_task_status_due: covers the board's status counts and the overdue scan
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'task_template'")
+        is_new = cur.fetchone() is None
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS task_template (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                description TEXT,
+                assigned_to TEXT,
+                priority TEXT DEFAULT 'Normal',
+                category TEXT DEFAULT 'general',
+                frequency TEXT NOT NULL DEFAULT 'daily',
+                interval INTEGER NOT NULL DEFAULT 1,
+                weekday INTEGER,
+                day_of_month INTEGER,
+                start_date DATE NOT NULL,
+                end_date DATE,
+                active INTEGER NOT NULL DEFAULT 1,
+                generated_until DATE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute("PRAGMA table_info(task)")
+        if 'template_id' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE task ADD COLUMN template_id INTEGER REFERENCES task_template(id)")
+            print("✓ Added 'template_id' column to task")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_task_template_due ON task(template_id, due_date) WHERE template_id IS NOT NULL")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_task_status_due ON task(status, due_date)")
+        if is_new:
+            today = date.today().isoformat()
+            cur.executemany('''INSERT INTO task_template (title, description, category, frequency, interval, weekday, day_of_month, start_date)
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                            [t + (today,) for t in DEFAULT_TASK_TEMPLATES])
+        expand_task_templates(cur)
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_task_schedule_schema):", e)
+
+
+def _staff_match_sql(value):
+    """Scalar subquery resolving free-text assigned_to (a staff id or a staff name) to staff.id."""
+    return f'''COALESCE(
+        (SELECT s.id FROM staff s WHERE CAST(s.id AS TEXT) = TRIM({value})),
+        (SELECT MIN(s.id) FROM staff s
+         WHERE LOWER(TRIM(s.first_name || ' ' || COALESCE(s.last_name, ''))) = LOWER(TRIM({value}))
+            OR LOWER(s.first_name) = LOWER(TRIM({value}))))'''
+
+
+def refresh_staff_workload(cur, today=None):
+    """
+    Recompute the staff_workload rows that the task triggers marked stale (as_of NULL) plus any
+    from an earlier day, since the overdue and this-week windows move with the date. Every other
+    row is served as stored. Caller commits. Returns the number of rows refreshed.
+    """
+    today = today or date.today()
+    week_start = today - timedelta(days=today.weekday())
+    # the common case is nothing stale; checking first keeps read-only pages out of the write lock
+    cur.execute('SELECT EXISTS (SELECT 1 FROM staff_workload WHERE as_of IS NULL OR as_of < ?)', (today.isoformat(),))
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute('''
+        UPDATE staff_workload SET
+            open_tasks = (SELECT COUNT(*) FROM task WHERE assigned_staff_id = staff_workload.staff_id
+                          AND status IN ('Pending', 'In Progress')),
+            overdue_tasks = (SELECT COUNT(*) FROM task WHERE assigned_staff_id = staff_workload.staff_id
+                             AND status IN ('Pending', 'In Progress') AND due_date < ?),
+            completed_week = (SELECT COUNT(*) FROM task WHERE assigned_staff_id = staff_workload.staff_id
+                              AND status = 'Completed' AND completed_at >= ?),
+            as_of = ?
+        WHERE as_of IS NULL OR as_of < ?
+    ''', (today.isoformat(), week_start.isoformat(), today.isoformat(), today.isoformat()))
+    return cur.rowcount
+
+
+def ensure_task_workload_schema(conn):
+    """
+    Task assignment as a staff foreign key, plus a per-staff workload summary.
+    - task.assigned_staff_id: resolved from the free-text assigned_to (ids or names) by triggers on
+      every insert/update, so all writers (forms, bulk API, recurring templates) stay in step;
+      role labels such as 'manager' resolve to NULL and keep displaying as text
+    - task.completed_at: stamped by trigger when a task moves to Completed
+    - staff_workload: open / overdue / completed-this-week per staff member; task triggers mark the
+      affected rows stale and refresh_staff_workload() recomputes only those
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(task)")
+        cols = {r[1] for r in cur.fetchall()}
+        if 'assigned_staff_id' not in cols:
+            cur.execute("ALTER TABLE task ADD COLUMN assigned_staff_id INTEGER REFERENCES staff(id)")
+            print("✓ Added 'assigned_staff_id' column to task")
+        if 'completed_at' not in cols:
+            cur.execute("ALTER TABLE task ADD COLUMN completed_at TIMESTAMP")
+            print("✓ Added 'completed_at' column to task")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_task_assignee ON task(assigned_staff_id, status, due_date, completed_at)")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS staff_workload (
+                staff_id INTEGER PRIMARY KEY REFERENCES staff(id),
+                open_tasks INTEGER NOT NULL DEFAULT 0,
+                overdue_tasks INTEGER NOT NULL DEFAULT 0,
+                completed_week INTEGER NOT NULL DEFAULT 0,
+                as_of DATE
+            )
+        ''')
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_task_assignee_insert AFTER INSERT ON task
+            BEGIN
+                UPDATE task SET assigned_staff_id = COALESCE(NEW.assigned_staff_id, {_staff_match_sql('NEW.assigned_to')}),
+                                completed_at = CASE WHEN NEW.status = 'Completed' THEN COALESCE(NEW.completed_at, CURRENT_TIMESTAMP) END
+                WHERE id = NEW.id;
+                UPDATE staff_workload SET as_of = NULL WHERE staff_id = NEW.assigned_staff_id;
+            END
+        ''')
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_task_assignee_update AFTER UPDATE OF assigned_to ON task
+            WHEN NEW.assigned_to IS NOT OLD.assigned_to
+            BEGIN
+                UPDATE task SET assigned_staff_id = {_staff_match_sql('NEW.assigned_to')} WHERE id = NEW.id;
+            END
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_task_completed_at AFTER UPDATE OF status ON task
+            WHEN NEW.status IS NOT OLD.status
+            BEGIN
+                UPDATE task SET completed_at = CASE WHEN NEW.status = 'Completed' THEN CURRENT_TIMESTAMP END WHERE id = NEW.id;
+            END
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_task_workload_update
+            AFTER UPDATE OF assigned_staff_id, status, due_date, completed_at ON task
+            BEGIN
+                UPDATE staff_workload SET as_of = NULL WHERE staff_id IN (OLD.assigned_staff_id, NEW.assigned_staff_id);
+            END
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_task_workload_delete AFTER DELETE ON task
+            BEGIN
+                UPDATE staff_workload SET as_of = NULL WHERE staff_id = OLD.assigned_staff_id;
+            END
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_staff_workload_insert AFTER INSERT ON staff
+            BEGIN
+                INSERT OR IGNORE INTO staff_workload (staff_id) VALUES (NEW.id);
+            END
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_staff_workload_delete AFTER DELETE ON staff
+            BEGIN
+                UPDATE task SET assigned_staff_id = NULL WHERE assigned_staff_id = OLD.id;
+                DELETE FROM staff_workload WHERE staff_id = OLD.id;
+            END
+        ''')
+        # backfill rows written before the triggers existed
+        cur.execute(f"UPDATE task SET assigned_staff_id = {_staff_match_sql('task.assigned_to')} "
+                    "WHERE assigned_staff_id IS NULL AND assigned_to IS NOT NULL AND TRIM(assigned_to) != ''")
+        cur.execute("INSERT OR IGNORE INTO staff_workload (staff_id) SELECT id FROM staff")
+        refresh_staff_workload(cur)
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_task_workload_schema):", e)
+
+
+def ensure_profiling_schema(conn):
+    """profiling_state: the single row behind /settings/profiling (armed captures + sampler switch)."""
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS profiling_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                pattern TEXT,
+                remaining INTEGER NOT NULL DEFAULT 0,
+                sampling INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('INSERT OR IGNORE INTO profiling_state (id) VALUES (1)')
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_profiling_schema):", e)
+
+
+def _data_version_triggers(cur, table):
+    """CREATE TRIGGER statements bumping `table`'s version; updates that change no column do not count."""
+    cur.execute(f'PRAGMA table_info("{table}")')
+    changed = ' OR '.join(f'OLD."{r[1]}" IS NOT NEW."{r[1]}"' for r in cur.fetchall())
+    bump = f"UPDATE data_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE table_name = '{table}';"
+    return {
+        f'trg_dv_{table}_insert': f'CREATE TRIGGER "trg_dv_{table}_insert" AFTER INSERT ON "{table}" BEGIN {bump} END',
+        f'trg_dv_{table}_update': f'CREATE TRIGGER "trg_dv_{table}_update" AFTER UPDATE ON "{table}" WHEN {changed} BEGIN {bump} END',
+        f'trg_dv_{table}_delete': f'CREATE TRIGGER "trg_dv_{table}_delete" AFTER DELETE ON "{table}" BEGIN {bump} END',
+    }
+
+
+def ensure_data_version_schema(conn, tables=None):
+    """
+    data_version: one counter (and last write time) per table, bumped by AFTER INSERT/UPDATE/DELETE triggers. Runs last
+    in init_database() so every table created above gets its triggers. The update trigger lists the
+    table's columns (so no-op maintenance UPDATEs keep cached pages); a trigger whose SQL no longer
+    matches the columns is recreated.
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS data_version (
+                table_name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP
+            )
+        ''')
+        cur.execute("PRAGMA table_info(data_version)")
+        if 'updated_at' not in {r[1] for r in cur.fetchall()}:
+            cur.execute("ALTER TABLE data_version ADD COLUMN updated_at TIMESTAMP")
+        if tables is None:
+            cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+            tables = [r[0] for r in cur.fetchall() if r[0] not in DATA_VERSION_EXCLUDE]
+        cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_dv_%'")
+        existing = dict(cur.fetchall())
+        for table in tables:
+            cur.execute('INSERT OR IGNORE INTO data_version (table_name) VALUES (?)', (table,))
+            for name, sql in _data_version_triggers(cur, table).items():
+                if existing.get(name) != sql:
+                    cur.execute(f'DROP TRIGGER IF EXISTS "{name}"')
+                    cur.execute(sql)
+        conn.commit()
+    except Exception as e:
+        print("Warning (ensure_data_version_schema):", e)
+
+
+def ensure_journal_mode(conn):
+    """Switch the database file to DB_JOURNAL_MODE (persistent; WAL lets reads proceed during a write)."""
+    if DB_JOURNAL_MODE.lower() not in ('delete', 'truncate', 'persist', 'wal'):
+        print(f"Warning (ensure_journal_mode): unsupported DB_JOURNAL_MODE {DB_JOURNAL_MODE!r}")
+        return
+    try:
+        mode = conn.execute(f'PRAGMA journal_mode = {DB_JOURNAL_MODE}').fetchone()[0]
+        if mode.lower() != DB_JOURNAL_MODE.lower():
+            print(f"Warning (ensure_journal_mode): journal_mode is {mode}, not {DB_JOURNAL_MODE}")
+    except Exception as e:
+        print("Warning (ensure_journal_mode):", e)
+
+
 def init_database():
     conn = get_db_connection()
+    ensure_journal_mode(conn)
     cur = conn.cursor()
     try:
         cur.execute('SELECT id, first_name, last_name FROM staff ORDER BY first_name')
@@ -282,6 +1883,22 @@ def init_database():
 
     # ensure reports table exists
     ensure_reports_table(conn)
+    ensure_medical_followup_schema(conn)
+    ensure_animal_profile_indexes(conn)
+    ensure_feed_analytics_schema(conn)
+    ensure_feed_stock_schema(conn)
+    ensure_inventory_reorder_schema(conn)
+    ensure_general_ledger_schema(conn)
+    ensure_sales_posting_schema(conn)
+    ensure_customer_ledger_schema(conn)
+    ensure_sales_summary_schema(conn)
+    ensure_supplier_stats_schema(conn)
+    ensure_document_schema(conn)
+    ensure_payroll_schema(conn)
+    ensure_task_schedule_schema(conn)
+    ensure_task_workload_schema(conn)
+    ensure_profiling_schema(conn)
+    ensure_data_version_schema(conn)
 
     # add default users if none
     cur.execute('SELECT COUNT(*) FROM user')
@@ -502,11 +2119,21 @@ def logout():
 
 
 # ----- Dashboard -----
+DASHBOARD_TABLES = ('animal', 'sale', 'task', 'staff', 'inventory_low_stock', 'financial', 'feed', 'medical')
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
+    context = cached('dashboard', DASHBOARD_TABLES, _dashboard_context)
+    return render_template('dashboard.html', **context,
+                           user_role=current_user.role,
+                           username=current_user.username)
+
+
+def _dashboard_context():
     """
-    Dashboard route: robustly computes KPIs and time-series used by dashboard.html.
+    Computes the KPIs and time-series used by dashboard.html (cached by dashboard()).
     - Safely handles variations in column names / transaction_date vs created_at, transaction_type casing, and negative amounts.
     - Returns exactly the same template variables as before so other code remains unchanged.
     """
@@ -540,6 +2167,12 @@ def dashboard():
     except Exception:
         total_staff = 0
 
+    try:
+        cur.execute('SELECT COUNT(*) FROM inventory_low_stock')
+        low_stock_count = cur.fetchone()[0] or 0
+    except Exception:
+        low_stock_count = 0
+
     # --- Date range (same behaviour as before) ---
     start_q = request.args.get('start', '').strip()
     end_q = request.args.get('end', '').strip()
@@ -636,16 +2269,9 @@ def dashboard():
         except Exception:
             return {}
 
-    # --- Financial totals: robust type matching (shared label lists) ---
-    income_labels = ("income", "sale", "sales", "payment", "payment_received", "receipt")
-    expense_labels = ("expense", "purchase", "purchases", "cost", "payment_made", "expense_paid")
-
-    # build SQL-friendly lists for IN(...) clause (safe because labels are static)
-    income_list_sql = ",".join(f"'{lab}'" for lab in income_labels)
-    expense_list_sql = ",".join(f"'{lab}'" for lab in expense_labels)
-
-    income_where = f"LOWER(TRIM(transaction_type)) IN ({income_list_sql})"
-    expense_where = f"LOWER(TRIM(transaction_type)) IN ({expense_list_sql})"
+    # --- Financial totals: txn_kind is normalized at write time (see financial_txn_kind) ---
+    income_where = "txn_kind = 'income'"
+    expense_where = "txn_kind = 'expense'"
 
     try:
         # use the new helper which prefers transaction_date then created_at and uses COALESCE(NULLIF(...),'')
@@ -717,11 +2343,11 @@ def dashboard():
 
     conn.close()
 
-    return render_template('dashboard.html',
-                           total_animals=total_animals,
+    return dict(total_animals=total_animals,
                            total_sales=total_sales,
                            pending_tasks=pending_tasks,
                            total_staff=total_staff,
+                           low_stock_count=low_stock_count,
                            days=days,
                            income_series=income_series,
                            expense_series=expense_series,
@@ -733,9 +2359,7 @@ def dashboard():
                            total_income=total_income,
                            start_date=start_dt.isoformat(),
                            end_date=end_dt.isoformat(),
-                           total_expense=total_expense,
-                           user_role=current_user.role,
-                           username=current_user.username)
+                           total_expense=total_expense)
 # --- BEGIN fixed single safe generate_report implementation (paste into app.py routes area) ---
 import os
 import csv
@@ -827,6 +2451,161 @@ def view_animal(animal_id):
     if not animal:
         flash('Animal not found.', 'error'); return redirect(url_for('animals'))
     return render_template('animal_view.html', animal=animal)
+
+
+# --- Animal profile (medical, breeding, production, feed and sales for one animal) ---
+class AnimalProfileCache:
+    """
+    Small LRU of built animal profiles keyed by tag.
+    Each entry is stamped with the day and the data versions of the tables a profile reads, so a
+    write to any of them (from any worker) retires it, and so does midnight (the profile's
+    withdrawal status depends on today's date). Write handlers also call invalidate(tag) (or
+    invalidate() when the affected animal is not known) so the change shows within the same request.
+    """
+
+    tables = ('animal', 'livestock', 'medical', 'breeding', 'production', 'feed', 'sale')
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _stamp(self):
+        return date.today().isoformat(), data_versions(self.tables)
+
+    def get(self, tag):
+        key = _animal_key(tag)
+        versions = self._stamp()
+        with self._lock:
+            hit = self._entries.get(key)
+            if not hit:
+                return None
+            stored_versions, data = hit
+            if stored_versions != versions:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, tag, data):
+        key = _animal_key(tag)
+        versions = self._stamp()
+        with self._lock:
+            self._entries[key] = (versions, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            if not tags:
+                self._entries.clear()
+                return
+            for tag in tags:
+                self._entries.pop(_animal_key(tag), None)
+
+
+animal_profile_cache = AnimalProfileCache()
+
+
+def _animal_groups(tag, pen_number=None):
+    """Feed is recorded per animal group: the animal's herd/category plus its pen, if any."""
+    groups = [name for name, tags in get_animals_map().items() if tag in tags]
+    if pen_number:
+        groups.append(str(pen_number))
+    return groups
+
+
+def build_animal_profile(animal):
+    """
+    Batched query plan for one animal: a single indexed query per related table, keyed by tag
+    (medical.animal_id, breeding.female_id/male_id, production.animal_tag, feed.animal_group,
+    sale.animal_tag). The lists are capped for display; totals come from aggregate queries over the
+    full history. Returns plain dicts so the result can be cached and served as JSON.
+    """
+    animal = dict(animal)
+    tag = animal.get('tag_number')
+    cached = animal_profile_cache.get(tag)
+    if cached is not None:
+        return cached
+
+    groups = _animal_groups(tag, animal.get('pen_number'))
+    profile = {'animal': animal, 'groups': groups}
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        totals = profile['totals'] = {}
+        cur.execute('SELECT * FROM medical WHERE animal_id = ? ORDER BY treatment_date DESC LIMIT 100', (tag,))
+        profile['medical'] = rows_to_dicts(cur.fetchall())
+        cur.execute('SELECT COUNT(*) FROM medical WHERE animal_id = ?', (tag,))
+        totals['treatments'] = cur.fetchone()[0]
+
+        cur.execute('''
+            SELECT *, 'dam' AS role FROM breeding WHERE female_id = ?
+            UNION ALL
+            SELECT *, 'sire' AS role FROM breeding WHERE male_id = ? AND female_id != ?
+            ORDER BY breeding_date DESC LIMIT 100
+        ''', (tag, tag, tag))
+        profile['breeding'] = rows_to_dicts(cur.fetchall())
+        cur.execute('SELECT (SELECT COUNT(*) FROM breeding WHERE female_id = ?) + '
+                    '(SELECT COUNT(*) FROM breeding WHERE male_id = ? AND female_id != ?)', (tag, tag, tag))
+        totals['breedings'] = cur.fetchone()[0]
+
+        try:
+            cur.execute('SELECT * FROM production WHERE animal_tag = ? ORDER BY production_date DESC LIMIT 100', (tag,))
+            profile['production'] = rows_to_dicts(cur.fetchall())
+            cur.execute('''SELECT COALESCE(SUM(COALESCE(NULLIF(quantity, 0), liters, 0)), 0) FROM production
+                           WHERE LOWER(COALESCE(NULLIF(production_type, ''), 'milk')) = 'milk' AND animal_tag = ?''', (tag,))
+            totals['milk'] = float(cur.fetchone()[0])
+        except sqlite3.OperationalError:
+            # production table not created yet on this database
+            profile['production'] = []
+            totals['milk'] = 0.0
+
+        if groups:
+            marks = ','.join('?' for _ in groups)
+            cur.execute(f'SELECT * FROM feed WHERE animal_group IN ({marks}) ORDER BY created_at DESC LIMIT 50', tuple(groups))
+            profile['feed'] = rows_to_dicts(cur.fetchall())
+        else:
+            profile['feed'] = []
+
+        cur.execute('SELECT * FROM sale WHERE animal_tag = ? ORDER BY sale_date DESC LIMIT 50', (tag,))
+        profile['sales'] = rows_to_dicts(cur.fetchall())
+        cur.execute('SELECT COALESCE(SUM(total_amount), 0) FROM sale WHERE animal_tag = ?', (tag,))
+        totals['sales'] = float(cur.fetchone()[0])
+    finally:
+        conn.close()
+
+    profile['withdrawal_until'] = withdrawal_index.active_until(tag)
+    animal_profile_cache.put(tag, profile)
+    return profile
+
+
+def _load_animal_or_none(animal_id):
+    conn = get_db_connection(); cur = conn.cursor()
+    cur.execute('SELECT * FROM animal WHERE id = ?', (animal_id,)); animal = cur.fetchone(); conn.close()
+    return animal
+
+
+@app.route('/animals/<int:animal_id>/profile')
+@login_required
+def animal_profile(animal_id):
+    if current_user.role not in ['admin', 'manager']:
+        flash('Access denied.', 'error'); return redirect(url_for('animals'))
+    animal = _load_animal_or_none(animal_id)
+    if not animal:
+        flash('Animal not found.', 'error'); return redirect(url_for('animals'))
+    return render_template('animal_profile.html', profile=build_animal_profile(animal))
+
+
+@app.route('/api/animals/<int:animal_id>/profile')
+@login_required
+def api_animal_profile(animal_id):
+    if current_user.role not in ['admin', 'manager']:
+        return jsonify({'ok': False, 'error': 'Access denied.'}), 403
+    animal = _load_animal_or_none(animal_id)
+    if not animal:
+        return jsonify({'ok': False, 'error': 'Animal not found.'}), 404
+    return jsonify({'ok': True, 'profile': build_animal_profile(animal)})
 # --- Delete animal route (add to app.py) ---
 @app.route('/animal/delete/<int:animal_id>', methods=['POST'])
 @login_required
@@ -850,6 +2629,7 @@ def delete_animal(animal_id):
         # check or cascade; here we simply attempt the delete
         cur.execute("DELETE FROM animal WHERE id = ?", (animal_id,))
         conn.commit()
+        animal_profile_cache.invalidate(row['tag_number'])
         flash(f'Animal A-{animal_id} deleted successfully', 'success')
         app.logger.info("Deleted animal id=%s by user=%s", animal_id, current_user.username)
     except Exception as e:
@@ -874,7 +2654,7 @@ def edit_animal(animal_id):
             cur.execute('UPDATE animal SET tag_number=?, breed=?, birth_date=?, weight=?, status=?, pen_number=?, health_status=? WHERE id=?',
                         (request.form.get('tag_number', '').strip(), request.form.get('breed', '').strip(), request.form.get('birth_date'),
                          float(request.form.get('weight') or 0), request.form.get('status', 'Active'), request.form.get('pen_number', ''), request.form.get('health_status', 'Good'), animal_id))
-            conn.commit(); flash('Animal updated!', 'success')
+            conn.commit(); animal_profile_cache.invalidate(); flash('Animal updated!', 'success')
         except Exception as e:
             flash(f'Error updating animal: {e}', 'error')
         finally:
@@ -909,17 +2689,154 @@ def add_animal():
 
 
 # ----- Sales -----
+# --- every sale owns one income row in financial (reference SALE-<id>), written in the sale's transaction ---
+SALE_REF_PREFIX = 'SALE-'
+SALE_FINANCIAL_CATEGORY = 'Sales'
+
+
+def sale_reference(sale_id):
+    return f'{SALE_REF_PREFIX}{sale_id}'
+
+
+def sync_sale_financial(cur, sale_id):
+    """
+    Post, re-post or reverse the financial entry for a sale on the caller's cursor (caller commits).
+    A deleted sale reverses its entry; otherwise the entry is created or brought in line with the sale.
+    """
+    ref = sale_reference(sale_id)
+    cur.execute('SELECT id FROM financial WHERE reference = ?', (ref,))
+    existing = [r[0] for r in cur.fetchall()]
+    cur.execute('SELECT id, customer_name, product, quantity, total_amount, sale_date FROM sale WHERE id = ?', (sale_id,))
+    sale = cur.fetchone()
+    if not sale:
+        for fid in existing:
+            unpost_financial(cur, fid)
+            cur.execute('DELETE FROM financial WHERE id = ?', (fid,))
+        return None
+    description = f"Sale S-{sale_id}: {sale['quantity']} x {sale['product']} to {sale['customer_name']}"
+    values = (sale['total_amount'] or 0, description, sale['sale_date'])
+    if existing:
+        fid = existing[0]
+        cur.execute('''UPDATE financial SET transaction_type = 'income', txn_kind = 'income', amount = ?, category = ?,
+                       description = ?, transaction_date = ? WHERE id = ?''',
+                    (values[0], SALE_FINANCIAL_CATEGORY, values[1], values[2], fid))
+        for dup in existing[1:]:
+            unpost_financial(cur, dup)
+            cur.execute('DELETE FROM financial WHERE id = ?', (dup,))
+    else:
+        cur.execute('''INSERT INTO financial (transaction_type, txn_kind, amount, category, description, transaction_date, reference)
+                       VALUES ('income', 'income', ?, ?, ?, ?, ?)''',
+                    (values[0], SALE_FINANCIAL_CATEGORY, values[1], values[2], ref))
+        fid = cur.lastrowid
+    post_financial(cur, fid)
+    return fid
+
+
+def resolve_sale_customer(cur, customer_name):
+    """customer.id for a sale's customer name (case-insensitive), or None for walk-in / unknown customers."""
+    name = (customer_name or '').strip().lower()
+    if not name:
+        return None
+    cur.execute('SELECT MIN(id) FROM customer WHERE LOWER(TRIM(customer_name)) = ?', (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _sale_payment_status(form):
+    status = (form.get('payment_status') or 'Pending').strip().title()
+    return status if status in ('Pending', 'Paid') else 'Pending'
+
+
+def sale_summary_snapshot(cur, sale_ids):
+    """Current cube attributes of the given sales (take one before and one after a write)."""
+    sale_ids = [int(i) for i in sale_ids if i]
+    if not sale_ids:
+        return []
+    cur.execute(SALE_SUMMARY_SELECT + ' WHERE s.id IN (' + ','.join('?' for _ in sale_ids) + ')', sale_ids)
+    return cur.fetchall()
+
+
+def apply_sale_summary(cur, rows, sign):
+    """Add (sign=1) or remove (sign=-1) sale snapshot rows from the summary tables. Caller commits."""
+    for r in rows:
+        cur.execute('''
+            INSERT INTO sales_summary (day, product_key, customer_type, product, revenue, quantity, sales_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day, product_key, customer_type) DO UPDATE SET
+                revenue = revenue + excluded.revenue, quantity = quantity + excluded.quantity,
+                sales_count = sales_count + excluded.sales_count
+        ''', (r['day'], r['product_key'], r['customer_type'], r['product'], sign * r['revenue'], sign * r['quantity'], sign))
+        cur.execute('''
+            INSERT INTO sales_customer_daily (day, customer_key, customer_id, customer_name, customer_type, revenue, quantity, sales_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day, customer_key) DO UPDATE SET
+                customer_name = excluded.customer_name, customer_type = excluded.customer_type,
+                revenue = revenue + excluded.revenue, quantity = quantity + excluded.quantity,
+                sales_count = sales_count + excluded.sales_count
+        ''', (r['day'], r['customer_key'], r['customer_id'], r['customer_name'], r['customer_type'],
+              sign * r['revenue'], sign * r['quantity'], sign))
+        if sign < 0:
+            cur.execute('DELETE FROM sales_summary WHERE day = ? AND product_key = ? AND customer_type = ? AND sales_count <= 0',
+                        (r['day'], r['product_key'], r['customer_type']))
+            cur.execute('DELETE FROM sales_customer_daily WHERE day = ? AND customer_key = ? AND sales_count <= 0',
+                        (r['day'], r['customer_key']))
+
+
+def reconcile_sales_ledger(cur, fix=False):
+    """
+    Diff sale against financial by reference. Returns {'missing', 'mismatched', 'orphaned'} lists;
+    with fix=True each discrepancy is repaired through sync_sale_financial (caller commits).
+    """
+    cur.execute(f'''
+        SELECT s.id AS sale_id, s.total_amount, s.sale_date, f.id AS financial_id, f.amount, f.transaction_date
+        FROM sale s
+        LEFT JOIN financial f ON f.reference = '{SALE_REF_PREFIX}' || s.id
+        WHERE f.id IS NULL OR ABS(COALESCE(f.amount, 0) - COALESCE(s.total_amount, 0)) > 0.005
+           OR COALESCE(f.transaction_date, '') != COALESCE(s.sale_date, '') OR f.txn_kind != 'income'
+    ''')
+    rows = rows_to_dicts(cur.fetchall())
+    report = {
+        'missing': [r for r in rows if r['financial_id'] is None],
+        'mismatched': [r for r in rows if r['financial_id'] is not None],
+    }
+    # SALE-... references sort between 'SALE-' and 'SALE.', so this is a range scan on idx_financial_reference;
+    # each is checked with a rowid lookup on its numeric tail (the string comparison rejects tails like '12abc')
+    cur.execute(f'''
+        SELECT f.id AS financial_id, f.reference, f.amount FROM financial f
+        WHERE f.reference >= '{SALE_REF_PREFIX}' AND f.reference < 'SALE.'
+          AND NOT EXISTS (SELECT 1 FROM sale s WHERE s.id = CAST(substr(f.reference, {len(SALE_REF_PREFIX) + 1}) AS INTEGER)
+                                                  AND '{SALE_REF_PREFIX}' || s.id = f.reference)
+    ''')
+    report['orphaned'] = rows_to_dicts(cur.fetchall())
+    if fix:
+        sale_ids = {r['sale_id'] for r in report['missing'] + report['mismatched']}
+        for r in report['orphaned']:
+            tail = r['reference'][len(SALE_REF_PREFIX):]
+            if tail.isdigit():
+                sale_ids.add(int(tail))
+            else:
+                unpost_financial(cur, r['financial_id'])
+                cur.execute('DELETE FROM financial WHERE id = ?', (r['financial_id'],))
+        for sale_id in sorted(sale_ids):
+            sync_sale_financial(cur, sale_id)
+    return report
+
+
 @app.route('/sales')
 @login_required
+@conditional_view('sale', 'customer', roles=('admin', 'accountant'))
 def sales():
     if current_user.role not in ['admin', 'accountant']:
         flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
-    conn = get_db_connection(); cur = conn.cursor()
-    cur.execute('SELECT * FROM sale ORDER BY sale_date DESC'); sales = cur.fetchall()
-    cur.execute('SELECT SUM(total_amount) FROM sale'); total_revenue = cur.fetchone()[0] or 0
-    cur.execute('SELECT COUNT(*) FROM sale'); total_sales = cur.fetchone()[0] or 0
-    conn.close()
-    return render_template('sales.html', sales=sales, total_revenue=total_revenue, total_sales=total_sales)
+    def build():
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute('SELECT * FROM sale ORDER BY sale_date DESC'); sales = rows_to_dicts(cur.fetchall())
+        cur.execute('SELECT SUM(total_amount) FROM sale'); total_revenue = cur.fetchone()[0] or 0
+        cur.execute('SELECT COUNT(*) FROM sale'); total_sales = cur.fetchone()[0] or 0
+        cur.execute('SELECT customer_name FROM customer ORDER BY customer_name'); customer_names = [r[0] for r in cur.fetchall()]
+        conn.close()
+        return dict(sales=sales, total_revenue=total_revenue, total_sales=total_sales, customer_names=customer_names)
+    return render_template('sales.html', **cached('sales', ('sale', 'customer'), build))
 
 
 @app.route('/sales/<int:sale_id>')
@@ -946,10 +2863,19 @@ def edit_sale(sale_id):
             qty = int(request.form.get('quantity', '1') or 1)
             price = float(request.form.get('price_per_unit', '0') or 0)
             total = qty * price
-            cur.execute('UPDATE sale SET customer_name=?, product=?, quantity=?, price_per_unit=?, total_amount=?, sale_date=? WHERE id=?',
-                        (request.form.get('customer_name', '').strip(), request.form.get('product', '').strip(), qty, price, total, request.form.get('sale_date'), sale_id))
-            conn.commit(); flash('Sale updated!', 'success')
+            customer = request.form.get('customer_name', '').strip()
+            cur.execute('SELECT customer_id FROM sale WHERE id = ?', (sale_id,)); old = cur.fetchone()
+            before = sale_summary_snapshot(cur, [sale_id])
+            customer_id = resolve_sale_customer(cur, customer)
+            cur.execute('UPDATE sale SET customer_name=?, customer_id=?, product=?, quantity=?, price_per_unit=?, total_amount=?, sale_date=?, payment_status=?, animal_tag=? WHERE id=?',
+                        (customer, customer_id, request.form.get('product', '').strip(), qty, price, total, request.form.get('sale_date'), _sale_payment_status(request.form), request.form.get('animal_tag', '').strip() or None, sale_id))
+            refresh_customer_totals(cur, [customer_id, old['customer_id'] if old else None])
+            apply_sale_summary(cur, before, -1)
+            apply_sale_summary(cur, sale_summary_snapshot(cur, [sale_id]), 1)
+            sync_sale_financial(cur, sale_id)
+            conn.commit(); animal_profile_cache.invalidate(); flash('Sale updated!', 'success')
         except Exception as e:
+            conn.rollback()
             flash(f'Error updating sale: {e}', 'error')
         finally:
             conn.close()
@@ -972,10 +2898,25 @@ def add_sale():
         total = qty * price
         if not customer or not product:
             flash('Customer and product are required.', 'error'); return redirect(url_for('sales'))
+        animal_tag = request.form.get('animal_tag', '').strip() or None
         conn = get_db_connection(); cur = conn.cursor()
-        cur.execute('INSERT INTO sale (customer_name, product, quantity, price_per_unit, total_amount, sale_date) VALUES (?, ?, ?, ?, ?, ?)',
-                    (customer, product, qty, price, total, request.form.get('sale_date')))
-        conn.commit(); conn.close(); flash('Sale recorded!', 'success')
+        try:
+            customer_id = resolve_sale_customer(cur, customer)
+            cur.execute('INSERT INTO sale (customer_name, customer_id, product, quantity, price_per_unit, total_amount, sale_date, payment_status, animal_tag) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (customer, customer_id, product, qty, price, total, request.form.get('sale_date') or date.today().isoformat(), _sale_payment_status(request.form), animal_tag))
+            sale_id = cur.lastrowid
+            sync_sale_financial(cur, sale_id)
+            refresh_customer_totals(cur, [customer_id])
+            apply_sale_summary(cur, sale_summary_snapshot(cur, [sale_id]), 1)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if animal_tag:
+            animal_profile_cache.invalidate(animal_tag)
+        flash('Sale recorded!', 'success')
     except Exception as e:
         flash(f'Error recording sale: {e}', 'error')
     return redirect(url_for('sales'))
@@ -1016,7 +2957,7 @@ def delete_sale(sale_id):
         table_name = row[0]  # 'sale' or 'sales'
 
         # fetch the row to give a friendly message
-        cur.execute(f"SELECT id, customer_name, product, total_amount FROM {table_name} WHERE id = ?", (sale_id,))
+        cur.execute(f"SELECT id, customer_name, product, total_amount, customer_id FROM {table_name} WHERE id = ?", (sale_id,))
         r = cur.fetchone()
         if not r:
             flash('Sale record not found.', 'error')
@@ -1026,9 +2967,15 @@ def delete_sale(sale_id):
         product = r[2] or ''
         total_amount = r[3] or 0
 
-        # delete the sale
+        # delete the sale and reverse its financial entry together
+        if table_name == 'sale':
+            apply_sale_summary(cur, sale_summary_snapshot(cur, [sale_id]), -1)
         cur.execute(f"DELETE FROM {table_name} WHERE id = ?", (sale_id,))
+        if table_name == 'sale':
+            sync_sale_financial(cur, sale_id)
+            refresh_customer_totals(cur, [r['customer_id']])
         conn.commit()
+        animal_profile_cache.invalidate()
 
         # ensure deletion_logs and insert audit row
         try:
@@ -1067,10 +3014,300 @@ def delete_sale(sale_id):
         current_app.logger.exception('Error deleting sale: %s', e)
         flash('Error deleting sale: ' + str(e), 'error')
     finally:
-        if conn:
-            conn.close()
+        if conn:
+            conn.close()
+
+    return redirect(url_for('sales'))
+
+
+# --- invoices / receipts ---
+DOCUMENT_PREFIXES = {'invoice': 'INV', 'receipt': 'RCT'}
+
+
+def next_document_number(cur, series, count=1):
+    """
+    Reserve the next `count` numbers in a series and return the first. The UPDATE holds the write
+    lock until the caller commits.
+    """
+    cur.execute('''INSERT INTO document_counter (series, last_value) VALUES (?, ?)
+                   ON CONFLICT(series) DO UPDATE SET last_value = last_value + excluded.last_value''', (series, count))
+    cur.execute('SELECT last_value FROM document_counter WHERE series = ?', (series,))
+    return cur.fetchone()[0] - count + 1
+
+
+def document_series(kind, sale):
+    """Numbering series of a sale's document: the prefix plus the year of the sale, not of issue."""
+    year = (sale['sale_date'] or '')[:4]
+    return f"{DOCUMENT_PREFIXES[kind]}-{year if year.isdigit() else date.today().year}"
+
+
+def sale_document_numbers(cur, sales, kind, issue=True):
+    """
+    {sale id: number} of the sales' invoices/receipts, issuing numbers for those that lack one:
+    one counter bump per series and one insert for the whole batch. Caller commits.
+    With issue=False only numbers already issued are returned and nothing is written.
+    """
+    numbers = {}
+    for chunk, marks in _task_id_chunks(s['id'] for s in sales):
+        cur.execute(f'SELECT sale_id, number FROM sale_document WHERE kind = ? AND sale_id IN ({marks})', [kind] + chunk)
+        numbers.update((r[0], r[1]) for r in cur.fetchall())
+    if not issue:
+        return numbers
+    missing = {}
+    for sale in sales:
+        if sale['id'] not in numbers:
+            missing.setdefault(document_series(kind, sale), {}).setdefault(sale['id'], sale)
+    issued = []
+    for series, pending in missing.items():
+        first = next_document_number(cur, series, len(pending))
+        for offset, sale_id in enumerate(pending):
+            numbers[sale_id] = f"{series}-{first + offset:05d}"
+            issued.append((sale_id, kind, numbers[sale_id]))
+    if issued:
+        cur.executemany('INSERT INTO sale_document (sale_id, kind, number) VALUES (?, ?, ?)', issued)
+        if kind == 'invoice':
+            cur.executemany('UPDATE sale SET invoice_number = ? WHERE id = ?', [(n, i) for i, _, n in issued])
+    return numbers
+
+
+def sale_document_number(cur, sale, kind):
+    """The number of a sale's invoice/receipt, issuing one on first use. Caller commits."""
+    return sale_document_numbers(cur, [sale], kind)[sale['id']]
+
+
+def sale_document_context(sale, kind, number, customer=None):
+    """Display-ready fields for invoices.render_document."""
+    contact = ' | '.join(v for v in ((customer['phone'], customer['email']) if customer else ()) if v)
+    return {
+        'title': kind.upper(), 'number': number,
+        'issue_date': sale['sale_date'] or date.today().isoformat(),
+        'party_label': 'Bill to' if kind == 'invoice' else 'Received from',
+        'customer_name': (customer['customer_name'] if customer else sale['customer_name']) or '',
+        'customer_contact': contact,
+        'product': sale['product'], 'quantity': sale['quantity'],
+        'unit_price': f"{sale['price_per_unit'] or 0:,.2f}", 'amount': f"{sale['total_amount'] or 0:,.2f}",
+        'currency': 'Ksh', 'total': f"{sale['total_amount'] or 0:,.2f}",
+        'payment_status': sale['payment_status'] or 'Pending', 'sale_reference': sale_reference(sale['id']),
+    }
+
+
+def _sale_customers(cur, sales):
+    ids = sorted({s['customer_id'] for s in sales if s['customer_id']})
+    if not ids:
+        return {}
+    cur.execute('SELECT id, customer_name, phone, email FROM customer WHERE id IN (' + ','.join('?' for _ in ids) + ')', ids)
+    return {r['id']: r for r in cur.fetchall()}
+
+
+@app.route('/sales/<int:sale_id>/<any(invoice, receipt):kind>.pdf')
+@login_required
+def sale_document(sale_id, kind):
+    if current_user.role not in ['admin', 'accountant']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute('SELECT * FROM sale WHERE id = ?', (sale_id,)); sale = cur.fetchone()
+        if not sale:
+            flash('Sale not found.', 'error'); return redirect(url_for('sales'))
+        if kind == 'receipt' and (sale['payment_status'] or '').strip().lower() != 'paid':
+            flash('A receipt can only be issued for a paid sale.', 'error'); return redirect(url_for('view_sale', sale_id=sale_id))
+        number = sale_document_number(cur, sale, kind)
+        conn.commit()
+        pdf = render_document(kind, sale_document_context(sale, kind, number, _sale_customers(cur, [sale]).get(sale['customer_id'])))
+    finally:
+        conn.close()
+    resp = make_response(pdf)
+    resp.headers['Content-Type'] = 'application/pdf'
+    resp.headers['Content-Disposition'] = f'inline; filename="{number}.pdf"'
+    return resp
+
+
+@app.route('/sales/invoices.zip', methods=['GET', 'POST'])
+@login_required
+def sale_invoice_batch():
+    """
+    Every invoice for one month (month=YYYY-MM) as a zip. POST issues numbers for sales that lack
+    one; GET has no side effects and includes only invoices already issued.
+    """
+    if current_user.role not in ['admin', 'accountant']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    month = _month_arg('month', date.today().strftime('%Y-%m'))
+    first = date.fromisoformat(f'{month}-01')
+    following = (first + timedelta(days=32)).replace(day=1)
+    issue = request.method == 'POST'
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute('SELECT * FROM sale WHERE sale_date >= ? AND sale_date < ? ORDER BY sale_date, id',
+                    (first.isoformat(), following.isoformat()))
+        sales = cur.fetchall()
+        if not sales:
+            flash(f'No sales in {month}.', 'info'); return redirect(url_for('sales'))
+        numbers = sale_document_numbers(cur, sales, 'invoice', issue=issue)
+        if issue:
+            conn.commit()
+        sales = [s for s in sales if s['id'] in numbers]
+        if not sales:
+            flash(f'No invoices have been issued for {month} yet.', 'info'); return redirect(url_for('sales'))
+        customers = _sale_customers(cur, sales)
+    finally:
+        conn.close()
+    jobs = [(f"{numbers[s['id']]}.pdf", 'invoice', sale_document_context(s, 'invoice', numbers[s['id']], customers.get(s['customer_id'])))
+            for s in sales]
+    resp = make_response(render_batch(jobs))
+    resp.headers['Content-Type'] = 'application/zip'
+    resp.headers['Content-Disposition'] = f'attachment; filename="invoices-{month}.zip"'
+    return resp
+
+
+# --- sales analytics: every query below reads sales_summary / sales_customer_daily only ---
+SALES_DIMENSIONS = {
+    'product': ('product_key', 'MIN(product)'),
+    'customer_type': ('customer_type', 'customer_type'),
+    'day': ('day', 'day'),
+    'month': ('substr(day, 1, 7)', 'substr(day, 1, 7)'),
+}
+
+
+def _shift_year(d, years):
+    try:
+        return d.replace(year=d.year + years)
+    except ValueError:  # 29 February
+        return d.replace(year=d.year + years, day=28)
+
+
+def _sales_filters(product=None, customer_type=None):
+    where, params = [], []
+    if product:
+        where.append('product_key = ?'); params.append(product.strip().lower())
+    if customer_type:
+        where.append('customer_type = ?'); params.append(customer_type.strip().lower())
+    return ''.join(' AND ' + w for w in where), params
+
+
+def sales_breakdown(cur, start, end, dimension='product', product=None, customer_type=None, limit=None):
+    """Revenue/quantity/count grouped by one cube dimension over [start, end], largest first."""
+    key_expr, label_expr = SALES_DIMENSIONS[dimension]
+    filt, params = _sales_filters(product, customer_type)
+    order = 'key' if dimension in ('day', 'month') else 'revenue DESC'
+    cur.execute(f'''
+        SELECT {key_expr} AS key, {label_expr} AS label, SUM(revenue) AS revenue, SUM(quantity) AS quantity,
+               SUM(sales_count) AS sales_count
+        FROM sales_summary WHERE day BETWEEN ? AND ?{filt}
+        GROUP BY 1 ORDER BY {order}{' LIMIT ' + str(int(limit)) if limit else ''}
+    ''', [start, end] + params)
+    return rows_to_dicts(cur.fetchall())
+
+
+def sales_top_customers(cur, start, end, limit=10, customer_type=None):
+    filt, params = _sales_filters(customer_type=customer_type)
+    cur.execute(f'''
+        SELECT customer_key, MAX(customer_id) AS customer_id, MAX(customer_name) AS customer_name,
+               MAX(customer_type) AS customer_type, SUM(revenue) AS revenue, SUM(sales_count) AS sales_count
+        FROM sales_customer_daily WHERE day BETWEEN ? AND ?{filt}
+        GROUP BY customer_key ORDER BY revenue DESC LIMIT ?
+    ''', [start, end] + params + [int(limit)])
+    return rows_to_dicts(cur.fetchall())
+
+
+def sales_totals(cur, start, end, product=None, customer_type=None):
+    filt, params = _sales_filters(product, customer_type)
+    cur.execute(f'''SELECT COALESCE(SUM(revenue), 0), COALESCE(SUM(quantity), 0), COALESCE(SUM(sales_count), 0)
+                    FROM sales_summary WHERE day BETWEEN ? AND ?{filt}''', [start, end] + params)
+    revenue, quantity, count = cur.fetchone()
+    return {'revenue': revenue, 'quantity': quantity, 'sales_count': count}
+
+
+def _pct_change(current, previous):
+    return round((current - previous) * 100.0 / previous, 1) if previous else None
+
+
+def sales_analytics_report(cur, start, end, product=None, customer_type=None, limit=10):
+    """Everything the analytics page and API show for one range, plus previous-period and year-ago comparisons."""
+    start_d, end_d = date.fromisoformat(start), date.fromisoformat(end)
+    span = end_d - start_d
+    prev_end = start_d - timedelta(days=1)
+    prev_start = prev_end - span
+    totals = sales_totals(cur, start, end, product, customer_type)
+    previous = sales_totals(cur, prev_start.isoformat(), prev_end.isoformat(), product, customer_type)
+    year_ago = sales_totals(cur, _shift_year(start_d, -1).isoformat(), _shift_year(end_d, -1).isoformat(), product, customer_type)
+
+    # monthly series with month-on-month and year-on-year change, from one query spanning range + prior year
+    series_from = _shift_year(start_d.replace(day=1), -1) - timedelta(days=31)
+    monthly = {r['key']: r['revenue'] for r in sales_breakdown(cur, series_from.isoformat(), end, 'month', product, customer_type)}
+    months = []
+    cursor = start_d.replace(day=1)
+    while cursor <= end_d:
+        key = cursor.strftime('%Y-%m')
+        prev_month = (cursor - timedelta(days=1)).strftime('%Y-%m')
+        last_year = _shift_year(cursor, -1).strftime('%Y-%m')
+        revenue = monthly.get(key, 0) or 0
+        months.append({'month': key, 'revenue': revenue,
+                       'mom_pct': _pct_change(revenue, monthly.get(prev_month, 0) or 0),
+                       'yoy_pct': _pct_change(revenue, monthly.get(last_year, 0) or 0)})
+        cursor = (cursor.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+    return {
+        'start': start, 'end': end, 'product': product, 'customer_type': customer_type,
+        'totals': totals,
+        'previous_period': dict(previous, start=prev_start.isoformat(), end=prev_end.isoformat(),
+                                change_pct=_pct_change(totals['revenue'], previous['revenue'])),
+        'year_ago': dict(year_ago, change_pct=_pct_change(totals['revenue'], year_ago['revenue'])),
+        'by_product': sales_breakdown(cur, start, end, 'product', product, customer_type, limit),
+        'by_customer_type': sales_breakdown(cur, start, end, 'customer_type', product, customer_type),
+        'top_customers': sales_top_customers(cur, start, end, limit, customer_type),
+        'months': months,
+    }
+
+
+def _sales_report_args():
+    today = date.today()
+    try:
+        start = date.fromisoformat(request.args.get('start', '')).isoformat()
+    except ValueError:
+        start = today.replace(month=1, day=1).isoformat()
+    try:
+        end = date.fromisoformat(request.args.get('end', '')).isoformat()
+    except ValueError:
+        end = today.isoformat()
+    if start > end:
+        start, end = end, start
+    limit = max(1, min(request.args.get('top', 10, type=int) or 10, 100))
+    return start, end, (request.args.get('product') or None), (request.args.get('customer_type') or None), limit
+
+
+@app.route('/sales/analytics')
+@login_required
+def sales_analytics():
+    if current_user.role not in ['admin', 'accountant']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    start, end, product, customer_type, limit = _sales_report_args()
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        report = sales_analytics_report(cur, start, end, product, customer_type, limit)
+    finally:
+        conn.close()
+    return render_template('sales_analytics.html', report=report, top=limit)
+
+
+@app.route('/api/sales/analytics')
+@login_required
+def api_sales_analytics():
+    if current_user.role not in ['admin', 'accountant']:
+        return jsonify({'ok': False, 'error': 'Access denied.'}), 403
+    start, end, product, customer_type, limit = _sales_report_args()
+    dimension = request.args.get('by')
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        if dimension:
+            if dimension not in SALES_DIMENSIONS:
+                return jsonify({'ok': False, 'error': f'Unknown dimension: {dimension}'}), 400
+            # drill-down: a single breakdown with the given filters
+            return jsonify({'ok': True, 'by': dimension,
+                            'rows': sales_breakdown(cur, start, end, dimension, product, customer_type)})
+        return jsonify(dict(ok=True, **sales_analytics_report(cur, start, end, product, customer_type, limit)))
+    finally:
+        conn.close()
 
-    return redirect(url_for('sales'))
 
 # ----- Breeding -----
 @app.route('/breeding')
@@ -1121,6 +3358,7 @@ def delete_breeding(breeding_id):
         # perform delete
         cur.execute('DELETE FROM breeding WHERE id = ?', (breeding_id,))
         conn.commit()
+        animal_profile_cache.invalidate()
 
         flash(f'Breeding record BP-{breeding_id} deleted.', 'success')
     except Exception as e:
@@ -1164,7 +3402,7 @@ def edit_breeding(breeding_id):
         try:
             cur.execute('UPDATE breeding SET male_id=?, female_id=?, breeding_date=?, expected_birth=?, status=?, notes=? WHERE id=?',
                         (request.form.get('male_id', '').strip(), request.form.get('female_id', '').strip(), request.form.get('breeding_date'), request.form.get('expected_birth'), request.form.get('status', 'Pending'), request.form.get('notes', '').strip(), breeding_id))
-            conn.commit(); flash('Breeding record updated!', 'success')
+            conn.commit(); animal_profile_cache.invalidate(); flash('Breeding record updated!', 'success')
         except Exception as e:
             flash(f'Error updating breeding record: {e}', 'error')
         finally:
@@ -1188,13 +3426,101 @@ def add_breeding():
             flash('Male, female and breeding date required.', 'error'); return redirect(url_for('breeding'))
         conn = get_db_connection(); cur = conn.cursor()
         cur.execute('INSERT INTO breeding (male_id, female_id, breeding_date, expected_birth, notes) VALUES (?, ?, ?, ?, ?)', (male, female, bdate, request.form.get('expected_birth'), request.form.get('notes', '')))
-        conn.commit(); conn.close(); flash('Breeding record added!', 'success')
+        conn.commit(); conn.close(); animal_profile_cache.invalidate(male, female); flash('Breeding record added!', 'success')
     except Exception as e:
         flash(f'Error adding breeding record: {e}', 'error')
     return redirect(url_for('breeding'))
 
 
 # ----- Medical -----
+# --- withdrawal tracking (drug withdrawal periods block milk from treated animals) ---
+def _animal_key(tag):
+    """Normalise an animal tag/id the same way for medical.animal_id and production.animal_tag."""
+    return (str(tag or '')).strip().lower()
+
+
+def medical_withdrawal_until(treatment_date, withdrawal_days):
+    """Return ISO date the withdrawal period ends (inclusive) or None when there is no withdrawal."""
+    try:
+        days = int(withdrawal_days or 0)
+    except (TypeError, ValueError):
+        days = 0
+    if days <= 0 or not treatment_date:
+        return None
+    try:
+        start = date.fromisoformat(str(treatment_date)[:10])
+    except ValueError:
+        return None
+    return (start + timedelta(days=days)).isoformat()
+
+
+class WithdrawalIndex:
+    """
+    In-memory interval index: animal key -> [(start, end)] for withdrawals that have not ended yet.
+    Loaded with one indexed range query (idx_medical_withdrawal) and reloaded when the medical
+    data version or the day changes, so other workers' writes are picked up; local medical writes
+    also call invalidate(). Dates before today (backdated entries) fall outside the index and are
+    answered by a direct query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._intervals = {}
+        self._loaded_at = None  # (day, medical data version) of the loaded intervals
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    @staticmethod
+    def _query(since):
+        """animal key -> [(start, end)] for withdrawals ending on or after `since`."""
+        intervals = {}
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT animal_id, treatment_date, withdrawal_until FROM medical "
+                "WHERE withdrawal_until IS NOT NULL AND withdrawal_until >= ?",
+                (since,)
+            )
+            for r in cur.fetchall():
+                start = str(r['treatment_date'] or '')[:10]
+                intervals.setdefault(_animal_key(r['animal_id']), []).append((start, str(r['withdrawal_until'])[:10]))
+        finally:
+            conn.close()
+        return intervals
+
+    def _load(self):
+        return self._query(date.today().isoformat())
+
+    def _current(self):
+        stamp = (date.today().isoformat(), data_versions(('medical',)))
+        with self._lock:
+            if self._loaded_at == stamp:
+                return self._intervals
+        intervals = self._load()
+        with self._lock:
+            self._intervals = intervals
+            self._loaded_at = stamp
+        return intervals
+
+    def active_until(self, animal_tag, on_date=None):
+        """Return the latest withdrawal end date covering `on_date` for the animal, or None."""
+        key = _animal_key(animal_tag)
+        if not key:
+            return None
+        today = date.today().isoformat()
+        day = str(on_date or today)[:10]
+        # the index only holds withdrawals still running today; one that ended since `day` is not in it
+        intervals = self._current() if day >= today else self._query(day)
+        ends = [end for start, end in intervals.get(key, ()) if start <= day <= end]
+        return max(ends) if ends else None
+
+
+withdrawal_index = WithdrawalIndex()
+
+
 # --- routes (paste/replace existing versions) ---
 
 @app.route('/medical')
@@ -1211,9 +3537,49 @@ def medical_records():
     medical_records = cur.fetchall()
     cur.execute('SELECT COUNT(*) FROM medical')
     total_medical = cur.fetchone()[0] or 0
+    # upcoming checkups come straight off idx_medical_followup instead of sorting every row in the template
+    cur.execute("SELECT * FROM medical WHERE next_checkup >= ? ORDER BY next_checkup, animal_id LIMIT 5",
+                (date.today().isoformat(),))
+    upcoming_checkups = cur.fetchall()
     conn.close()
 
-    return render_template('medical.html', medical_records=medical_records, total_medical=total_medical)
+    return render_template('medical.html', medical_records=medical_records, total_medical=total_medical,
+                           upcoming_checkups=upcoming_checkups)
+
+
+@app.route('/medical/followups')
+@login_required
+def medical_followups():
+    """Follow-up queue: overdue + upcoming checkups and animals still under drug withdrawal."""
+    if current_user.role not in ['admin', 'manager', 'vet']:
+        flash('Access denied.', 'error')
+        return redirect(url_for('dashboard'))
+
+    try:
+        days = max(1, min(int(request.args.get('days', 14)), 365))
+    except (TypeError, ValueError):
+        days = 14
+    today = date.today()
+    horizon = (today + timedelta(days=days)).isoformat()
+    overdue_from = (today - timedelta(days=30)).isoformat()
+
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        # all three are range scans on the (next_checkup, animal_id) / (withdrawal_until, animal_id) indexes
+        cur.execute("SELECT * FROM medical WHERE next_checkup >= ? AND next_checkup < ? ORDER BY next_checkup, animal_id",
+                    (overdue_from, today.isoformat()))
+        overdue = cur.fetchall()
+        cur.execute("SELECT * FROM medical WHERE next_checkup >= ? AND next_checkup <= ? ORDER BY next_checkup, animal_id",
+                    (today.isoformat(), horizon))
+        upcoming = cur.fetchall()
+        cur.execute("SELECT * FROM medical WHERE withdrawal_until >= ? ORDER BY withdrawal_until, animal_id",
+                    (today.isoformat(),))
+        withdrawals = cur.fetchall()
+    finally:
+        conn.close()
+
+    return render_template('medical_followups.html', overdue=overdue, upcoming=upcoming,
+                           withdrawals=withdrawals, days=days, today=today.isoformat())
 
 
 @app.route('/delete_medical/<int:medical_id>', methods=['POST'])
@@ -1230,6 +3596,8 @@ def delete_medical(medical_id):
         cur.execute('DELETE FROM medical WHERE id = ?', (medical_id,))
         conn.commit()
         conn.close()
+        withdrawal_index.invalidate()
+        animal_profile_cache.invalidate()
         flash('Medical record deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting record: {e}', 'error')
@@ -1272,20 +3640,26 @@ def edit_medical(medical_id):
         # optionally debug incoming form
         # debug_form('edit_medical', request.form)
         try:
+            tdate = request.form.get('treatment_date')
+            wdays = int(request.form.get('withdrawal_days') or 0)
             cur.execute(
-                'UPDATE medical SET animal_id=?, treatment_date=?, condition=?, treatment=?, veterinarian=?, next_checkup=?, notes=? WHERE id=?',
+                'UPDATE medical SET animal_id=?, treatment_date=?, condition=?, treatment=?, veterinarian=?, next_checkup=?, notes=?, withdrawal_days=?, withdrawal_until=? WHERE id=?',
                 (
                     request.form.get('animal_id', '').strip(),
-                    request.form.get('treatment_date'),
+                    tdate,
                     request.form.get('condition', '').strip(),
                     request.form.get('treatment', '').strip(),
                     request.form.get('veterinarian', '').strip(),
-                    request.form.get('next_checkup'),
+                    request.form.get('next_checkup') or None,
                     request.form.get('notes', '').strip(),
+                    wdays,
+                    medical_withdrawal_until(tdate, wdays),
                     medical_id
                 )
             )
             conn.commit()
+            withdrawal_index.invalidate()
+            animal_profile_cache.invalidate()
             flash('Medical record updated!', 'success')
         except Exception as e:
             flash(f'Error: {e}', 'error')
@@ -1323,22 +3697,28 @@ def add_medical():
             flash('Required fields missing.', 'error')
             return redirect(url_for('medical_records'))
 
+        wdays = int(request.form.get('withdrawal_days') or 0)
+
         conn = get_db_connection()
         cur = conn.cursor()
         cur.execute(
-            'INSERT INTO medical (animal_id, treatment_date, condition, treatment, veterinarian, next_checkup, notes) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            'INSERT INTO medical (animal_id, treatment_date, condition, treatment, veterinarian, next_checkup, notes, withdrawal_days, withdrawal_until) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
             (
                 aid,
                 tdate,
                 cond,
                 treat,
                 request.form.get('veterinarian', '').strip(),
-                request.form.get('next_checkup'),
-                request.form.get('notes', '').strip()
+                request.form.get('next_checkup') or None,
+                request.form.get('notes', '').strip(),
+                wdays,
+                medical_withdrawal_until(tdate, wdays)
             )
         )
         conn.commit()
         conn.close()
+        withdrawal_index.invalidate()
+        animal_profile_cache.invalidate(aid)
         flash('Medical record added!', 'success')
     except Exception as e:
         flash(f'Error adding medical record: {e}', 'error')
@@ -1348,6 +3728,248 @@ def add_medical():
 
 
 # ----- Feed -----
+# --- feed analytics: daily aggregates refreshed on write, reports read only the aggregate tables ---
+def _table_exists(cur, name):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return cur.fetchone() is not None
+
+
+def refresh_feed_aggregates(conn, days=None):
+    """
+    Recompute feed_daily_agg / milk_daily_agg for the given days (ISO dates), or rebuild
+    everything when days is None. Each day is re-derived from the source rows through the
+    idx_feed_day / idx_production_day expression indexes. Caller commits.
+    """
+    cur = conn.cursor()
+    if days is not None:
+        days = sorted({str(d)[:10] for d in days if d})
+        if not days:
+            return
+        marks = ','.join('?' for _ in days)
+        params = tuple(days)
+        cur.execute(f'DELETE FROM feed_daily_agg WHERE day IN ({marks})', params)
+        cur.execute(f'DELETE FROM milk_daily_agg WHERE day IN ({marks})', params)
+        feed_filter = f'WHERE {FEED_DAY_EXPR} IN ({marks})'
+        milk_filter = f'AND {MILK_DAY_EXPR} IN ({marks})'
+    else:
+        params = ()
+        cur.execute('DELETE FROM feed_daily_agg')
+        cur.execute('DELETE FROM milk_daily_agg')
+        feed_filter = milk_filter = ''
+
+    # unit cost comes from the inventory item with the same name as the feed type (when stocked)
+    if _table_exists(cur, 'inventory'):
+        price_join = '''LEFT JOIN (SELECT LOWER(TRIM(name)) AS item_key, MAX(price) AS unit_price
+                                   FROM inventory GROUP BY item_key) inv
+                        ON inv.item_key = LOWER(TRIM(feed.feed_type))'''
+        cost_expr = 'SUM(feed.quantity * COALESCE(inv.unit_price, 0))'
+    else:
+        price_join, cost_expr = '', '0'
+    cur.execute(f'''
+        INSERT INTO feed_daily_agg (day, group_key, feed_type, feed_qty, feed_cost, entries)
+        SELECT {FEED_DAY_EXPR}, LOWER(TRIM(COALESCE(feed.animal_group, ''))), TRIM(feed.feed_type),
+               COALESCE(SUM(feed.quantity), 0), {cost_expr}, COUNT(*)
+        FROM feed {price_join}
+        {feed_filter}
+        GROUP BY 1, 2, 3
+    ''', params)
+
+    if _table_exists(cur, 'production'):
+        cur.execute(f'''
+            INSERT INTO milk_daily_agg (day, group_key, milk_liters, entries)
+            SELECT {MILK_DAY_EXPR}, LOWER(TRIM(COALESCE(category, ''))),
+                   COALESCE(SUM(COALESCE(quantity, liters, 0)), 0), COUNT(*)
+            FROM production
+            WHERE LOWER(COALESCE(NULLIF(production_type, ''), 'milk')) = 'milk' {milk_filter}
+            GROUP BY 1, 2
+        ''', params)
+
+
+def refresh_feed_aggregates_safe(days):
+    """Write-path hook: refresh the touched days without failing the request that triggered it."""
+    try:
+        conn = get_db_connection()
+        try:
+            refresh_feed_aggregates(conn, days)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception:
+        app.logger.exception('Could not refresh feed aggregates for %s', days)
+
+
+FEED_COVER_WINDOW_DAYS = 14   # trailing window for the consumption rate
+FEED_COVER_WARN_DAYS = 7      # feed types with less cover than this are flagged on the feed page
+
+
+def _feed_key(name):
+    return (name or '').strip().lower()
+
+
+def _feed_cover_item(cur, key):
+    """
+    The stock item behind a feed type: the item its latest linked feed entry draws from (None if
+    that item is gone), or the item named like the feed type when no entry names an item.
+    """
+    cur.execute('''SELECT f.inventory_item_id, i.id, i.quantity FROM feed f LEFT JOIN inventory i ON i.id = f.inventory_item_id
+                   WHERE LOWER(TRIM(f.feed_type)) = ? AND f.inventory_item_id IS NOT NULL
+                   ORDER BY f.id DESC LIMIT 1''', (key,))
+    linked = cur.fetchone()
+    if linked:
+        return linked if linked['id'] is not None else None
+    cur.execute('SELECT id, quantity FROM inventory WHERE LOWER(TRIM(name)) = ? ORDER BY id LIMIT 1', (key,))
+    return cur.fetchone()
+
+
+def refresh_feed_cover(cur, feed_keys, item_ids=()):
+    """
+    Recompute feed_cover for the given feed types, plus the feed types drawing on item_ids, only.
+    Stock comes from the linked inventory item; the rate is the trailing FEED_COVER_WINDOW_DAYS
+    consumption from feed_daily_agg. Caller commits.
+    """
+    keys = {_feed_key(k) for k in feed_keys if _feed_key(k)}
+    item_ids = [i for i in item_ids if i]
+    if item_ids:
+        marks = ','.join('?' for _ in item_ids)
+        cur.execute(f'SELECT DISTINCT LOWER(TRIM(feed_type)) FROM feed WHERE inventory_item_id IN ({marks})', item_ids)
+        keys.update(r[0] for r in cur.fetchall() if r[0])
+    keys = sorted(keys)
+    if not keys or not _table_exists(cur, 'inventory'):
+        return
+    since = (date.today() - timedelta(days=FEED_COVER_WINDOW_DAYS - 1)).isoformat()
+    for key in keys:
+        item = _feed_cover_item(cur, key)
+        if not item:
+            cur.execute('DELETE FROM feed_cover WHERE feed_key = ?', (key,))
+            continue
+        cur.execute('SELECT COALESCE(SUM(feed_qty), 0) FROM feed_daily_agg WHERE day >= ? AND LOWER(feed_type) = ?',
+                    (since, key))
+        rate = float(cur.fetchone()[0] or 0) / FEED_COVER_WINDOW_DAYS
+        stock = float(item['quantity'] or 0)
+        cover = (stock / rate) if rate else None
+        cur.execute('''INSERT OR REPLACE INTO feed_cover (feed_key, item_id, stock, daily_rate, days_of_cover, updated_at)
+                       VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''', (key, item['id'], stock, rate, cover))
+
+
+def feed_inventory_item(cur, feed_type, item_id=None):
+    """The inventory row a feed entry draws from: the chosen item, else the item named like the feed type."""
+    if item_id:
+        cur.execute('SELECT id, name, quantity FROM inventory WHERE id = ?', (item_id,))
+    else:
+        cur.execute('SELECT id, name, quantity FROM inventory WHERE LOWER(TRIM(name)) = ? ORDER BY id LIMIT 1',
+                    (_feed_key(feed_type),))
+    return cur.fetchone()
+
+
+def feed_efficiency_report(cur, start, end, granularity='month'):
+    """
+    Feed conversion (litres per unit of feed) and feed cost per litre by period and animal group,
+    computed from the aggregate tables only.
+    """
+    period = 'substr(day, 1, 7)' if granularity == 'month' else 'day'
+    cur.execute(f'''
+        SELECT f.period, f.group_key, f.feed_qty, f.feed_cost, COALESCE(m.milk_liters, 0) AS milk_liters
+        FROM (SELECT {period} AS period, group_key, SUM(feed_qty) AS feed_qty, SUM(feed_cost) AS feed_cost
+              FROM feed_daily_agg WHERE day BETWEEN ? AND ? GROUP BY 1, 2) f
+        LEFT JOIN (SELECT {period} AS period, group_key, SUM(milk_liters) AS milk_liters
+                   FROM milk_daily_agg WHERE day BETWEEN ? AND ? GROUP BY 1, 2) m
+          ON m.period = f.period AND m.group_key = f.group_key
+        ORDER BY f.period, f.group_key
+    ''', (start, end, start, end))
+    rows = []
+    totals = {}
+    for period_key, group_key, feed_qty, feed_cost, milk in cur.fetchall():
+        feed_qty = float(feed_qty or 0); feed_cost = float(feed_cost or 0); milk = float(milk or 0)
+        rows.append({
+            'period': period_key,
+            'group': group_key or '(no group)',
+            'feed_qty': feed_qty,
+            'feed_cost': feed_cost,
+            'milk_liters': milk,
+            'feed_conversion': (milk / feed_qty) if feed_qty else None,
+            'cost_per_liter': (feed_cost / milk) if milk else None,
+        })
+        t = totals.setdefault(period_key, {'period': period_key, 'feed_qty': 0.0, 'feed_cost': 0.0, 'milk_liters': 0.0})
+        t['feed_qty'] += feed_qty; t['feed_cost'] += feed_cost; t['milk_liters'] += milk
+    series = []
+    for t in totals.values():
+        t['feed_conversion'] = (t['milk_liters'] / t['feed_qty']) if t['feed_qty'] else None
+        t['cost_per_liter'] = (t['feed_cost'] / t['milk_liters']) if t['milk_liters'] else None
+        series.append(t)
+    return rows, series
+
+
+def _feed_report_args():
+    today = date.today()
+    try:
+        start = date.fromisoformat(request.args.get('start', '')).isoformat()
+    except ValueError:
+        start = (today - timedelta(days=180)).isoformat()
+    try:
+        end = date.fromisoformat(request.args.get('end', '')).isoformat()
+    except ValueError:
+        end = today.isoformat()
+    if start > end:
+        start, end = end, start
+    granularity = 'day' if request.args.get('granularity') == 'day' else 'month'
+    return start, end, granularity
+
+
+def _load_feed_report(start, end, granularity):
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        # first use on an existing database: build the aggregates once
+        cur.execute('SELECT 1 FROM feed_daily_agg LIMIT 1')
+        if cur.fetchone() is None:
+            cur.execute('SELECT 1 FROM feed LIMIT 1')
+            if cur.fetchone() is not None:
+                refresh_feed_aggregates(conn)
+                conn.commit()
+        return feed_efficiency_report(cur, start, end, granularity)
+    finally:
+        conn.close()
+
+
+@app.route('/feed/analytics')
+@login_required
+def feed_analytics():
+    if current_user.role not in ['admin', 'manager']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    start, end, granularity = _feed_report_args()
+    rows, series = _load_feed_report(start, end, granularity)
+    return render_template('feed_analytics.html', rows=rows, series=series,
+                           start=start, end=end, granularity=granularity)
+
+
+@app.route('/api/feed/analytics')
+@login_required
+def api_feed_analytics():
+    if current_user.role not in ['admin', 'manager']:
+        return jsonify({'ok': False, 'error': 'Access denied.'}), 403
+    start, end, granularity = _feed_report_args()
+    rows, series = _load_feed_report(start, end, granularity)
+    return jsonify({'ok': True, 'start': start, 'end': end, 'granularity': granularity, 'rows': rows, 'series': series})
+
+
+@app.route('/feed/analytics/rebuild', methods=['POST'])
+@login_required
+def rebuild_feed_analytics():
+    if current_user.role != 'admin':
+        flash('Access denied.', 'error'); return redirect(url_for('feed_analytics'))
+    conn = get_db_connection()
+    try:
+        refresh_feed_aggregates(conn)
+        conn.commit()
+        flash('Feed analytics rebuilt.', 'success')
+    except Exception as e:
+        conn.rollback()
+        app.logger.exception('Feed analytics rebuild failed')
+        flash(f'Error rebuilding feed analytics: {e}', 'error')
+    finally:
+        conn.close()
+    return redirect(url_for('feed_analytics'))
+
+
 @app.route('/feed')
 @login_required
 def feed():
@@ -1356,8 +3978,15 @@ def feed():
     conn = get_db_connection(); cur = conn.cursor()
     cur.execute('SELECT * FROM feed ORDER BY created_at DESC'); feed_records = cur.fetchall()
     cur.execute('SELECT COUNT(*) FROM feed'); total_feed = cur.fetchone()[0] or 0
+    cur.execute('''SELECT fc.*, i.name AS item_name, i.unit FROM feed_cover fc
+                   LEFT JOIN inventory i ON i.id = fc.item_id
+                   WHERE fc.days_of_cover IS NOT NULL AND fc.days_of_cover < ?
+                   ORDER BY fc.days_of_cover''', (FEED_COVER_WARN_DAYS,))
+    low_feed = cur.fetchall()
+    cur.execute('SELECT id, name, quantity, unit FROM inventory ORDER BY name'); stock_items = cur.fetchall()
     conn.close()
-    return render_template('feed.html', feed_records=feed_records, total_feed=total_feed)
+    return render_template('feed.html', feed_records=feed_records, total_feed=total_feed,
+                           low_feed=low_feed, stock_items=stock_items, cover_warn_days=FEED_COVER_WARN_DAYS)
 # add near your other feed routes (imports assumed already present)
 from flask import current_app
 
@@ -1369,27 +3998,37 @@ def delete_feed(feed_id):
         flash('Access denied.', 'error')
         return redirect(url_for('feed'))
 
+    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
 
         # Optional: check record exists
-        cur.execute('SELECT id FROM feed WHERE id = ?', (feed_id,))
+        cur.execute(f'SELECT id, feed_type, quantity, inventory_item_id, {FEED_DAY_EXPR} AS day FROM feed WHERE id = ?', (feed_id,))
         rec = cur.fetchone()
         if not rec:
             flash('Feed record not found.', 'error')
             conn.close()
             return redirect(url_for('feed'))
 
-        # Delete
+        # Delete, returning the drawn stock to its inventory item (if that item still exists)
         cur.execute('DELETE FROM feed WHERE id = ?', (feed_id,))
+        if rec['inventory_item_id'] and rec['quantity'] and feed_inventory_item(cur, None, rec['inventory_item_id']):
+            post_inventory_movement(cur, rec['inventory_item_id'], 'in', rec['quantity'], reference=f'FEED-{feed_id}',
+                                    notes='Feed entry deleted', performed_by=getattr(current_user, 'username', ''))
+        refresh_feed_aggregates(conn, [rec['day']])
+        refresh_feed_cover(cur, [rec['feed_type']])
         conn.commit()
         conn.close()
+        animal_profile_cache.invalidate()
 
         flash('Feed record deleted successfully.', 'success')
     except Exception as e:
         # Keep the error message concise for UI; log details server-side if needed
         current_app.logger.exception("Failed to delete feed record %s", feed_id)
+        if conn:
+            conn.rollback()
+            conn.close()
         flash(f'Error deleting feed record: {e}', 'error')
 
     return redirect(url_for('feed'))
@@ -1416,10 +4055,40 @@ def edit_feed(feed_id):
     if request.method == 'POST':
         debug_form('edit_feed', request.form)
         try:
+            cur.execute(f'SELECT feed_type, quantity, inventory_item_id, {FEED_DAY_EXPR} AS day FROM feed WHERE id = ?', (feed_id,))
+            old = cur.fetchone()
+            ft = request.form.get('feed_type', '').strip(); qty = float(request.form.get('quantity', '0') or 0)
             cur.execute('UPDATE feed SET feed_type=?, quantity=?, animal_group=?, feeding_time=?, notes=? WHERE id=?',
-                        (request.form.get('feed_type', '').strip(), float(request.form.get('quantity', '0') or 0), request.form.get('animal_group', '').strip(), request.form.get('feeding_time'), request.form.get('notes', '').strip(), feed_id))
-            conn.commit(); flash('Feed record updated!', 'success')
+                        (ft, qty, request.form.get('animal_group', '').strip(), request.form.get('feeding_time'), request.form.get('notes', '').strip(), feed_id))
+            if old:
+                refresh_feed_aggregates(conn, [old['day']])
+                # keep the linked stock items in step with the corrected entry
+                old_item_id, old_qty = old['inventory_item_id'], float(old['quantity'] or 0)
+                chosen = request.form.get('inventory_item_id', type=int)
+                if chosen or _feed_key(ft) != _feed_key(old['feed_type']):
+                    item = feed_inventory_item(cur, ft, chosen)
+                    item_id = item['id'] if item else None
+                else:
+                    item_id = old_item_id
+                user = getattr(current_user, 'username', '')
+                if item_id == old_item_id:
+                    delta = qty - old_qty
+                    if item_id and delta and feed_inventory_item(cur, None, item_id):
+                        post_inventory_movement(cur, item_id, 'out' if delta > 0 else 'in', abs(delta), reference=f'FEED-{feed_id}',
+                                                notes='Feed entry corrected', performed_by=user)
+                else:
+                    # moved to another item: the old item gets its quantity back, the new one is drawn down
+                    if old_item_id and old_qty and feed_inventory_item(cur, None, old_item_id):
+                        post_inventory_movement(cur, old_item_id, 'in', old_qty, reference=f'FEED-{feed_id}',
+                                                notes='Feed entry moved to another item', performed_by=user)
+                    if item_id and qty:
+                        post_inventory_movement(cur, item_id, 'out', qty, reference=f'FEED-{feed_id}',
+                                                notes='Feed entry corrected', performed_by=user)
+                    cur.execute('UPDATE feed SET inventory_item_id = ? WHERE id = ?', (item_id, feed_id))
+                refresh_feed_cover(cur, [old['feed_type'], ft], [old_item_id, item_id])
+            conn.commit(); animal_profile_cache.invalidate(); flash('Feed record updated!', 'success')
         except Exception as e:
+            conn.rollback()
             flash(f'Error: {e}', 'error')
         finally:
             conn.close()
@@ -1436,28 +4105,86 @@ def add_feed():
     debug_form('add_feed', request.form)
     if current_user.role not in ['admin', 'manager']:
         flash('Access denied.', 'error'); return redirect(url_for('feed'))
+    conn = None
     try:
         ft = request.form.get('feed_type', '').strip(); qty = float(request.form.get('quantity', '0') or 0)
         if not ft or qty <= 0:
             flash('Feed type and positive quantity required.', 'error'); return redirect(url_for('feed'))
         conn = get_db_connection(); cur = conn.cursor()
-        cur.execute('INSERT INTO feed (feed_type, quantity, animal_group, feeding_time, notes) VALUES (?, ?, ?, ?, ?)',
-                    (ft, qty, request.form.get('animal_group', ''), request.form.get('feeding_time'), request.form.get('notes', '')))
-        conn.commit(); conn.close(); flash('Feed record added!', 'success')
+        # the feed entry and its stock 'out' movement are one transaction
+        item = feed_inventory_item(cur, ft, request.form.get('inventory_item_id', type=int))
+        item_id = item['id'] if item else None
+        cur.execute('INSERT INTO feed (feed_type, quantity, animal_group, feeding_time, notes, inventory_item_id) VALUES (?, ?, ?, ?, ?, ?)',
+                    (ft, qty, request.form.get('animal_group', ''), request.form.get('feeding_time'), request.form.get('notes', ''), item_id))
+        feed_id = cur.lastrowid
+        cur.execute(f'SELECT {FEED_DAY_EXPR} FROM feed WHERE id = ?', (feed_id,))
+        refresh_feed_aggregates(conn, [cur.fetchone()[0]])
+        if item_id:
+            post_inventory_movement(cur, item_id, 'out', qty, reference=f'FEED-{feed_id}',
+                                    notes=f"Feed: {request.form.get('animal_group', '')}".strip(),
+                                    performed_by=getattr(current_user, 'username', ''))
+        refresh_feed_cover(cur, [ft])
+        conn.commit(); animal_profile_cache.invalidate(); flash('Feed record added!', 'success')
+    except InventoryMovementError as e:
+        conn.rollback()
+        flash(f'Feed not recorded: {e}', 'error')
     except Exception as e:
+        if conn is not None:
+            conn.rollback()
         flash(f'Error adding feed: {e}', 'error')
+    finally:
+        if conn is not None:
+            conn.close()
     return redirect(url_for('feed'))
 
 
 # ----- Suppliers -----
+SUPPLIER_RANKINGS = {
+    # sort key -> ORDER BY over the maintained supplier columns
+    'spend': 'total_spent DESC',
+    'orders': 'order_count DESC, total_spent DESC',
+    'lead_time': 'delivery_lead_time IS NULL, delivery_lead_time ASC',
+    'reliability': 'reliability_score IS NULL, reliability_score DESC, delivery_lead_time ASC',
+}
+
+
+def supplier_ranking(cur, sort='spend', limit=None):
+    cur.execute(f'''
+        SELECT id, company_name, products, rating, quoted_lead_time, total_spent, order_count,
+               last_order_date, delivery_lead_time, reliability_score
+        FROM supplier ORDER BY {SUPPLIER_RANKINGS[sort]}, company_name{' LIMIT ' + str(int(limit)) if limit else ''}
+    ''')
+    return rows_to_dicts(cur.fetchall())
+
+
 @app.route('/suppliers')
 @login_required
+@conditional_view('supplier')
 def suppliers():
+    def build():
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute('SELECT * FROM supplier ORDER BY created_at DESC'); suppliers = rows_to_dicts(cur.fetchall())
+        cur.execute('SELECT COUNT(*) FROM supplier'); total_suppliers = cur.fetchone()[0] or 0
+        conn.close()
+        return dict(suppliers=suppliers, total_suppliers=total_suppliers)
+    return render_template('suppliers.html', **cached('suppliers', ('supplier',), build))
+
+
+@app.route('/suppliers/ranking')
+@login_required
+def supplier_ranking_view():
+    sort = request.args.get('sort', 'spend')
+    if sort not in SUPPLIER_RANKINGS:
+        sort = 'spend'
+    limit = request.args.get('limit', type=int)
     conn = get_db_connection(); cur = conn.cursor()
-    cur.execute('SELECT * FROM supplier ORDER BY created_at DESC'); suppliers = cur.fetchall()
-    cur.execute('SELECT COUNT(*) FROM supplier'); total_suppliers = cur.fetchone()[0] or 0
-    conn.close()
-    return render_template('suppliers.html', suppliers=suppliers, total_suppliers=total_suppliers)
+    try:
+        rows = supplier_ranking(cur, sort, limit)
+    finally:
+        conn.close()
+    if request.args.get('format') == 'json':
+        return jsonify({'ok': True, 'sort': sort, 'suppliers': rows})
+    return render_template('supplier_ranking.html', rows=rows, sort=sort, sorts=list(SUPPLIER_RANKINGS))
 
 
 @app.route('/suppliers/<int:supplier_id>')
@@ -1479,8 +4206,9 @@ def edit_supplier(supplier_id):
     if request.method == 'POST':
         debug_form('edit_supplier', request.form)
         try:
-            cur.execute('UPDATE supplier SET company_name=?, contact_person=?, phone=?, email=?, products=?, address=?, payment_terms=?, rating=?, notes=? WHERE id=?',
-                        (request.form.get('company_name', '').strip(), request.form.get('contact_person', '').strip(), request.form.get('phone', '').strip(), request.form.get('email', '').strip(), request.form.get('products', '').strip(), request.form.get('address', '').strip(), request.form.get('payment_terms', 'cod').strip(), int(request.form.get('rating', '3') or 3), request.form.get('notes', '').strip(), supplier_id))
+            cur.execute('UPDATE supplier SET company_name=?, contact_person=?, phone=?, email=?, products=?, address=?, payment_terms=?, rating=?, notes=?, quoted_lead_time=? WHERE id=?',
+                        (request.form.get('company_name', '').strip(), request.form.get('contact_person', '').strip(), request.form.get('phone', '').strip(), request.form.get('email', '').strip(), request.form.get('products', '').strip(), request.form.get('address', '').strip(), request.form.get('payment_terms', 'cod').strip(), int(request.form.get('rating', '3') or 3), request.form.get('notes', '').strip(), request.form.get('quoted_lead_time', type=int), supplier_id))
+            refresh_supplier_stats(cur, [supplier_id])
             conn.commit(); flash('Supplier updated!', 'success')
         except Exception as e:
             flash(f'Error: {e}', 'error')
@@ -1545,14 +4273,17 @@ def delete_supplier(supplier_id):
 # ----- Customers -----
 @app.route('/customers')
 @login_required
+@conditional_view('customer', roles=('admin', 'accountant'))
 def customers():
     if current_user.role not in ['admin', 'accountant']:
         flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
-    conn = get_db_connection(); cur = conn.cursor()
-    cur.execute('SELECT * FROM customer ORDER BY created_at DESC'); customers = cur.fetchall()
-    cur.execute('SELECT COUNT(*) FROM customer'); total_customers = cur.fetchone()[0] or 0
-    conn.close()
-    return render_template('customers.html', customers=customers, total_customers=total_customers)
+    def build():
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute('SELECT * FROM customer ORDER BY created_at DESC'); customers = rows_to_dicts(cur.fetchall())
+        cur.execute('SELECT COUNT(*) FROM customer'); total_customers = cur.fetchone()[0] or 0
+        conn.close()
+        return dict(customers=customers, total_customers=total_customers)
+    return render_template('customers.html', **cached('customers', ('customer',), build))
 
 
 @app.route('/customers/<int:customer_id>')
@@ -1561,10 +4292,58 @@ def view_customer(customer_id):
     if current_user.role not in ['admin', 'accountant']:
         flash('Access denied.', 'error'); return redirect(url_for('customers'))
     conn = get_db_connection(); cur = conn.cursor()
-    cur.execute('SELECT * FROM customer WHERE id = ?', (customer_id,)); rec = cur.fetchone(); conn.close()
+    cur.execute('SELECT * FROM customer WHERE id = ?', (customer_id,)); rec = cur.fetchone()
+    cur.execute('SELECT id, product, total_amount, sale_date, payment_status FROM sale WHERE customer_id = ? ORDER BY sale_date DESC LIMIT 20',
+                (customer_id,)); recent_sales = cur.fetchall()
+    conn.close()
     if not rec:
         flash('Customer not found.', 'error'); return redirect(url_for('customers'))
-    return render_template('customer_view.html', customer=rec)
+    return render_template('customer_view.html', customer=rec, recent_sales=recent_sales)
+
+
+AGING_BUCKETS = (('0-30', 0, 30), ('31-60', 31, 60), ('61-90', 61, 90), ('90+', 91, None))
+
+
+def receivables_aging(cur, as_of):
+    """Unpaid sales per customer split into age buckets, in one grouped query over idx_sale_unpaid."""
+    age = "CAST(julianday(:as_of) - julianday(s.sale_date) AS INTEGER)"
+    buckets = ',\n'.join(
+        f"COALESCE(SUM(CASE WHEN {age} >= {lo}" + (f" AND {age} <= {hi}" if hi is not None else '') +
+        f" THEN s.total_amount END), 0) AS \"{label}\""
+        for label, lo, hi in AGING_BUCKETS)
+    cur.execute(f'''
+        SELECT s.customer_id, COALESCE(c.customer_name, MIN(s.customer_name)) AS customer_name,
+               COUNT(*) AS invoices, MIN(s.sale_date) AS oldest, SUM(s.total_amount) AS total,
+               {buckets}
+        FROM sale s LEFT JOIN customer c ON c.id = s.customer_id
+        WHERE {SALE_UNPAID_SQL.replace('payment_status', 's.payment_status')} AND s.sale_date <= :as_of
+        GROUP BY COALESCE(s.customer_id, 'name:' || LOWER(TRIM(s.customer_name)))
+        ORDER BY total DESC
+    ''', {'as_of': as_of})
+    rows = rows_to_dicts(cur.fetchall())
+    totals = {label: sum(r[label] for r in rows) for label, _, _ in AGING_BUCKETS}
+    totals['total'] = sum(r['total'] for r in rows)
+    return rows, totals
+
+
+@app.route('/customers/aging')
+@login_required
+def customer_aging():
+    if current_user.role not in ['admin', 'accountant']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    try:
+        as_of = date.fromisoformat(request.args.get('as_of', '')).isoformat()
+    except ValueError:
+        as_of = date.today().isoformat()
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        rows, totals = receivables_aging(cur, as_of)
+    finally:
+        conn.close()
+    if request.args.get('format') == 'json':
+        return jsonify({'ok': True, 'as_of': as_of, 'customers': rows, 'totals': totals})
+    return render_template('customer_aging.html', rows=rows, totals=totals, as_of=as_of,
+                           buckets=[b[0] for b in AGING_BUCKETS])
 
 
 @app.route('/customers/<int:customer_id>/edit', methods=['GET', 'POST'])
@@ -1576,10 +4355,16 @@ def edit_customer(customer_id):
     if request.method == 'POST':
         debug_form('edit_customer', request.form)
         try:
+            # name/type changes move this customer's sales between cube cells
+            cur.execute('SELECT id FROM sale WHERE customer_id = ?', (customer_id,))
+            owned = [r[0] for r in cur.fetchall()]
+            apply_sale_summary(cur, sale_summary_snapshot(cur, owned), -1)
             cur.execute('UPDATE customer SET customer_name=?, company=?, phone=?, email=?, address=?, customer_type=?, notes=? WHERE id=?',
                         (request.form.get('customer_name', '').strip(), request.form.get('company', '').strip(), request.form.get('phone', '').strip(), request.form.get('email', '').strip(), request.form.get('address', '').strip(), request.form.get('customer_type', 'retail').strip(), request.form.get('notes', '').strip(), customer_id))
+            apply_sale_summary(cur, sale_summary_snapshot(cur, owned), 1)
             conn.commit(); flash('Customer updated!', 'success')
         except Exception as e:
+            conn.rollback()
             flash(f'Error: {e}', 'error')
         finally:
             conn.close()
@@ -1601,6 +4386,16 @@ def add_customer():
         conn = get_db_connection(); cur = conn.cursor()
         cur.execute('INSERT INTO customer (customer_name, company, phone, email, address, customer_type, notes) VALUES (?, ?, ?, ?, ?, ?, ?)',
                     (cname, request.form.get('company', ''), phone, request.form.get('email', ''), request.form.get('address', ''), request.form.get('customer_type', 'retail'), request.form.get('notes', '')))
+        customer_id = cur.lastrowid
+        # earlier sales typed in under this name now belong to the account
+        cur.execute('SELECT id FROM sale WHERE customer_id IS NULL AND LOWER(TRIM(customer_name)) = ?', (cname.lower(),))
+        adopted = [r[0] for r in cur.fetchall()]
+        if adopted:
+            apply_sale_summary(cur, sale_summary_snapshot(cur, adopted), -1)
+            cur.execute('UPDATE sale SET customer_id = ? WHERE id IN (' + ','.join('?' for _ in adopted) + ')',
+                        [customer_id] + adopted)
+            apply_sale_summary(cur, sale_summary_snapshot(cur, adopted), 1)
+        refresh_customer_totals(cur, [customer_id])
         conn.commit(); conn.close(); flash('Customer added!', 'success')
     except Exception as e:
         flash(f'Error: {e}', 'error')
@@ -1636,8 +4431,13 @@ def delete_customer(customer_id):
             flash('Customer not found.', 'error')
             return redirect(url_for('customers'))
 
-        # delete
+        # delete (sales stay, keyed by name only)
+        cur.execute('SELECT id FROM sale WHERE customer_id = ?', (customer_id,))
+        owned = [r[0] for r in cur.fetchall()]
+        apply_sale_summary(cur, sale_summary_snapshot(cur, owned), -1)
+        cur.execute('UPDATE sale SET customer_id = NULL WHERE customer_id = ?', (customer_id,))
         cur.execute('DELETE FROM customer WHERE id = ?', (customer_id,))
+        apply_sale_summary(cur, sale_summary_snapshot(cur, owned), 1)
         conn.commit()
 
         # optional audit log (will create table if missing)
@@ -1685,19 +4485,116 @@ def delete_customer(customer_id):
 
 
 # ----- Financial -----
+# --- general ledger posting: every financial write re-posts its journal and adjusts monthly balances ---
+def _gl_account_id(cur, code, name, account_type):
+    cur.execute('INSERT OR IGNORE INTO gl_account (code, name, account_type) VALUES (?, ?, ?)', (code, name, account_type))
+    cur.execute('SELECT id FROM gl_account WHERE code = ?', (code,))
+    return cur.fetchone()[0]
+
+
+def _gl_apply_balance(cur, account_id, period, debit, credit):
+    """Add a movement to (account, month) and roll the closing balance forward for that and later months."""
+    cur.execute('''INSERT OR IGNORE INTO gl_period_balance (account_id, period, debit, credit, closing_balance)
+                   SELECT ?, ?, 0, 0, COALESCE((SELECT closing_balance FROM gl_period_balance
+                                                WHERE account_id = ? AND period < ? ORDER BY period DESC LIMIT 1), 0)''',
+                (account_id, period, account_id, period))
+    cur.execute('UPDATE gl_period_balance SET debit = debit + ?, credit = credit + ? WHERE account_id = ? AND period = ?',
+                (debit, credit, account_id, period))
+    cur.execute('UPDATE gl_period_balance SET closing_balance = closing_balance + ? WHERE account_id = ? AND period >= ?',
+                (debit - credit, account_id, period))
+    # a month whose movements were fully reversed carries no information; keep the table identical to a rebuild
+    cur.execute('DELETE FROM gl_period_balance WHERE account_id = ? AND period = ? AND ABS(debit) < 1e-9 AND ABS(credit) < 1e-9',
+                (account_id, period))
+
+
+def unpost_financial(cur, financial_id):
+    """Remove the journal for a financial row and back its lines out of the period balances."""
+    cur.execute('SELECT id, entry_date FROM gl_journal WHERE financial_id = ?', (financial_id,))
+    journal = cur.fetchone()
+    if not journal:
+        return
+    cur.execute('SELECT account_id, debit, credit FROM gl_line WHERE journal_id = ?', (journal['id'],))
+    for line in cur.fetchall():
+        _gl_apply_balance(cur, line['account_id'], journal['entry_date'][:7], -line['debit'], -line['credit'])
+    cur.execute('DELETE FROM gl_line WHERE journal_id = ?', (journal['id'],))
+    cur.execute('DELETE FROM gl_journal WHERE id = ?', (journal['id'],))
+
+
+def post_financial(cur, financial_id):
+    """(Re)post one financial row to the ledger inside the caller's transaction."""
+    unpost_financial(cur, financial_id)
+    cur.execute(f'SELECT id, txn_kind, amount, category, description, {FIN_DAY_EXPR} AS day FROM financial WHERE id = ?',
+                (financial_id,))
+    row = cur.fetchone()
+    if not row or row['txn_kind'] not in ('income', 'expense'):
+        return
+    amount = abs(row['amount'] or 0)
+    category = (row['category'] or '').strip()
+    cash_id = _gl_account_id(cur, GL_CASH_ACCOUNT, 'Cash & Bank', 'asset')
+    other_id = _gl_account_id(cur, gl_account_code(row['txn_kind'], category), category, row['txn_kind'])
+    debit_id, credit_id = (cash_id, other_id) if row['txn_kind'] == 'income' else (other_id, cash_id)
+    cur.execute('INSERT INTO gl_journal (financial_id, entry_date, description) VALUES (?, ?, ?)',
+                (financial_id, row['day'], row['description']))
+    journal_id = cur.lastrowid
+    cur.executemany('INSERT INTO gl_line (journal_id, account_id, debit, credit) VALUES (?, ?, ?, ?)',
+                    [(journal_id, debit_id, amount, 0), (journal_id, credit_id, 0, amount)])
+    _gl_apply_balance(cur, debit_id, row['day'][:7], amount, 0)
+    _gl_apply_balance(cur, credit_id, row['day'][:7], 0, amount)
+
+
+def link_financial_supplier(cur, financial_id, supplier_id=None):
+    """
+    Attribute an expense to a supplier: the one chosen on the form, else the supplier whose receipt
+    carries the same purchase reference. Refreshes the stats of the old and new supplier. Caller commits.
+    """
+    cur.execute('SELECT supplier_id, reference, txn_kind FROM financial WHERE id = ?', (financial_id,))
+    row = cur.fetchone()
+    if not row:
+        return
+    purchase_ref = (row['reference'] or '').strip().lower() or None
+    if row['txn_kind'] != 'expense':
+        supplier_id = None
+    elif not supplier_id and purchase_ref:
+        cur.execute('SELECT MIN(supplier_id) FROM inventory_transactions WHERE purchase_ref = ? AND supplier_id IS NOT NULL',
+                    (purchase_ref,))
+        supplier_id = cur.fetchone()[0]
+    cur.execute('UPDATE financial SET supplier_id = ?, purchase_ref = ? WHERE id = ?', (supplier_id, purchase_ref, financial_id))
+    refresh_supplier_stats(cur, [row['supplier_id'], supplier_id])
+
+
+def _form_supplier_id():
+    try:
+        return int(request.form.get('supplier_id') or 0) or None
+    except ValueError:
+        return None
+
+
+def gl_kind_totals(cur, period_from=None, period_to=None):
+    """Income and expense totals (natural sign) over a month range, read from gl_period_balance."""
+    cur.execute('''
+        SELECT a.account_type, COALESCE(SUM(b.credit - b.debit), 0)
+        FROM gl_period_balance b JOIN gl_account a ON a.id = b.account_id
+        WHERE a.account_type IN ('income', 'expense') AND b.period BETWEEN ? AND ?
+        GROUP BY a.account_type
+    ''', (period_from or '0000-00', period_to or '9999-99'))
+    totals = dict(cur.fetchall())
+    return float(totals.get('income', 0) or 0), -float(totals.get('expense', 0) or 0)
+
+
 @app.route('/financial')
 @login_required
+@conditional_view('financial', 'gl_period_balance', 'gl_account', 'supplier', roles=('admin', 'accountant'))
 def financial():
     if current_user.role not in ['admin', 'accountant']:
         flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
     conn = get_db_connection(); cur = conn.cursor()
     cur.execute('SELECT * FROM financial ORDER BY created_at DESC'); financial_records = cur.fetchall()
-    cur.execute('SELECT SUM(amount) FROM financial WHERE transaction_type = ?', ('income',)); total_income = cur.fetchone()[0] or 0
-    cur.execute('SELECT SUM(amount) FROM financial WHERE transaction_type = ?', ('expense',)); total_expense = cur.fetchone()[0] or 0
+    total_income, total_expense = gl_kind_totals(cur)
     net_profit = total_income - total_expense
     cur.execute('SELECT COUNT(*) FROM financial'); total_financial_records = cur.fetchone()[0] or 0
+    cur.execute('SELECT id, company_name FROM supplier ORDER BY company_name'); supplier_options = cur.fetchall()
     conn.close()
-    return render_template('financial.html', financial_records=financial_records, total_income=total_income, total_expense=total_expense, net_profit=net_profit, total_financial_records=total_financial_records)
+    return render_template('financial.html', financial_records=financial_records, total_income=total_income, total_expense=total_expense, net_profit=net_profit, total_financial_records=total_financial_records, supplier_options=supplier_options)
 
 
 @app.route('/financial/<int:record_id>')
@@ -1729,7 +4626,9 @@ def delete_financial(record_id):
             return redirect(url_for('financial'))
 
         # optional: copy rec contents to a deletion log table (audit)
+        unpost_financial(cur, record_id)
         cur.execute('DELETE FROM financial WHERE id = ?', (record_id,))
+        refresh_supplier_stats(cur, [rec['supplier_id']])
         conn.commit()
         flash(f'Financial record F-{record_id} deleted.', 'success')
     except Exception as e:
@@ -1749,18 +4648,24 @@ def edit_financial(record_id):
     if request.method == 'POST':
         debug_form('edit_financial', request.form)
         try:
-            cur.execute('UPDATE financial SET transaction_type=?, amount=?, category=?, description=?, transaction_date=?, reference=? WHERE id=?',
-                        (request.form.get('transaction_type', '').strip(), float(request.form.get('amount', '0') or 0), request.form.get('category', '').strip(), request.form.get('description', '').strip(), request.form.get('transaction_date'), request.form.get('reference', '').strip(), record_id))
+            ttype = request.form.get('transaction_type', '').strip()
+            cur.execute('UPDATE financial SET transaction_type=?, txn_kind=?, amount=?, category=?, description=?, transaction_date=?, reference=? WHERE id=?',
+                        (ttype, financial_txn_kind(ttype), float(request.form.get('amount', '0') or 0), request.form.get('category', '').strip(), request.form.get('description', '').strip(), request.form.get('transaction_date'), request.form.get('reference', '').strip(), record_id))
+            post_financial(cur, record_id)
+            link_financial_supplier(cur, record_id, _form_supplier_id())
             conn.commit(); flash('Financial record updated!', 'success')
         except Exception as e:
+            conn.rollback()
             flash(f'Error: {e}', 'error')
         finally:
             conn.close()
         return redirect(url_for('financial'))
-    cur.execute('SELECT * FROM financial WHERE id = ?', (record_id,)); rec = cur.fetchone(); conn.close()
+    cur.execute('SELECT * FROM financial WHERE id = ?', (record_id,)); rec = cur.fetchone()
+    cur.execute('SELECT id, company_name FROM supplier ORDER BY company_name'); supplier_options = cur.fetchall()
+    conn.close()
     if not rec:
         flash('Financial record not found.', 'error'); return redirect(url_for('financial'))
-    return render_template('financial_edit.html', record=rec)
+    return render_template('financial_edit.html', record=rec, supplier_options=supplier_options)
 
 
 @app.route('/add_financial', methods=['POST'])
@@ -1774,13 +4679,128 @@ def add_financial():
         if not ttype or amount <= 0 or not request.form.get('category') or not request.form.get('description'):
             flash('Required fields missing.', 'error'); return redirect(url_for('financial'))
         conn = get_db_connection(); cur = conn.cursor()
-        cur.execute('INSERT INTO financial (transaction_type, amount, category, description, transaction_date, reference) VALUES (?, ?, ?, ?, ?, ?)',
-                    (ttype, amount, request.form.get('category', '').strip(), request.form.get('description', '').strip(), request.form.get('transaction_date'), request.form.get('reference', '')))
+        cur.execute('INSERT INTO financial (transaction_type, txn_kind, amount, category, description, transaction_date, reference) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (ttype, financial_txn_kind(ttype), amount, request.form.get('category', '').strip(), request.form.get('description', '').strip(), request.form.get('transaction_date'), request.form.get('reference', '')))
+        financial_id = cur.lastrowid
+        post_financial(cur, financial_id)
+        link_financial_supplier(cur, financial_id, _form_supplier_id())
         conn.commit(); conn.close(); flash('Financial transaction added!', 'success')
     except Exception as e:
         flash(f'Error: {e}', 'error')
     return redirect(url_for('financial'))
 
+
+def _month_arg(name, default):
+    value = (request.values.get(name) or '').strip()[:7]
+    try:
+        _dt.datetime.strptime(value, '%Y-%m')
+        return value
+    except ValueError:
+        return default
+
+
+@app.route('/financial/statements')
+@login_required
+def financial_statements():
+    """P&L, balance sheet and cash flow for a month range, all read from gl_period_balance."""
+    if current_user.role not in ['admin', 'accountant']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    this_month = date.today().strftime('%Y-%m')
+    period_to = _month_arg('to', this_month)
+    period_from = _month_arg('from', period_to[:4] + '-01')
+    if period_from > period_to:
+        period_from, period_to = period_to, period_from
+
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        # profit & loss: period movements of income/expense accounts
+        cur.execute('''
+            SELECT a.code, a.name, a.account_type, SUM(b.credit - b.debit) AS net
+            FROM gl_period_balance b JOIN gl_account a ON a.id = b.account_id
+            WHERE a.account_type IN ('income', 'expense') AND b.period BETWEEN ? AND ?
+            GROUP BY a.id ORDER BY a.account_type DESC, net DESC
+        ''', (period_from, period_to))
+        pnl = rows_to_dicts(cur.fetchall())
+        for r in pnl:
+            r['amount'] = r['net'] if r['account_type'] == 'income' else -r['net']
+        total_income = sum(r['amount'] for r in pnl if r['account_type'] == 'income')
+        total_expense = sum(r['amount'] for r in pnl if r['account_type'] == 'expense')
+
+        # balance sheet: latest closing balance per account at period_to
+        cur.execute('''
+            SELECT a.code, a.name, a.account_type, b.closing_balance
+            FROM gl_account a
+            JOIN gl_period_balance b ON b.account_id = a.id
+             AND b.period = (SELECT MAX(period) FROM gl_period_balance WHERE account_id = a.id AND period <= ?)
+        ''', (period_to,))
+        closing = rows_to_dicts(cur.fetchall())
+        assets = [r for r in closing if r['account_type'] == 'asset']
+        liabilities = [dict(r, closing_balance=-r['closing_balance']) for r in closing if r['account_type'] == 'liability']
+        retained = -sum(r['closing_balance'] for r in closing if r['account_type'] in ('income', 'expense'))
+
+        # cash flow: monthly movement on the cash account
+        cur.execute('''
+            SELECT b.period, b.debit AS inflow, b.credit AS outflow, b.closing_balance
+            FROM gl_period_balance b JOIN gl_account a ON a.id = b.account_id
+            WHERE a.code = ? AND b.period BETWEEN ? AND ?
+            ORDER BY b.period
+        ''', (GL_CASH_ACCOUNT, period_from, period_to))
+        cash_flow = rows_to_dicts(cur.fetchall())
+        cur.execute('''SELECT b.closing_balance FROM gl_period_balance b JOIN gl_account a ON a.id = b.account_id
+                       WHERE a.code = ? AND b.period < ? ORDER BY b.period DESC LIMIT 1''', (GL_CASH_ACCOUNT, period_from))
+        row = cur.fetchone()
+        opening_cash = row[0] if row else 0
+    finally:
+        conn.close()
+
+    return render_template('financial_statements.html', period_from=period_from, period_to=period_to,
+                           pnl=pnl, total_income=total_income, total_expense=total_expense,
+                           assets=assets, liabilities=liabilities, retained_earnings=retained,
+                           cash_flow=cash_flow, opening_cash=opening_cash)
+
+
+@app.route('/financial/ledger/rebuild', methods=['POST'])
+@login_required
+def rebuild_ledger():
+    if current_user.role != 'admin':
+        flash('Access denied.', 'error'); return redirect(url_for('financial_statements'))
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute(f"UPDATE financial SET txn_kind = {TXN_KIND_SQL}")
+        rebuild_general_ledger(cur)
+        conn.commit()
+        flash('General ledger rebuilt from financial records.', 'success')
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.exception('Ledger rebuild failed')
+        flash(f'Error rebuilding ledger: {e}', 'error')
+    finally:
+        conn.close()
+    return redirect(url_for('financial_statements'))
+
+
+@app.route('/financial/reconcile', methods=['GET', 'POST'])
+@login_required
+def reconcile_sales():
+    """GET: sales vs financial discrepancies (JSON). POST: repair them (admin only)."""
+    fix = request.method == 'POST'
+    allowed = ['admin'] if fix else ['admin', 'accountant']
+    if current_user.role not in allowed:
+        return jsonify({'ok': False, 'error': 'Access denied.'}), 403
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        report = reconcile_sales_ledger(cur, fix=fix)
+        if fix:
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.exception('Sales reconciliation failed')
+        return jsonify({'ok': False, 'error': str(e)}), 500
+    finally:
+        conn.close()
+    counts = {k: len(v) for k, v in report.items()}
+    return jsonify({'ok': True, 'fixed': fix, 'counts': counts, **report})
+
 # ------------------- PRODUCTION ROUTES -------------------
 # ---------- Production routes (create/list/view/edit/delete/export) ----------
 # ------------------- Production: robust routes & DB helpers -------------------
@@ -1858,10 +4878,7 @@ def production_get_conn():
     """
     Return a sqlite3 Connection with row_factory set to sqlite3.Row.
     """
-    dbfile = production_db_path()
-    conn = sqlite3.connect(dbfile)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return connect_db(production_db_path())
 
 # ---------- Schema helper: ensure table + expected columns exist ----------
 def ensure_production_table_and_columns():
@@ -1925,14 +4942,23 @@ def ensure_production_table_and_columns():
                     pass
 
         # Add missing columns
+        added = False
         for col, ctype in expected.items():
             if col not in existing_cols:
                 try:
                     cur.execute(f"ALTER TABLE production ADD COLUMN {col} {ctype}")
                     conn.commit()
+                    added = True
                     current_app.logger.info("Added column %s to production", col)
                 except Exception:
                     current_app.logger.exception("Could not add column %s to production (continuing)", col)
+        if added:
+            ensure_data_version_schema(conn, ('production',))
+
+        # per-animal lookups (animal profile, history on the view page) + per-day feed analytics refresh
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_production_animal ON production(animal_tag, production_date)")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_production_day ON production({MILK_DAY_EXPR})")
+        conn.commit()
     finally:
         conn.close()
 
@@ -2067,6 +5093,7 @@ def production_list():
 
 @app.route('/production/export')
 @login_required
+@conditional_view('production', roles=('admin', 'storekeeper', 'manager'))
 def production_export():
     if getattr(current_user, 'role', None) not in ['admin', 'storekeeper', 'manager']:
         flash('Access denied.', 'error')
@@ -2115,10 +5142,214 @@ def production_export():
         conn.close()
 
 
+# ---------- Batched production writes ----------
+# Milking is bursty: several people record dozens of cows within minutes, and every entry used to
+# be its own transaction queueing for the SQLite write lock. Entries now go through one writer
+# thread per process that commits everything arriving within PRODUCTION_GROUP_COMMIT_MS together.
+PRODUCTION_GROUP_COMMIT_MS = float(os.environ.get('PRODUCTION_GROUP_COMMIT_MS', 15))
+PRODUCTION_GROUP_MAX_ROWS = int(os.environ.get('PRODUCTION_GROUP_MAX_ROWS', 500))
+PRODUCTION_WRITE_TIMEOUT = 30  # seconds a request waits for its entries to be committed
+MILKING_SESSIONS = ['Morning', 'Midday', 'Evening']
+
+
+def production_entry_row(animal_tag, quantity, production_type='milk', unit='L', production_date=None,
+                         category='', notes='', recorded_by=''):
+    """
+    Validate one production entry and return the row tuple ProductionWriter inserts.
+    Raises ValueError with a message fit for the user (missing animal, bad quantity, drug withdrawal).
+    """
+    animal_tag = (animal_tag or '').strip()
+    if not animal_tag:
+        raise ValueError('animal tag is required')
+    try:
+        qty = float(quantity or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f'{animal_tag}: quantity must be a number')
+    if qty < 0:
+        raise ValueError(f'{animal_tag}: quantity cannot be negative')
+    ptype = (production_type or 'milk').strip()
+    pdate = production_date or None
+    # drug withdrawal: milk from a treated animal must not enter the record (in-memory interval lookup)
+    if ptype.lower() == 'milk':
+        blocked_until = withdrawal_index.active_until(animal_tag, pdate)
+        if blocked_until:
+            raise ValueError(f'{animal_tag} is under drug withdrawal until {blocked_until}')
+    return (animal_tag, (category or '').strip(), ptype, qty, (unit or 'L').strip(), pdate,
+            recorded_by or '', (notes or '').strip())
+
+
+def insert_production_rows(cur, rows):
+    """Insert rows from production_entry_row(); returns the new ids in order."""
+    ids = []
+    for animal_tag, category, ptype, qty, unit, pdate, recorded_by, notes in rows:
+        cur.execute("""INSERT INTO production (animal_tag, tag, category, production_type, quantity, liters, unit, production_date, date, recorded_by, notes)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (animal_tag, animal_tag, category, ptype, qty, qty, unit, pdate, pdate, recorded_by, notes))
+        ids.append(cur.lastrowid)
+    return ids
+
+
+class ProductionWriteTimeout(Exception):
+    """write() gave up waiting; maybe_saved says whether the rows had already reached the writer."""
+
+    def __init__(self, message, maybe_saved=False):
+        super().__init__(message)
+        self.maybe_saved = maybe_saved
+
+
+class ProductionWriter:
+    """
+    Group commit for production inserts. submit() queues a list of rows and returns a Future that
+    resolves to their ids once they are committed; a background thread takes the first waiting
+    submission, keeps collecting for `window_ms` (up to `max_rows` rows) and writes the lot in one
+    transaction. If that transaction fails, each submission is retried on its own so one bad entry
+    only fails its own request. The feed aggregates and animal profile cache are refreshed once per
+    batch, before the futures resolve, so a caller that redirects to a report sees its entries.
+    A caller that times out withdraws its submission if the thread has not taken it yet; otherwise
+    the rows may still be committed and the caller is told so.
+    """
+
+    def __init__(self, window_ms=PRODUCTION_GROUP_COMMIT_MS, max_rows=PRODUCTION_GROUP_MAX_ROWS):
+        self.window = window_ms / 1000.0
+        self.max_rows = max_rows
+        self.batches = 0
+        self.rows_written = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, rows):
+        future = Future()
+        if not rows:
+            future.set_result([])
+            return future
+        self._ensure_thread()
+        self._queue.put((list(rows), future))
+        return future
+
+    def write(self, rows, timeout=PRODUCTION_WRITE_TIMEOUT):
+        future = self.submit(rows)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise ProductionWriteTimeout('The database is busy; nothing was saved. Please try again.') from None
+            raise ProductionWriteTimeout('Saving is taking longer than usual and the entries may still be saved. '
+                                         'Check the production list before entering them again.', maybe_saved=True) from None
+
+    def _ensure_thread(self):
+        # started lazily so every forked worker process gets its own thread
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='production-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if not item[1].set_running_or_notify_cancel():
+                continue  # its caller timed out and withdrew it
+            batch = [item]
+            n = len(item[0])
+            deadline = time.monotonic() + self.window
+            while n < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if not item[1].set_running_or_notify_cancel():
+                    continue
+                batch.append(item)
+                n += len(item[0])
+            try:
+                with app.app_context():
+                    self._write_batch(batch)
+            except Exception as e:
+                app.logger.exception('Production writer failed a batch of %d rows', n)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _write_batch(self, batch):
+        done, failed, days = [], [], set()
+        conn = production_get_conn()
+        try:
+            cur = conn.cursor()
+            try:
+                ids = [insert_production_rows(cur, rows) for rows, _ in batch]
+                days.update(self._days(cur, [i for chunk in ids for i in chunk]))
+                conn.commit()
+                done = list(zip(batch, ids))
+            except Exception:
+                conn.rollback()
+                if len(batch) == 1:
+                    raise
+                for item in batch:
+                    try:
+                        ids = insert_production_rows(cur, item[0])
+                        days.update(self._days(cur, ids))
+                        conn.commit()
+                        done.append((item, ids))
+                    except Exception as e:
+                        conn.rollback()
+                        failed.append((item[1], e))
+        finally:
+            conn.close()
+
+        self.batches += 1
+        self.rows_written += sum(len(ids) for _, ids in done)
+        tags = {row[0] for (rows, _), _ in done for row in rows}
+        if tags:
+            animal_profile_cache.invalidate(*tags)
+        if days:
+            refresh_feed_aggregates_safe(sorted(days))
+        for (_, future), ids in done:
+            future.set_result(ids)
+        for future, e in failed:
+            future.set_exception(e)
+
+    @staticmethod
+    def _days(cur, ids):
+        if not ids:
+            return []
+        # ids come from one write transaction, so nothing else lies in this range
+        cur.execute(f"SELECT DISTINCT {MILK_DAY_EXPR} FROM production WHERE id BETWEEN ? AND ?", (min(ids), max(ids)))
+        return [r[0] for r in cur.fetchall() if r[0]]
+
+
+production_writer = ProductionWriter()
+
+
+def _can_record_production():
+    return getattr(current_user, 'role', None) in ['admin', 'storekeeper', 'manager']
+
+
+def _session_rows(entries, production_date, production_type, unit, session, animals_map, recorded_by):
+    """Validate the entries of one milking session; returns (rows, rejected) with rejected = [{'animal_tag', 'error'}]."""
+    category_of = {tag: cat for cat, tags in animals_map.items() for tag in tags}
+    rows, rejected = [], []
+    for entry in entries:
+        tag = (entry.get('animal_tag') or entry.get('tag') or '').strip()
+        notes = (entry.get('notes') or '').strip()
+        if session:
+            notes = f'{session} session' + (f' - {notes}' if notes else '')
+        try:
+            rows.append(production_entry_row(tag, entry.get('quantity'), production_type, unit, production_date,
+                                             entry.get('category') or category_of.get(tag, ''), notes, recorded_by))
+        except ValueError as e:
+            rejected.append({'animal_tag': tag, 'error': str(e)})
+    return rows, rejected
+
+
 @app.route('/production/create', methods=['GET','POST'])
 @login_required
 def production_create():
-    if getattr(current_user, 'role', None) not in ['admin', 'storekeeper', 'manager']:
+    if not _can_record_production():
         flash('Access denied.', 'error')
         return redirect(url_for('production_list'))
 
@@ -2127,35 +5358,100 @@ def production_create():
 
     if request.method == 'POST':
         animal_tag = (request.form.get('animal_tag') or request.form.get('tag') or '').strip()
-        category = (request.form.get('category') or '').strip()
-        ptype = (request.form.get('production_type') or 'milk').strip()
-        try:
-            qty = float(request.form.get('quantity') or request.form.get('liters') or 0)
-        except Exception:
-            qty = 0
-        unit = (request.form.get('unit') or 'L').strip()
-        pdate = (request.form.get('production_date') or request.form.get('date') or None)
-        notes = (request.form.get('notes') or '').strip()
         recorded_by = getattr(current_user, 'username', '') or request.form.get('recorded_by') or ''
+        try:
+            row = production_entry_row(animal_tag, request.form.get('quantity') or request.form.get('liters'),
+                                       request.form.get('production_type'), request.form.get('unit'),
+                                       request.form.get('production_date') or request.form.get('date'),
+                                       request.form.get('category'), request.form.get('notes'), recorded_by)
+        except ValueError as e:
+            flash(f'{e}; production entry was not recorded.', 'error')
+            return redirect(url_for('production_create'))
 
-        conn = production_get_conn()
-        cur = conn.cursor()
         try:
-            cur.execute("""INSERT INTO production (animal_tag, tag, category, production_type, quantity, liters, unit, production_date, date, recorded_by, notes)
-                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                        (animal_tag, animal_tag, category, ptype, qty, qty, unit, pdate, pdate, recorded_by, notes))
-            conn.commit()
+            production_writer.write([row])
             flash('Production recorded!', 'success')
-            return redirect(url_for('production_list'))
+        except ProductionWriteTimeout as e:
+            flash(str(e), 'warning')
         except Exception as e:
-            conn.rollback()
             current_app.logger.exception("Error inserting production: %s", e)
             flash(f'Error recording production: {e}', 'error')
-            return redirect(url_for('production_list'))
-        finally:
-            conn.close()
+        return redirect(url_for('production_list'))
+
+    return render_template('production_create.html', creating=True, record=None, animals=animals_map)
+
+
+@app.route('/production/session', methods=['GET','POST'])
+@login_required
+def production_session():
+    """Record a whole milking session (one quantity per animal) in a single submission."""
+    if not _can_record_production():
+        flash('Access denied.', 'error')
+        return redirect(url_for('production_list'))
+
+    ensure_production_table_and_columns()
+    animals_map = get_animals_map()
+
+    if request.method == 'POST':
+        entries = []
+        for tag in (t for tags in animals_map.values() for t in tags):
+            qty = (request.form.get(f'qty-{tag}') or '').strip()
+            if qty:
+                entries.append({'animal_tag': tag, 'quantity': qty})
+        rows, rejected = _session_rows(entries, request.form.get('production_date') or date.today().isoformat(),
+                                       request.form.get('production_type'), request.form.get('unit'),
+                                       (request.form.get('session') or '').strip(), animals_map,
+                                       getattr(current_user, 'username', ''))
+        if not rows and not rejected:
+            flash('Enter a quantity for at least one animal.', 'warning')
+            return redirect(url_for('production_session'))
+        try:
+            production_writer.write(rows)
+        except ProductionWriteTimeout as e:
+            flash(str(e), 'warning')
+            return redirect(url_for('production_list' if e.maybe_saved else 'production_session'))
+        except Exception as e:
+            current_app.logger.exception("Error inserting production session: %s", e)
+            flash(f'Error recording the session: {e}', 'error')
+            return redirect(url_for('production_session'))
+        if rows:
+            flash(f'Recorded {len(rows)} production entries.', 'success')
+        for r in rejected:
+            flash(f"Not recorded: {r['error']}.", 'error')
+        return redirect(url_for('production_list'))
 
-    return render_template('production_create.html', creating=True, record=None, animals=animals_map)
+    return render_template('production_session.html', animals=animals_map, sessions=MILKING_SESSIONS,
+                           today=date.today().isoformat())
+
+
+@app.route('/api/production/batch', methods=['POST'])
+@login_required
+def api_production_batch():
+    """
+    Record many entries in one call:
+    {"production_date", "production_type", "unit", "session", "entries": [{"animal_tag", "quantity", "notes"}]}.
+    Valid entries are committed together; invalid ones come back in "rejected" with the reason.
+    """
+    if not _can_record_production():
+        return jsonify({'ok': False, 'error': 'Access denied'}), 403
+
+    payload = request.get_json(silent=True) or {}
+    entries = payload.get('entries')
+    if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+        return jsonify({'ok': False, 'error': 'entries must be a list of objects'}), 400
+    ensure_production_table_and_columns()
+    rows, rejected = _session_rows(entries, payload.get('production_date') or date.today().isoformat(),
+                                   payload.get('production_type'), payload.get('unit'),
+                                   (payload.get('session') or '').strip(), get_animals_map(),
+                                   getattr(current_user, 'username', ''))
+    try:
+        ids = production_writer.write(rows)
+    except ProductionWriteTimeout as e:
+        return jsonify({'ok': False, 'error': str(e), 'maybe_saved': e.maybe_saved, 'rejected': rejected}), 503
+    except Exception as e:
+        current_app.logger.exception("Error inserting production batch: %s", e)
+        return jsonify({'ok': False, 'error': str(e), 'rejected': rejected}), 500
+    return jsonify({'ok': True, 'inserted': len(ids), 'ids': ids, 'rejected': rejected})
 
 
 @app.route('/production/<int:production_id>')
@@ -2210,9 +5506,15 @@ def edit_production(production_id):
             pdate = (request.form.get('production_date') or request.form.get('date') or None)
             notes = (request.form.get('notes') or '').strip()
 
+            cur.execute(f"SELECT {MILK_DAY_EXPR} FROM production WHERE id = ?", (production_id,))
+            old_day = cur.fetchone()
             cur.execute("UPDATE production SET animal_tag=?, tag=?, category=?, production_type=?, quantity=?, liters=?, unit=?, production_date=?, date=?, notes=? WHERE id = ?",
                         (animal_tag, animal_tag, category, ptype, qty, qty, unit, pdate, pdate, notes, production_id))
+            cur.execute(f"SELECT {MILK_DAY_EXPR} FROM production WHERE id = ?", (production_id,))
+            new_day = cur.fetchone()
             conn.commit()
+            animal_profile_cache.invalidate()
+            refresh_feed_aggregates_safe([d[0] for d in (old_day, new_day) if d])
             flash('Production updated!', 'success')
             return redirect(url_for('production_list'))
 
@@ -2239,7 +5541,7 @@ def delete_production(production_id):
     ensure_production_table_and_columns()
     conn = production_get_conn(); cur = conn.cursor()
     try:
-        cur.execute("SELECT id, animal_tag, quantity, liters FROM production WHERE id = ?", (production_id,))
+        cur.execute(f"SELECT id, animal_tag, quantity, liters, {MILK_DAY_EXPR} AS day FROM production WHERE id = ?", (production_id,))
         r = cur.fetchone()
         if not r:
             if request.accept_mimetypes.accept_json:
@@ -2248,6 +5550,8 @@ def delete_production(production_id):
 
         cur.execute("DELETE FROM production WHERE id = ?", (production_id,))
         conn.commit()
+        animal_profile_cache.invalidate(r['animal_tag'])
+        refresh_feed_aggregates_safe([r['day']])
 
         # optional deletion log
         try:
@@ -2298,10 +5602,7 @@ from sqlite3 import OperationalError
 def _find_template(candidates):
     """Return first template that exists in Jinja loader, or None."""
     try:
-        loader = current_app.jinja_loader
-        if not loader or not hasattr(loader, 'list_templates'):
-            return None
-        available = set(loader.list_templates())
+        available = template_names()
         for t in candidates:
             if t in available:
                 return t
@@ -2331,6 +5632,7 @@ def inventory_list():
                 quantity   AS quantity_on_hand,
                 unit,
                 notes,
+                min_level,
                 created_at,
                 NULL       AS updated_at
             FROM inventory
@@ -2338,6 +5640,9 @@ def inventory_list():
         """)
         items = cur.fetchall()
 
+        cur.execute('SELECT item_id FROM inventory_low_stock')
+        low_stock_ids = {r[0] for r in cur.fetchall()}
+
         cur.execute('SELECT COALESCE(SUM(quantity),0) FROM inventory')
         total_quantity = cur.fetchone()[0] or 0
 
@@ -2349,12 +5654,33 @@ def inventory_list():
     return render_template('inventory_list.html',
                            items=items,
                            total_quantity=total_quantity,
-                           total_items=total_items)
+                           total_items=total_items,
+                           low_stock_ids=low_stock_ids)
+
+
+@app.route('/inventory/alerts')
+@login_required
+def inventory_alerts():
+    """Items below their reorder point, with suggested reorder quantities (reads the flag table only)."""
+    if getattr(current_user, 'role', None) not in ['admin', 'storekeeper', 'manager']:
+        return jsonify({'ok': False, 'error': 'Access denied.'}), 403
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute('''SELECT item_id, name, unit, on_hand, min_level, daily_rate, reorder_qty, flagged_at
+                       FROM inventory_low_stock ORDER BY on_hand / min_level, name''')
+        alerts = rows_to_dicts(cur.fetchall())
+    finally:
+        conn.close()
+    for a in alerts:
+        a['reorder_qty'] = math.ceil(a['reorder_qty'] or 0)
+        a['days_left'] = round(a['on_hand'] / a['daily_rate'], 1) if a['daily_rate'] else None
+    return jsonify({'ok': True, 'count': len(alerts), 'alerts': alerts})
 
 
 # EXPORT CSV
 @app.route('/inventory/export')
 @login_required
+@conditional_view('inventory', roles=('admin', 'storekeeper'))
 def inventory_export():
     if getattr(current_user, 'role', None) not in ['admin', 'storekeeper']:
         flash('Access denied.', 'error')
@@ -2417,6 +5743,10 @@ def inventory_create():
         unit = (request.form.get('unit') or '').strip()
         location = (request.form.get('location') or '').strip()
         notes = (request.form.get('notes') or '').strip()
+        try:
+            min_level = float(request.form.get('min_level') or 0)
+        except Exception:
+            min_level = 0
 
         if not item_name:
             flash('Item name is required.', 'error')
@@ -2425,9 +5755,11 @@ def inventory_create():
         try:
             conn = get_db_connection(); cur = conn.cursor()
             cur.execute(
-                'INSERT INTO inventory (name, sku, quantity, unit, location, notes) VALUES (?, ?, ?, ?, ?, ?)',
-                (item_name, sku, quantity, unit, location, notes)
+                'INSERT INTO inventory (name, sku, quantity, unit, location, notes, min_level) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (item_name, sku, quantity, unit, location, notes, min_level)
             )
+            refresh_low_stock(cur, [cur.lastrowid])
+            refresh_feed_cover(cur, [item_name])
             conn.commit()
             flash('Inventory item added!', 'success')
         except Exception as e:
@@ -2473,7 +5805,7 @@ def view_inventory(item_id):
     conn = get_db_connection(); cur = conn.cursor()
     try:
         cur.execute("""
-            SELECT id, name AS item_name, sku, location, quantity AS quantity_on_hand, unit, notes, created_at, NULL AS updated_at
+            SELECT id, name AS item_name, sku, location, quantity AS quantity_on_hand, unit, notes, min_level, created_at, NULL AS updated_at
             FROM inventory
             WHERE id = ?
         """, (item_id,))
@@ -2520,11 +5852,19 @@ def edit_inventory(item_id):
             unit = (request.form.get('unit') or '').strip()
             location = (request.form.get('location') or '').strip()
             notes = (request.form.get('notes') or '').strip()
+            try:
+                min_level = float(request.form.get('min_level') or 0)
+            except Exception:
+                min_level = 0
 
+            cur.execute('SELECT name FROM inventory WHERE id = ?', (item_id,))
+            old = cur.fetchone()
             cur.execute(
-                'UPDATE inventory SET name=?, sku=?, quantity=?, unit=?, location=?, notes=? WHERE id=?',
-                (name, sku, quantity, unit, location, notes, item_id)
+                'UPDATE inventory SET name=?, sku=?, quantity=?, unit=?, location=?, notes=?, min_level=? WHERE id=?',
+                (name, sku, quantity, unit, location, notes, min_level, item_id)
             )
+            refresh_feed_cover(cur, [name, old['name'] if old else ''], [item_id])
+            refresh_low_stock(cur, [item_id])
             conn.commit()
             flash('Inventory item updated!', 'success')
         except Exception as e:
@@ -2536,7 +5876,7 @@ def edit_inventory(item_id):
 
     try:
         cur.execute("""
-            SELECT id, name AS item_name, sku, location, quantity AS quantity_on_hand, unit, notes, created_at, NULL AS updated_at
+            SELECT id, name AS item_name, sku, location, quantity AS quantity_on_hand, unit, notes, min_level, created_at, NULL AS updated_at
             FROM inventory
             WHERE id = ?
         """, (item_id,))
@@ -2551,6 +5891,49 @@ def edit_inventory(item_id):
     return render_template('inventory_edit.html', item=rec)
 
 
+class InventoryMovementError(ValueError):
+    """A stock movement that cannot be posted (unknown item, bad quantity, insufficient stock)."""
+
+
+def post_inventory_movement(cur, item_id, tx_type, qty, reference='', notes='', performed_by='', supplier_id=None):
+    """
+    Post one ledger movement: adjust inventory.quantity and append to inventory_transactions.
+    Runs on the caller's cursor so it joins the caller's transaction; the caller commits.
+    Receipts are attributed to supplier_id, else to the supplier named in the reference.
+    Returns the new on-hand quantity.
+    """
+    if tx_type not in ['in', 'out'] or not qty or qty <= 0:
+        raise InventoryMovementError('Invalid tx_type or quantity')
+    cur.execute('SELECT id, name, quantity FROM inventory WHERE id = ?', (item_id,))
+    row = cur.fetchone()
+    if not row:
+        raise InventoryMovementError('Item not found')
+    current_qty = row['quantity'] or 0
+    new_qty = current_qty + qty if tx_type == 'in' else current_qty - qty
+    if new_qty < 0:
+        raise InventoryMovementError(f"Insufficient quantity for checkout ({row['name']}: {current_qty} on hand)")
+    cur.execute('UPDATE inventory SET quantity = ? WHERE id = ?', (new_qty, item_id))
+    purchase_ref = None
+    if tx_type == 'in':
+        party, purchase_ref = parse_movement_reference(reference)
+        supplier_id = supplier_id or supplier_id_by_name(cur, party)
+    else:
+        supplier_id = None
+    cur.execute(
+        'INSERT INTO inventory_transactions (item_id, tx_type, quantity, reference, notes, performed_by, supplier_id, purchase_ref) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (item_id, tx_type, qty, reference, notes, performed_by, supplier_id, purchase_ref)
+    )
+    refresh_feed_cover(cur, [row['name']], [item_id])
+    refresh_low_stock(cur, [item_id])
+    if supplier_id:
+        if purchase_ref:
+            # expenses booked against this purchase before the goods arrived
+            cur.execute("UPDATE financial SET supplier_id = ? WHERE supplier_id IS NULL AND purchase_ref = ? AND txn_kind = 'expense'",
+                        (supplier_id, purchase_ref))
+        refresh_supplier_stats(cur, [supplier_id])
+    return new_qty
+
+
 # TRANSACTION endpoint used by client JS -> check in / check out
 @app.route('/inventory/<int:item_id>/tx', methods=['POST'])
 @login_required
@@ -2575,44 +5958,22 @@ def inventory_tx(item_id):
     reference = data.get('reference') or ''
     notes = data.get('notes') or ''
     performed_by = data.get('performed_by') or getattr(current_user, 'username', '')
+    try:
+        supplier_id = int(data.get('supplier_id') or 0) or None
+    except (TypeError, ValueError):
+        supplier_id = None
 
     if tx_type not in ['in', 'out'] or qty <= 0:
         return jsonify({'ok': False, 'error': 'Invalid tx_type or quantity'}), 400
 
     conn = get_db_connection(); cur = conn.cursor()
     try:
-        cur.execute('SELECT id, quantity FROM inventory WHERE id = ?', (item_id,))
-        row = cur.fetchone()
-        if not row:
-            return jsonify({'ok': False, 'error': 'Item not found'}), 404
-
-        # ensure transactions table exists
-        cur.executescript("""
-        CREATE TABLE IF NOT EXISTS inventory_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            item_id INTEGER,
-            tx_type TEXT,
-            quantity INTEGER,
-            reference TEXT,
-            notes TEXT,
-            performed_by TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
-
-        current_qty = row['quantity'] if isinstance(row, dict) and 'quantity' in row else (row[1] if len(row) > 1 else 0)
-        new_qty = current_qty + qty if tx_type == 'in' else current_qty - qty
-
-        if new_qty < 0:
-            return jsonify({'ok': False, 'error': 'Insufficient quantity for checkout'}), 400
-
-        cur.execute('UPDATE inventory SET quantity = ? WHERE id = ?', (new_qty, item_id))
-        cur.execute(
-            'INSERT INTO inventory_transactions (item_id, tx_type, quantity, reference, notes, performed_by) VALUES (?, ?, ?, ?, ?, ?)',
-            (item_id, tx_type, qty, reference, notes, performed_by)
-        )
+        new_qty = post_inventory_movement(cur, item_id, tx_type, qty, reference, notes, performed_by, supplier_id)
         conn.commit()
         return jsonify({'ok': True, 'new_qty': new_qty})
+    except InventoryMovementError as e:
+        conn.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), (404 if str(e) == 'Item not found' else 400)
     except Exception as e:
         conn.rollback()
         current_app.logger.exception('inventory_tx error: %s', e)
@@ -2641,7 +6002,13 @@ def delete_inventory(item_id):
             flash('Record not found.', 'error')
             return redirect(url_for('inventory_list'))
 
+        # feed entries drawn from the item keep their history but no longer point at it
+        cur.execute('SELECT DISTINCT feed_type FROM feed WHERE inventory_item_id = ?', (item_id,))
+        feed_types = [r[0] for r in cur.fetchall()]
         cur.execute('DELETE FROM inventory WHERE id = ?', (item_id,))
+        cur.execute('UPDATE feed SET inventory_item_id = NULL WHERE inventory_item_id = ?', (item_id,))
+        refresh_feed_cover(cur, [rec['name']] + feed_types)
+        refresh_low_stock(cur, [item_id])
         conn.commit()
 
         if request.accept_mimetypes.accept_json:
@@ -2663,6 +6030,7 @@ def delete_inventory(item_id):
 # ---------- STAFF LIST ----------
 @app.route('/staff')
 @login_required
+@conditional_view('staff', 'task', roles=('admin',))
 def staff():
     if current_user.role != 'admin':
         flash('Access denied.', 'error')
@@ -2671,17 +6039,23 @@ def staff():
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute('SELECT * FROM staff ORDER BY created_at DESC')
+        refresh_staff_workload(cur)
+        conn.commit()
+        cur.execute('''
+            SELECT st.*, w.open_tasks, w.overdue_tasks, w.completed_week
+            FROM staff st LEFT JOIN staff_workload w ON w.staff_id = st.id
+            ORDER BY st.created_at DESC
+        ''')
         staff_members = cur.fetchall()
 
-        cur.execute("SELECT COUNT(*) FROM staff")
-        total_staff = cur.fetchone()[0] or 0
-
-        cur.execute("SELECT COUNT(*) FROM staff WHERE status = 'Active'")
-        active_today = cur.fetchone()[0] or 0
-
-        cur.execute("SELECT COUNT(*) FROM staff WHERE status IN ('On Leave','Leave')")
-        on_leave = cur.fetchone()[0] or 0
+        # one pass for every status count (add_staff stores lower-case statuses, the edit form title-case)
+        cur.execute('''
+            SELECT COUNT(*),
+                   COALESCE(SUM(LOWER(TRIM(status)) = 'active'), 0),
+                   COALESCE(SUM(LOWER(TRIM(status)) IN ('on leave', 'leave')), 0)
+            FROM staff
+        ''')
+        total_staff, active_today, on_leave = cur.fetchone()
 
         cur.execute("SELECT COUNT(*) FROM task WHERE status IN ('Pending','In Progress')")
         active_tasks = cur.fetchone()[0] or 0
@@ -2804,6 +6178,14 @@ def view_staff(staff_id):
     try:
         cur.execute('SELECT * FROM staff WHERE id = ?', (staff_id,))
         s = cur.fetchone()
+        workload = staff_workload_rows(cur, staff_id) if s else None
+        conn.commit()
+        cur.execute('''
+            SELECT id, title, status, priority, due_date FROM task
+            WHERE assigned_staff_id = ? AND status IN ('Pending', 'In Progress')
+            ORDER BY due_date IS NULL, due_date
+        ''', (staff_id,))
+        open_tasks = cur.fetchall()
     finally:
         conn.close()
 
@@ -2811,7 +6193,8 @@ def view_staff(staff_id):
         flash('Staff member not found.', 'error')
         return redirect(url_for('staff'))
 
-    return render_template('staff_view.html', staff=s)
+    return render_template('staff_view.html', staff=s, workload=workload, open_tasks=open_tasks,
+                           today=date.today().isoformat())
 
 
 # ---------- EDIT STAFF ----------
@@ -2836,10 +6219,11 @@ def edit_staff(staff_id):
             phone = request.form.get('phone', '').strip()
             status = request.form.get('status', 'Active').strip()
             id_number = request.form.get('id_number', '').strip()
+            salary = request.form.get('salary', type=float) or 0
 
             cur.execute(
-                'UPDATE staff SET first_name=?, last_name=?, position=?, department=?, email=?, phone=?, status=?, id_number=? WHERE id=?',
-                (first_name, last_name, position, department, email, phone, status, id_number, staff_id)
+                'UPDATE staff SET first_name=?, last_name=?, position=?, department=?, email=?, phone=?, status=?, id_number=?, salary=? WHERE id=?',
+                (first_name, last_name, position, department, email, phone, status, id_number, salary, staff_id)
             )
             conn.commit()
             flash('Staff updated!', 'success')
@@ -2889,14 +6273,15 @@ def add_staff():
         date_employed = request.form.get('date_employed') or None
         id_number = request.form.get('id_number', '').strip()
         status = request.form.get('status', 'active').strip()
+        salary = request.form.get('salary', type=float) or 0
 
         conn = get_db_connection()
         cur = conn.cursor()
 
         # IMPORTANT: make sure your staff table has the columns below (id_number, status)
         cur.execute(
-            'INSERT INTO staff (first_name, last_name, position, department, email, phone, address, dob, date_employed, id_number, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-            (fn, ln, pos, department, email, phone, address, dob, date_employed, id_number, status)
+            'INSERT INTO staff (first_name, last_name, position, department, email, phone, address, dob, date_employed, id_number, status, salary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (fn, ln, pos, department, email, phone, address, dob, date_employed, id_number, status, salary)
         )
         conn.commit()
         conn.close()
@@ -2907,12 +6292,255 @@ def add_staff():
 
     return redirect(url_for('staff'))
 
+# ---------- ATTENDANCE & PAYROLL ----------
+ATTENDANCE_STATUSES = ('present', 'absent', 'leave', 'off')
+PAYROLL_STANDARD_HOURS = 8      # a normal working day; hours beyond it are overtime
+PAYROLL_OVERTIME_RATE = 1.5     # multiple of the hourly rate paid for overtime
+PAYROLL_STAFF_SQL = "LOWER(TRIM(COALESCE(s.status, 'active'))) IN ('active', 'on leave', 'leave')"
+
+
+def _attendance_hours(clock_in, clock_out):
+    """Hours between two HH:MM times (a clock-out before the clock-in is taken as the next day)."""
+    try:
+        t_in = _dt.datetime.strptime(clock_in, '%H:%M')
+        t_out = _dt.datetime.strptime(clock_out, '%H:%M')
+    except (TypeError, ValueError):
+        return 0
+    delta = (t_out - t_in).total_seconds() / 3600.0
+    return round(delta + 24 if delta < 0 else delta, 2)
+
+
+def month_working_days(period):
+    """Mon-Sat days in a YYYY-MM month (the farm works Saturdays)."""
+    first = date.fromisoformat(period + '-01')
+    last = (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    return sum(1 for d in range(last.day) if (first + timedelta(days=d)).weekday() != 6), first, last
+
+
+def compute_pay_run(cur, period, created_by=''):
+    """
+    Compute and store a month's payroll for every active employee in one INSERT ... SELECT over
+    staff and that month's attendance. Pay = salary + overtime - (salary / working days x absent days);
+    days without an attendance row are paid. Returns the new pay_run id. Caller commits.
+    """
+    working_days, first, last = month_working_days(period)
+    cur.execute('INSERT INTO pay_run (period, working_days, created_by) VALUES (?, ?, ?)', (period, working_days, created_by))
+    run_id = cur.lastrowid
+    cur.execute(f'''
+        INSERT INTO payslip (pay_run_id, staff_id, staff_name, position, department, base_salary, days_present, days_leave,
+                             days_absent, hours_worked, overtime_hours, overtime_pay, absence_deduction, gross_pay, net_pay)
+        SELECT :run, id, staff_name, position, department, salary, present, on_leave, absent, hours, overtime,
+               overtime_pay, deduction, ROUND(salary + overtime_pay, 2), ROUND(salary + overtime_pay - deduction, 2)
+        FROM (
+            SELECT s.id, TRIM(s.first_name || ' ' || s.last_name) AS staff_name, s.position, s.department,
+                   COALESCE(s.salary, 0) AS salary,
+                   COALESCE(a.present, 0) AS present, COALESCE(a.on_leave, 0) AS on_leave, COALESCE(a.absent, 0) AS absent,
+                   COALESCE(a.hours, 0) AS hours, COALESCE(a.overtime, 0) AS overtime,
+                   ROUND(COALESCE(a.overtime, 0) * COALESCE(s.salary, 0) / (:days * :std) * :ot_rate, 2) AS overtime_pay,
+                   ROUND(MIN(COALESCE(a.absent, 0), :days) * COALESCE(s.salary, 0) / :days, 2) AS deduction
+            FROM staff s
+            LEFT JOIN (
+                SELECT staff_id,
+                       SUM(status = 'present') AS present, SUM(status = 'leave') AS on_leave, SUM(status = 'absent') AS absent,
+                       SUM(COALESCE(hours, 0)) AS hours, SUM(MAX(COALESCE(hours, 0) - :std, 0)) AS overtime
+                FROM attendance WHERE work_date BETWEEN :start AND :end
+                GROUP BY staff_id
+            ) a ON a.staff_id = s.id
+            WHERE {PAYROLL_STAFF_SQL} AND (s.date_employed IS NULL OR s.date_employed = '' OR s.date_employed <= :end)
+        )
+    ''', {'run': run_id, 'days': working_days, 'std': PAYROLL_STANDARD_HOURS, 'ot_rate': PAYROLL_OVERTIME_RATE,
+          'start': first.isoformat(), 'end': last.isoformat()})
+    return run_id
+
+
+def _attendance_date_arg():
+    try:
+        return date.fromisoformat(request.values.get('date', '')).isoformat()
+    except ValueError:
+        return date.today().isoformat()
+
+
+@app.route('/attendance', methods=['GET', 'POST'])
+@login_required
+def attendance():
+    """Day sheet: every active employee with their attendance for ?date=, saved in one batch."""
+    if current_user.role not in ['admin', 'manager']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    work_date = _attendance_date_arg()
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        if request.method == 'POST':
+            rows = []
+            for key in request.form:
+                if not key.startswith('status_'):
+                    continue
+                try:
+                    staff_id = int(key[len('status_'):])
+                except ValueError:
+                    continue
+                status = request.form.get(key, 'present')
+                if status not in ATTENDANCE_STATUSES:
+                    continue
+                clock_in = request.form.get(f'in_{staff_id}') or None
+                clock_out = request.form.get(f'out_{staff_id}') or None
+                hours = _attendance_hours(clock_in, clock_out) if status == 'present' else 0
+                rows.append((staff_id, work_date, status, clock_in, clock_out, hours))
+            # foreign keys are not enforced on these connections, so drop rows for unknown staff
+            known = set()
+            for chunk, marks in _task_id_chunks(r[0] for r in rows):
+                cur.execute(f'SELECT id FROM staff WHERE id IN ({marks})', chunk)
+                known.update(r['id'] for r in cur.fetchall())
+            rows = [r for r in rows if r[0] in known]
+            cur.executemany('''
+                INSERT INTO attendance (staff_id, work_date, status, clock_in, clock_out, hours) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(staff_id, work_date) DO UPDATE SET
+                    status = excluded.status, clock_in = excluded.clock_in, clock_out = excluded.clock_out, hours = excluded.hours
+            ''', rows)
+            conn.commit()
+            flash(f'Attendance saved for {len(rows)} staff on {work_date}.', 'success')
+            return redirect(url_for('attendance', date=work_date))
+        cur.execute(f'''
+            SELECT s.id, s.first_name, s.last_name, s.position, s.department,
+                   a.status, a.clock_in, a.clock_out, a.hours
+            FROM staff s LEFT JOIN attendance a ON a.staff_id = s.id AND a.work_date = ?
+            WHERE {PAYROLL_STAFF_SQL}
+            ORDER BY s.first_name, s.last_name
+        ''', (work_date,))
+        sheet = cur.fetchall()
+    finally:
+        conn.close()
+    return render_template('attendance.html', sheet=sheet, work_date=work_date, statuses=ATTENDANCE_STATUSES)
+
+
+@app.route('/staff/<int:staff_id>/clock', methods=['POST'])
+@login_required
+def staff_clock(staff_id):
+    """Clock a staff member in or out now (action=in|out); JSON for the directory buttons."""
+    if current_user.role not in ['admin', 'manager']:
+        return jsonify({'ok': False, 'error': 'Access denied.'}), 403
+    data = request.get_json(silent=True) or request.form
+    action = (data.get('action') or '').lower()
+    if action not in ('in', 'out'):
+        return jsonify({'ok': False, 'error': 'action must be in or out'}), 400
+    now = _dt.datetime.now()
+    work_date, clock = now.date().isoformat(), now.strftime('%H:%M')
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        # foreign keys are not enforced on these connections, so check the staff member exists
+        cur.execute('SELECT 1 FROM staff WHERE id = ?', (staff_id,))
+        if not cur.fetchone():
+            return jsonify({'ok': False, 'error': 'Staff member not found'}), 404
+        if action == 'in':
+            cur.execute('''
+                INSERT INTO attendance (staff_id, work_date, status, clock_in) VALUES (?, ?, 'present', ?)
+                ON CONFLICT(staff_id, work_date) DO UPDATE SET status = 'present', clock_in = COALESCE(clock_in, excluded.clock_in)
+            ''', (staff_id, work_date, clock))
+        else:
+            cur.execute('SELECT clock_in FROM attendance WHERE staff_id = ? AND work_date = ?', (staff_id, work_date))
+            row = cur.fetchone()
+            if not row or not row['clock_in']:
+                return jsonify({'ok': False, 'error': 'Not clocked in today'}), 400
+            cur.execute('UPDATE attendance SET clock_out = ?, hours = ? WHERE staff_id = ? AND work_date = ?',
+                        (clock, _attendance_hours(row['clock_in'], clock), staff_id, work_date))
+        conn.commit()
+        return jsonify({'ok': True, 'work_date': work_date, 'time': clock})
+    finally:
+        conn.close()
+
+
+@app.route('/payroll', methods=['GET', 'POST'])
+@login_required
+def payroll():
+    if current_user.role not in ['admin', 'accountant']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        if request.method == 'POST':
+            if current_user.role != 'admin':
+                flash('Only an admin can run payroll.', 'error'); return redirect(url_for('payroll'))
+            period = (request.form.get('period') or '')[:7]
+            try:
+                _dt.datetime.strptime(period, '%Y-%m')
+            except ValueError:
+                flash('Choose a month to run.', 'error'); return redirect(url_for('payroll'))
+            try:
+                run_id = compute_pay_run(cur, period, getattr(current_user, 'username', ''))
+                conn.commit()
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                flash(f'Payroll for {period} has already been run. Void it first to re-run.', 'error')
+                return redirect(url_for('payroll'))
+            flash(f'Payroll for {period} computed.', 'success')
+            return redirect(url_for('view_pay_run', run_id=run_id))
+        cur.execute('''
+            SELECT r.*, COUNT(p.id) AS staff_count, COALESCE(SUM(p.gross_pay), 0) AS total_gross,
+                   COALESCE(SUM(p.net_pay), 0) AS total_net
+            FROM pay_run r LEFT JOIN payslip p ON p.pay_run_id = r.id
+            GROUP BY r.id ORDER BY r.period DESC, r.id DESC
+        ''')
+        runs = cur.fetchall()
+    finally:
+        conn.close()
+    return render_template('payroll.html', runs=runs, default_period=date.today().strftime('%Y-%m'))
+
+
+@app.route('/payroll/<int:run_id>')
+@login_required
+def view_pay_run(run_id):
+    if current_user.role not in ['admin', 'accountant']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute('SELECT * FROM pay_run WHERE id = ?', (run_id,)); run = cur.fetchone()
+        cur.execute('SELECT * FROM payslip WHERE pay_run_id = ? ORDER BY staff_name', (run_id,)); slips = cur.fetchall()
+    finally:
+        conn.close()
+    if not run:
+        flash('Pay run not found.', 'error'); return redirect(url_for('payroll'))
+    return render_template('pay_run.html', run=run, slips=slips)
+
+
+@app.route('/payroll/<int:run_id>/void', methods=['POST'])
+@login_required
+def void_pay_run(run_id):
+    if current_user.role != 'admin':
+        flash('Access denied.', 'error'); return redirect(url_for('payroll'))
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute("UPDATE pay_run SET status = 'void' WHERE id = ? AND status != 'void'", (run_id,))
+        conn.commit()
+        flash(f'Pay run PR-{run_id} voided.', 'success')
+    finally:
+        conn.close()
+    return redirect(url_for('payroll'))
+
+
+@app.route('/payroll/<int:run_id>/payslip/<int:staff_id>')
+@login_required
+def view_payslip(run_id, staff_id):
+    if current_user.role not in ['admin', 'accountant']:
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute('SELECT * FROM pay_run WHERE id = ?', (run_id,)); run = cur.fetchone()
+        cur.execute('SELECT * FROM payslip WHERE pay_run_id = ? AND staff_id = ?', (run_id, staff_id)); slip = cur.fetchone()
+    finally:
+        conn.close()
+    if not run or not slip:
+        flash('Payslip not found.', 'error'); return redirect(url_for('payroll'))
+    return render_template('payslip.html', run=run, slip=slip)
+
+
 # ----- NEW: task view & edit routes (added to resolve BuildError for view/edit links) -----
+# display name for a task's assignee: the joined staff row (alias s), else the free-text label
+TASK_ASSIGNEE_SQL = "COALESCE(NULLIF(TRIM(s.first_name || ' ' || COALESCE(s.last_name, '')), ''), t.assigned_to)"
+
 @app.route('/tasks/<int:task_id>')
 @login_required
 def view_task(task_id):
     conn = get_db_connection(); cur = conn.cursor()
-    cur.execute('SELECT * FROM task WHERE id = ?', (task_id,))
+    cur.execute(f'SELECT t.*, {TASK_ASSIGNEE_SQL} AS assignee_name FROM task t '
+                'LEFT JOIN staff s ON s.id = t.assigned_staff_id WHERE t.id = ?', (task_id,))
     task = cur.fetchone()
     conn.close()
     if not task:
@@ -2980,6 +6608,17 @@ def _obj_to_plain_dict(o):
     except Exception:
         return {"id": getattr(o, "id", None), "repr": str(o)}
 
+def staff_workload_rows(cur, staff_id=None):
+    """Per-staff workload served from the staff_workload summary (stale rows refreshed first; caller commits)."""
+    refresh_staff_workload(cur)
+    sql = '''SELECT w.*, s.first_name, s.last_name, s.position FROM staff_workload w JOIN staff s ON s.id = w.staff_id'''
+    if staff_id is not None:
+        cur.execute(sql + ' WHERE w.staff_id = ?', (staff_id,))
+        return cur.fetchone()
+    cur.execute(sql + ' ORDER BY w.overdue_tasks DESC, w.open_tasks DESC, s.first_name')
+    return cur.fetchall()
+
+
 @app.route('/tasks')
 @login_required
 def tasks():
@@ -2996,33 +6635,28 @@ def tasks():
         staff_rows = cur.fetchall()
         staff_members = rows_to_objs(staff_rows, cur)
 
-        # tasks list (attribute-access objects for template loops)
-        cur.execute("SELECT * FROM task ORDER BY id DESC")
+        # top up recurring tasks (a no-op once templates are generated through the horizon)
+        if expand_task_templates(cur):
+            conn.commit()
+
+        # tasks list (attribute-access objects for template loops), assignee names joined in SQL
+        cur.execute(f"""SELECT t.*, {TASK_ASSIGNEE_SQL} AS assignee_name
+                        FROM task t LEFT JOIN staff s ON s.id = t.assigned_staff_id ORDER BY t.id DESC""")
         task_rows = cur.fetchall()
         tasks_list = rows_to_objs(task_rows, cur)
 
-        # counts
-        cur.execute("SELECT COUNT(*) FROM task WHERE status = ?", ('Pending',))
-        pending_count = cur.fetchone()[0] or 0
-        cur.execute("SELECT COUNT(*) FROM task WHERE status = ?", ('In Progress',))
-        inprogress_count = cur.fetchone()[0] or 0
-        cur.execute("SELECT COUNT(*) FROM task WHERE status = ?", ('Completed',))
-        completed_count = cur.fetchone()[0] or 0
-
-        # overdue (uses sqlite date() comparison)
-        try:
-            cur.execute("SELECT COUNT(*) FROM task WHERE due_date IS NOT NULL AND due_date < date('now')")
-            overdue_count = cur.fetchone()[0] or 0
-        except Exception:
-            overdue_count = 0
-
-        # staff_map for resolving assigned_to
-        staff_map = {}
-        for s in staff_members:
-            sid = getattr(s, 'id', None)
-            name = f"{getattr(s,'first_name','') or ''} {getattr(s,'last_name','') or ''}".strip()
-            staff_map[sid] = name
-            staff_map[str(sid)] = name
+        # counts: one GROUP BY and one range scan, both answered from idx_task_status_due
+        cur.execute("SELECT status, COUNT(*) FROM task GROUP BY status")
+        counts = dict(cur.fetchall())
+        pending_count = counts.get('Pending', 0)
+        inprogress_count = counts.get('In Progress', 0)
+        completed_count = counts.get('Completed', 0)
+        cur.execute("SELECT COUNT(*) FROM task WHERE status IN ('Pending', 'In Progress') AND due_date < ?",
+                    (date.today().isoformat(),))
+        overdue_count = cur.fetchone()[0] or 0
+
+        workload = staff_workload_rows(cur)
+        conn.commit()
 
     except Exception as e:
         # On error, fallback to demo data so page still renders
@@ -3035,7 +6669,7 @@ def tasks():
         ]
         staff_members = []
         pending_count = inprogress_count = completed_count = overdue_count = 0
-        staff_map = {}
+        workload = []
     finally:
         if conn:
             conn.close()
@@ -3051,58 +6685,321 @@ def tasks():
                            inprogress_count=inprogress_count,
                            completed_count=completed_count,
                            overdue_count=overdue_count,
-                           staff_map=staff_map)
+                           workload=workload)
+
+
+@app.route('/tasks/templates', methods=['GET', 'POST'])
+@login_required
+def task_templates():
+    """Recurring task templates; creating one materialises its upcoming tasks immediately."""
+    if current_user.role not in ['admin', 'manager']:
+        flash('Access denied.', 'error'); return redirect(url_for('tasks'))
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        if request.method == 'POST':
+            debug_form('task_templates', request.form)
+            title = request.form.get('title', '').strip()
+            frequency = request.form.get('frequency', 'daily')
+            if not title or frequency not in TASK_FREQUENCIES:
+                flash('Title and a valid frequency are required.', 'error'); return redirect(url_for('task_templates'))
+            try:
+                start_date = date.fromisoformat(request.form.get('start_date') or date.today().isoformat())
+                end_date = date.fromisoformat(request.form['end_date']) if request.form.get('end_date') else None
+            except ValueError:
+                flash('Start and end dates must be valid dates (YYYY-MM-DD).', 'error'); return redirect(url_for('task_templates'))
+            weekday = request.form.get('weekday', type=int)
+            day_of_month = request.form.get('day_of_month', type=int)
+            if end_date and end_date < start_date:
+                flash('The end date cannot be before the start date.', 'error'); return redirect(url_for('task_templates'))
+            if (weekday is not None and not 0 <= weekday <= 6) or (day_of_month is not None and not 1 <= day_of_month <= 31):
+                flash('Weekday must be 0-6 and day of month 1-31.', 'error'); return redirect(url_for('task_templates'))
+            cur.execute('''
+                INSERT INTO task_template (title, description, assigned_to, priority, category, frequency, interval,
+                                           weekday, day_of_month, start_date, end_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (title, request.form.get('description', '').strip(), request.form.get('assigned_to') or None,
+                  request.form.get('priority', 'Normal'), request.form.get('category', '').strip() or 'general', frequency,
+                  max(request.form.get('interval', 1, type=int) or 1, 1), weekday, day_of_month, start_date.isoformat(),
+                  end_date.isoformat() if end_date else None))
+            added = expand_task_templates(cur, template_ids=[cur.lastrowid])
+            conn.commit()
+            flash(f'Recurring task "{title}" created ({added} upcoming tasks scheduled).', 'success')
+            return redirect(url_for('task_templates'))
+        cur.execute('''
+            SELECT t.*, (SELECT COUNT(*) FROM task WHERE template_id = t.id AND status != 'Completed') AS open_tasks
+            FROM task_template t ORDER BY t.active DESC, t.title
+        ''')
+        templates = cur.fetchall()
+        cur.execute("SELECT id, first_name, last_name FROM staff ORDER BY first_name")
+        staff_members = cur.fetchall()
+    finally:
+        conn.close()
+    return render_template('task_templates.html', templates=templates, staff_members=staff_members,
+                           frequencies=TASK_FREQUENCIES, horizon=TASK_SCHEDULE_HORIZON_DAYS)
+
+
+@app.route('/tasks/templates/<int:template_id>/toggle', methods=['POST'])
+@login_required
+def toggle_task_template(template_id):
+    """Pause (dropping its untouched future tasks) or resume a recurring template."""
+    if current_user.role not in ['admin', 'manager']:
+        flash('Access denied.', 'error'); return redirect(url_for('tasks'))
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute('SELECT active FROM task_template WHERE id = ?', (template_id,)); row = cur.fetchone()
+        if not row:
+            flash('Template not found.', 'error'); return redirect(url_for('task_templates'))
+        today = date.today().isoformat()
+        if row['active']:
+            cur.execute("DELETE FROM task WHERE template_id = ? AND status = 'Pending' AND due_date > ?", (template_id, today))
+            cur.execute('UPDATE task_template SET active = 0, generated_until = ? WHERE id = ?', (today, template_id))
+        else:
+            cur.execute('UPDATE task_template SET active = 1 WHERE id = ?', (template_id,))
+            expand_task_templates(cur, template_ids=[template_id])
+        conn.commit()
+    finally:
+        conn.close()
+    return redirect(url_for('task_templates'))
+
+
     # Add this to app.py (near your other routes)
-from flask import request, redirect, url_for, render_template, flash, abort
+from flask import request, redirect, url_for, render_template, flash
 from flask_login import login_required
 
-@app.route('/tasks/<int:task_id>/edit', methods=['GET', 'POST'])
+TASK_STATUSES = ('Pending', 'In Progress', 'Completed')
+TASK_PRIORITIES = ('High', 'Normal', 'Low')
+
+
+def _task_id_chunks(ids, size=500):
+    """Split ids into IN-lists small enough for SQLite's bound-variable limit."""
+    ids = sorted({int(i) for i in ids})
+    for i in range(0, len(ids), size):
+        chunk = ids[i:i + size]
+        yield chunk, ','.join('?' for _ in chunk)
+
+
+def apply_task_mutations(cur, ops):
+    """
+    Apply a batch of task mutations on the caller's cursor (one transaction; the caller commits).
+    Each op is {'action': 'status' | 'assign' | 'delete', 'ids': [...], 'status' | 'assigned_to': value}.
+    Every op is validated before anything is written. Returns {action: rows affected}.
+    """
+    plan = []
+    for op in ops:
+        if not isinstance(op, dict):
+            raise ValueError('each op must be an object')
+        action = (op.get('action') or '').lower()
+        if not isinstance(op.get('ids') or [], list):
+            raise ValueError('ids must be a list')
+        try:
+            ids = [int(i) for i in (op.get('ids') or [])]
+        except (TypeError, ValueError):
+            raise ValueError('ids must be integers')
+        if not ids:
+            raise ValueError(f'no ids given for {action or "op"}')
+        if action == 'status':
+            status = op.get('status')
+            if status not in TASK_STATUSES:
+                raise ValueError(f'unknown status: {status}')
+            plan.append((action, ids, 'UPDATE task SET status = ? WHERE id IN ({})', [status]))
+        elif action == 'assign':
+            assigned_to = op.get('assigned_to')
+            plan.append((action, ids, 'UPDATE task SET assigned_to = ? WHERE id IN ({})',
+                         [str(assigned_to) if assigned_to not in (None, '') else None]))
+        elif action == 'delete':
+            plan.append((action, ids, 'DELETE FROM task WHERE id IN ({})', []))
+        else:
+            raise ValueError(f'unknown action: {action}')
+    affected = {}
+    for action, ids, sql, params in plan:
+        for chunk, marks in _task_id_chunks(ids):
+            cur.execute(sql.format(marks), params + chunk)
+            affected[action] = affected.get(action, 0) + cur.rowcount
+    return affected
+
+
+@app.route('/api/tasks/bulk', methods=['POST'])
 @login_required
-def edit_task(task_id):
-    conn = None
+def api_tasks_bulk():
+    """Bulk task changes for the board: {"ops": [...]} (or a single op) applied in one commit."""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'ok': False, 'error': 'expected a JSON object'}), 400
+    ops = data.get('ops') if isinstance(data.get('ops'), list) else [data]
+    conn = get_db_connection(); cur = conn.cursor()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        affected = apply_task_mutations(cur, ops)
+        conn.commit()
+        return jsonify({'ok': True, 'affected': affected})
+    except ValueError as e:
+        conn.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.exception('api_tasks_bulk error: %s', e)
+        return jsonify({'ok': False, 'error': str(e)}), 500
+    finally:
+        conn.close()
 
-        # GET -> show edit form
-        if request.method == 'GET':
-            cur.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-            row = cur.fetchone()
-            if not row:
-                abort(404)
-            task = rows_to_objs([row], cur)[0]
-            # Render your edit template (create task_edit.html if missing)
-            return render_template('task_edit.html', task=task)
-
-        # POST -> update fields (form field names below are examples; adapt to your form)
-        form = request.form
-        title = form.get('title') or None
-        description = form.get('description') or None
-        status = form.get('status') or None
-        assigned_to = form.get('assigned_to') or None
 
-        cur.execute("""
-            UPDATE tasks
-               SET title = ?, description = ?, status = ?, assigned_to = ?, updated_at = datetime('now')
-             WHERE id = ?
-        """, (title, description, status, assigned_to, task_id))
+@app.route('/update_task_status', methods=['POST'])
+@login_required
+def update_task_status():
+    data = request.get_json(silent=True) or request.form
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        apply_task_mutations(cur, [{'action': 'status', 'ids': [data.get('task_id')], 'status': data.get('status')}])
         conn.commit()
+        return jsonify({'success': True, 'message': f"Task marked {data.get('status')}"})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    finally:
+        conn.close()
+
 
+@app.route('/add_task', methods=['POST'])
+@login_required
+def add_task():
+    debug_form('add_task', request.form)
+    title = request.form.get('title', '').strip()
+    if not title:
+        flash('Title is required.', 'error'); return redirect(url_for('tasks'))
+    priority = request.form.get('priority', 'Normal')
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        cur.execute('INSERT INTO task (title, description, assigned_to, status, priority, due_date, category) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (title, request.form.get('description', '').strip(), request.form.get('assigned_to') or None, 'Pending',
+                     priority if priority in TASK_PRIORITIES else 'Normal', request.form.get('due_date') or None,
+                     request.form.get('category', '').strip() or 'general'))
+        conn.commit(); flash('Task created!', 'success')
+    except Exception as e:
+        flash(f'Error: {e}', 'error')
+    finally:
+        conn.close()
+    return redirect(url_for('tasks'))
+
+
+@app.route('/tasks/<int:task_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_task(task_id):
+    conn = get_db_connection(); cur = conn.cursor()
+    try:
+        if request.method == 'GET':
+            cur.execute('SELECT * FROM task WHERE id = ?', (task_id,))
+            task = cur.fetchone()
+            if not task:
+                flash('Task not found.', 'error'); return redirect(url_for('tasks'))
+            cur.execute('SELECT id, first_name, last_name FROM staff ORDER BY first_name')
+            return render_template('task_edit.html', task=task, staff_members=cur.fetchall(),
+                                   statuses=TASK_STATUSES, priorities=TASK_PRIORITIES)
+
+        debug_form('edit_task', request.form)
+        status = request.form.get('status', 'Pending')
+        priority = request.form.get('priority', 'Normal')
+        cur.execute('''
+            UPDATE task SET title = ?, description = ?, status = ?, assigned_to = ?, priority = ?, due_date = ?, category = ?
+            WHERE id = ?
+        ''', (request.form.get('title', '').strip(), request.form.get('description', '').strip(),
+              status if status in TASK_STATUSES else 'Pending', request.form.get('assigned_to') or None,
+              priority if priority in TASK_PRIORITIES else 'Normal', request.form.get('due_date') or None,
+              request.form.get('category', '').strip() or 'general', task_id))
+        conn.commit()
         flash('Task updated successfully', 'success')
         return redirect(url_for('view_task', task_id=task_id))
-
     except Exception:
         app.logger.exception("edit_task error")
-        flash('Failed to update task', 'danger')
+        flash('Failed to update task', 'error')
         return redirect(url_for('view_task', task_id=task_id))
     finally:
-        if conn:
-            conn.close()
+        conn.close()
 
 
 # ----- Reports ----
 
 # ----- Settings and user management -----
+def _profile_files():
+    if not PROFILE_DIR.exists():
+        return []
+    files = sorted(PROFILE_DIR.glob('*.prof'), key=lambda f: f.stat().st_mtime, reverse=True)
+    return [{'name': f.name, 'size': f.stat().st_size,
+             'modified': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(f.stat().st_mtime))} for f in files]
+
+
+@app.route('/settings/profiling', methods=['GET', 'POST'])
+@login_required
+def profiling_settings():
+    if current_user.role != 'admin':
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    if request.method == 'POST':
+        debug_form('profiling_settings', request.form)
+        action = request.form.get('action')
+        conn = get_db_connection(); cur = conn.cursor()
+        try:
+            if action == 'arm':
+                pattern = request.form.get('pattern', '').strip() or '.*'
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    flash(f'Invalid route pattern: {e}', 'error'); return redirect(url_for('profiling_settings'))
+                count = min(max(request.form.get('count', 1, type=int) or 1, 1), 100)
+                cur.execute('UPDATE profiling_state SET pattern = ?, remaining = ?, updated_at = CURRENT_TIMESTAMP WHERE id = 1',
+                            (pattern, count))
+                flash(f'Profiling the next {count} request(s) matching {pattern}.', 'success')
+            elif action == 'disarm':
+                cur.execute('UPDATE profiling_state SET remaining = 0, updated_at = CURRENT_TIMESTAMP WHERE id = 1')
+            elif action in ('sampling_on', 'sampling_off'):
+                cur.execute('UPDATE profiling_state SET sampling = ?, updated_at = CURRENT_TIMESTAMP WHERE id = 1',
+                            (1 if action == 'sampling_on' else 0,))
+            elif action == 'clear':
+                sampler.reset()
+                if PROFILE_DIR.exists():
+                    for f in [*PROFILE_DIR.glob('*.prof'), *PROFILE_DIR.glob('samples-*.txt')]:
+                        f.unlink(missing_ok=True)
+                flash('Profiles and samples cleared.', 'success')
+            conn.commit()
+        finally:
+            conn.close()
+        _profiling_state(refresh=True)
+        return redirect(url_for('profiling_settings'))
+    state = _profiling_state(refresh=True)
+    sample_files = sorted(PROFILE_DIR.glob('samples-*.txt')) if PROFILE_DIR.exists() else []
+    return render_template('profiling.html', state=state, profiles=_profile_files(),
+                           sample_workers=len(sample_files), sampler_running=sampler.running,
+                           sample_interval_ms=sampler.interval * 1000)
+
+
+@app.route('/settings/profiling/samples.txt')
+@login_required
+def profiling_samples():
+    """Collapsed stacks from the sampler, merged over every worker's sample file."""
+    if current_user.role != 'admin':
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    sampler.flush()
+    texts = [f.read_text(encoding='utf-8') for f in PROFILE_DIR.glob('samples-*.txt')] if PROFILE_DIR.exists() else []
+    resp = make_response(merge_collapsed(texts))
+    resp.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    return resp
+
+
+@app.route('/settings/profiling/<name>')
+@login_required
+def profiling_dump(name):
+    """One cProfile capture: collapsed stacks (default), ?view=top for the pstats table, ?download=1 for the raw dump."""
+    if current_user.role != 'admin':
+        flash('Access denied.', 'error'); return redirect(url_for('dashboard'))
+    path = PROFILE_DIR / name
+    if os.path.basename(name) != name or not name.endswith('.prof') or not path.is_file():
+        flash('Profile not found.', 'error'); return redirect(url_for('profiling_settings'))
+    if request.args.get('download'):
+        resp = make_response(path.read_bytes())
+        resp.headers['Content-Type'] = 'application/octet-stream'
+        resp.headers['Content-Disposition'] = f'attachment; filename={name}'
+        return resp
+    resp = make_response(top_functions(path) if request.args.get('view') == 'top' else collapse_pstats(path))
+    resp.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    return resp
+
+
 @app.route('/settings')
 @login_required
 def settings():
@@ -3156,13 +7053,18 @@ def delete_task():
         if not task_id:
             return jsonify({'success': False, 'message': 'Missing task_id'})
         conn = get_db_connection(); cur = conn.cursor()
-        cur.execute('DELETE FROM task WHERE id = ?', (task_id,))
+        apply_task_mutations(cur, [{'action': 'delete', 'ids': [task_id]}])
         conn.commit(); conn.close()
         return jsonify({'success': True, 'message': 'Task deleted'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
 
+if TEMPLATE_WARMUP:
+    for _name, _error in warm_templates().items():
+        print(f"Warning (template {_name}):", _error)
+
+
 if __name__ == '__main__':
     print("=" * 60); print("DL FARM MANAGEMENT SYSTEM - COMPLETE"); print("=" * 60)
     try:
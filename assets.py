@@ -0,0 +1,66 @@
+# assets.py
+"""
+Static asset bundles and the fingerprint manifest.
+
+Exports:
+ - BUNDLES: bundle name -> source files under static/, concatenated in this order
+ - AssetManifest: reads static/dist/manifest.json (written by scripts/build_assets.py) and maps
+   static filenames and bundle names to their fingerprinted copies
+
+Until the build has run there is no manifest: bundles resolve to their source files and every
+static URL stays as it is, so a fresh checkout works without a build step.
+"""
+
+import json
+import os
+import threading
+
+BUNDLES = {
+    'app.css': ['css/style.css', 'css/base.css'],
+    'app.js': ['js/base.js'],
+    'dashboard.css': ['css/dashboard.css'],
+    'dashboard.js': ['js/dashboard.js'],
+}
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+
+class AssetManifest:
+    """The parsed manifest, re-read when the file changes so a rebuild needs no restart."""
+
+    def __init__(self, static_dir):
+        self.path = os.path.join(str(static_dir), DIST_DIR, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._data = {}
+
+    def _current(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            with self._lock:
+                try:
+                    with open(self.path, encoding='utf-8') as fh:
+                        self._data = json.load(fh)
+                except (OSError, ValueError):
+                    self._data = {}
+                self._mtime = mtime
+        return self._data
+
+    @property
+    def build(self):
+        """Content hash of the whole build ('' when not built); part of page ETags and cache keys."""
+        return self._current().get('build', '')
+
+    def resolve(self, filename):
+        return self._current().get('files', {}).get(filename, filename)
+
+    def bundle_files(self, name):
+        built = self._current().get('bundles', {}).get(name)
+        return [built] if built else list(BUNDLES.get(name, ()))
+
+    @staticmethod
+    def is_fingerprinted(filename):
+        return filename.startswith(DIST_DIR + '/') and not filename.endswith('/' + MANIFEST_NAME)
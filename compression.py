@@ -0,0 +1,257 @@
+# compression.py
+"""
+Response compression.
+
+Exports:
+ - CompressionMiddleware: WSGI middleware that gzip- or brotli-encodes text responses (HTML, JSON,
+   CSV, CSS, JS, ...) for clients that accept it, including streamed responses, and serves
+   precompressed static files (<file>.br / <file>.gz next to the original) when they exist
+ - precompress(path): write those .gz (and, with brotli installed, .br) siblings for one file
+ - COMPRESSIBLE_TYPES, brotli (None when neither brotli nor brotlicffi is installed)
+
+Responses that are already encoded, marked no-transform, partial (206), bodiless or smaller than
+min_size are passed through untouched. A compressed response loses its Content-Length and its ETag
+becomes weak, since the bytes differ from the identity representation.
+"""
+
+import gzip
+import os
+import zlib
+
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+COMPRESSIBLE_TYPES = frozenset({
+    'text/html', 'text/plain', 'text/csv', 'text/css', 'text/javascript', 'text/xml',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+})
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# a streamed body is flushed to the client after at least this much new input
+FLUSH_BYTES = 16 * 1024
+
+
+def accepted_encodings(header):
+    """Encodings from an Accept-Encoding header that we can produce, best first."""
+    q = {}
+    for part in (header or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            q[name.strip()] = weight
+    found = []
+    for name in ('br', 'gzip'):
+        if name == 'br' and brotli is None:
+            continue
+        if q.get(name, q.get('*', 0.0)) > 0:
+            found.append(name)
+    return found
+
+
+def _compressor(encoding, level, brotli_quality):
+    if encoding == 'br':
+        c = brotli.Compressor(quality=brotli_quality)
+        return c.process, c.flush, c.finish
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16+15: gzip container
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers, *names):
+    names = {n.lower() for n in names}
+    return [(k, v) for k, v in headers if k.lower() not in names]
+
+
+def _add_vary(headers, token='Accept-Encoding'):
+    vary = _header(headers, 'Vary')
+    if vary is None:
+        return headers + [('Vary', token)]
+    if token.lower() in (v.strip().lower() for v in vary.split(',')):
+        return headers
+    return _without(headers, 'Vary') + [('Vary', f'{vary}, {token}')]
+
+
+def _weak_etag(headers):
+    etag = _header(headers, 'ETag')
+    if etag is None or etag.startswith('W/'):
+        return headers
+    return _without(headers, 'ETag') + [('ETag', 'W/' + etag)]
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=1024, level=6, brotli_quality=5, types=COMPRESSIBLE_TYPES,
+                 static_dir=None, static_url_path='/static'):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.types = types
+        self.static_dir = str(static_dir) if static_dir else None
+        self.static_prefix = static_url_path.rstrip('/') + '/'
+
+    @property
+    def enabled(self):
+        return self.level > 0
+
+    def __call__(self, environ, start_response):
+        if not self.enabled:
+            return self.app(environ, start_response)
+        encodings = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING'))
+        path = self._precompressed(environ, encodings)
+        if path is not None:
+            def start_precompressed(status, headers, exc_info=None):
+                return start_response(status, _add_vary(headers), exc_info)
+            return self.app(dict(environ, PATH_INFO=path), start_precompressed)
+        return self._compressed(environ, start_response, encodings[0] if encodings else None)
+
+    def _precompressed(self, environ, encodings):
+        """PATH_INFO of a fresh .br/.gz sibling of the requested static file, if there is one."""
+        path = environ.get('PATH_INFO', '')
+        if (not self.static_dir or not encodings or environ.get('REQUEST_METHOD') not in ('GET', 'HEAD')
+                or not path.startswith(self.static_prefix)):
+            return None
+        source = safe_join(self.static_dir, path[len(self.static_prefix):])
+        if source is None:
+            return None
+        try:
+            mtime = os.stat(source).st_mtime
+        except OSError:
+            return None
+        for encoding in encodings:
+            try:
+                # a sibling older than its source is stale (the file was rewritten); ignore it
+                if os.stat(source + SUFFIXES[encoding]).st_mtime >= mtime:
+                    return path + SUFFIXES[encoding]
+            except OSError:
+                continue
+        return None
+
+    def _eligible(self, environ, status, headers):
+        code = int(status.split(' ', 1)[0])
+        content_type = (_header(headers, 'Content-Type') or '').split(';')[0].strip().lower()
+        if code < 200 or code in (204, 206, 304) or content_type not in self.types:
+            return False
+        if _header(headers, 'Content-Encoding') or 'no-transform' in (_header(headers, 'Cache-Control') or ''):
+            return False
+        return environ.get('REQUEST_METHOD') != 'HEAD'
+
+    def _compressed(self, environ, start_response, encoding):
+        state = {}
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            if exc_info and state.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            state.update(status=status, headers=list(headers), exc_info=exc_info)
+            return written.append  # the legacy write() callable: buffered ahead of the body
+
+        body = self.app(environ, capture)
+        return self._stream(environ, start_response, encoding, body, state, written)
+
+    def _stream(self, environ, start_response, encoding, body, state, written):
+        chunks = iter(body)
+        try:
+            pending, size = list(written), sum(map(len, written))
+            while 'status' not in state:  # start_response may be deferred to the first chunk
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(chunk)
+                size += len(chunk)
+            status, headers = state.get('status', '500 INTERNAL SERVER ERROR'), state.get('headers', [])
+            eligible = self._eligible(environ, status, headers)
+            if eligible:
+                headers = _add_vary(headers)
+            if encoding and status.startswith('304'):
+                headers = _weak_etag(headers)
+            length = _header(headers, 'Content-Length')
+            if not (eligible and encoding) or (length is not None and int(length) < self.min_size):
+                state['sent'] = True
+                start_response(status, headers, state.get('exc_info'))
+                yield from pending
+                yield from chunks
+                return
+
+            # read ahead until the body is known to reach min_size (or has ended)
+            ended = False
+            while size < self.min_size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    ended = True
+                    break
+                pending.append(chunk)
+                size += len(chunk)
+            if ended and size < self.min_size:
+                state['sent'] = True
+                start_response(status, headers, state.get('exc_info'))
+                yield b''.join(pending)
+                return
+
+            headers = _weak_etag(_without(headers, 'Content-Length')) + [('Content-Encoding', encoding)]
+            state['sent'] = True
+            start_response(status, headers, state.get('exc_info'))
+            compress, flush, finish = _compressor(encoding, self.level, self.brotli_quality)
+            out = compress(b''.join(pending))
+            unflushed = 0
+            for chunk in chunks:
+                out += compress(chunk)
+                unflushed += len(chunk)
+                if unflushed >= FLUSH_BYTES:
+                    yield out + flush()
+                    out, unflushed = b'', 0
+            yield out + finish()
+        finally:
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
+
+
+def precompress(path, min_size=256, level=9, brotli_quality=11):
+    """
+    Write path.gz (and path.br when brotli is installed) unless they are already up to date or
+    would not be smaller than the file. Returns the encodings written.
+    """
+    mtime = os.stat(path).st_mtime
+    if os.path.getsize(path) < min_size:
+        return []
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    encoders = {'gzip': lambda d: gzip.compress(d, compresslevel=level, mtime=0)}
+    if brotli is not None:
+        encoders['br'] = lambda d: brotli.compress(d, quality=brotli_quality)
+    written = []
+    for encoding, encode in encoders.items():
+        target = path + SUFFIXES[encoding]
+        try:
+            if os.stat(target).st_mtime >= mtime:
+                continue
+        except OSError:
+            pass
+        packed = encode(data)
+        if len(packed) >= len(data):
+            continue
+        with open(target + '.tmp', 'wb') as fh:
+            fh.write(packed)
+        os.replace(target + '.tmp', target)
+        written.append(encoding)
+    return written
@@ -0,0 +1,204 @@
+# page_cache.py
+"""
+Versioned cache for page data and rendered template fragments.
+
+Exports:
+ - PageCache: in-process LRU bounded by entry count and size, optionally backed by a SQLite file
+   that several worker processes share, so one worker's miss becomes every worker's hit
+ - FragmentCacheExtension: the Jinja tag  {% cache 'name', 'table', ... %} ... {% endcache %}
+
+Nothing is invalidated explicitly. Callers build keys that include the data version of every table
+the entry depends on (see data_version in app.py); a write bumps the version, the next lookup
+misses and the old entry simply ages out of the LRU (and out of the shared file).
+Values must be picklable (plain dicts/lists/str, not sqlite3.Row) and are shared between
+requests, so treat what get() returns as read-only.
+"""
+
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+# prune the shared file back to shared_max_entries after this many writes to it
+SHARED_PRUNE_EVERY = 100
+
+
+class PageCache:
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024, shared_path=None, shared_max_entries=4096):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared_path = shared_path
+        self.shared_max_entries = shared_max_entries
+        self.hits = self.misses = self.shared_hits = 0
+        self._bytes = 0
+        self._entries = OrderedDict()  # digest -> (value, size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shared_writes = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def digest(key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return (True, value) on a hit, (False, None) on a miss."""
+        if not self.enabled:
+            return False, None
+        digest = self.digest(key)
+        with self._lock:
+            hit = self._entries.get(digest)
+            if hit is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return True, hit[0]
+        blob = self._shared_get(digest)
+        if blob is not None:
+            value = pickle.loads(blob)
+            self._store(digest, value, len(blob))
+            with self._lock:
+                self.hits += 1
+                self.shared_hits += 1
+            return True, value
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        try:
+            blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        digest = self.digest(key)
+        self._store(digest, value, len(blob))
+        self._shared_put(digest, blob)
+
+    def get_or_build(self, key, build):
+        found, value = self.get(key)
+        if found:
+            return value
+        value = build()
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        conn = self._shared_conn()
+        if conn is not None:
+            try:
+                conn.execute('DELETE FROM page_cache')
+                conn.commit()
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits,
+                    'misses': self.misses, 'shared_hits': self.shared_hits}
+
+    def _store(self, digest, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(digest, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[digest] = (value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    # --- shared SQLite file (one connection per thread; failures only cost a miss) ---
+    def _shared_conn(self):
+        if not self.shared_path:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = sqlite3.connect(self.shared_path, timeout=1.0)
+                conn.execute('PRAGMA journal_mode = wal')
+                conn.execute('PRAGMA synchronous = off')
+                conn.execute('''CREATE TABLE IF NOT EXISTS page_cache (
+                                    key TEXT PRIMARY KEY, value BLOB NOT NULL, stored_at REAL NOT NULL)''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_page_cache_stored ON page_cache(stored_at)')
+                conn.commit()
+            except sqlite3.Error:
+                return None
+            self._local.conn = conn
+        return conn
+
+    def _shared_get(self, digest):
+        conn = self._shared_conn()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT value FROM page_cache WHERE key = ?', (digest,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def _shared_put(self, digest, blob):
+        conn = self._shared_conn()
+        if conn is None:
+            return
+        try:
+            conn.execute('INSERT OR REPLACE INTO page_cache (key, value, stored_at) VALUES (?, ?, ?)',
+                         (digest, blob, time.time()))
+            self._shared_writes += 1
+            if self._shared_writes % SHARED_PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM page_cache WHERE stored_at < (SELECT stored_at FROM page_cache '
+                             'ORDER BY stored_at DESC LIMIT 1 OFFSET ?)', (self.shared_max_entries,))
+            conn.commit()
+        except sqlite3.Error:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+
+
+class FragmentCacheExtension(Extension):
+    """
+    {% cache 'sales.content', 'sale', 'customer' %} ... {% endcache %}
+    The body is rendered only on a miss. The key comes from environment.fragment_cache_key(name,
+    tables), which the application sets (together with environment.fragment_cache) so that keys
+    carry the request arguments, the user's role and the tables' data versions.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_key=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        cache, make_key = self.environment.fragment_cache, self.environment.fragment_cache_key
+        if cache is None or make_key is None or not cache.enabled:
+            return caller()
+        key = make_key(args[0], tuple(args[1:]))
+        found, html = cache.get(key)
+        if not found:
+            html = str(caller())
+            cache.put(key, html)
+        return Markup(html)
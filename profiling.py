@@ -0,0 +1,168 @@
+# profiling.py
+"""
+Request profiling for the admin profiling page (Settings -> System).
+
+Exports:
+ - SamplingProfiler: a background thread that samples the stacks of threads currently serving a
+   request; cheap enough to leave on in production
+ - collapse_pstats(path): a cProfile dump as collapsed stacks
+ - merge_collapsed(texts): add several collapsed-stack texts together
+ - top_functions(path, limit): the classic pstats table, sorted by cumulative time
+
+Collapsed stacks ("outer;inner;leaf weight" per line) are what flamegraph.pl, speedscope and
+inferno read. cProfile only records caller -> callee edges, so the stacks collapse_pstats()
+rebuilds split each function's time across its callers in proportion to the edge times.
+"""
+
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+
+MAX_STACK_DEPTH = 64
+# cProfile paths whose weight falls below this (microseconds) are dropped from the collapsed output
+MIN_WEIGHT_US = 1
+
+
+def _pstats_label(func):
+    filename, lineno, name = func
+    if filename == '~':  # built-ins
+        return name.strip('<>').replace(' ', '_')
+    return f'{os.path.basename(filename)}:{name}:{lineno}'
+
+
+def _frame_label(code):
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}'
+
+
+def collapse_pstats(path):
+    """Rebuild approximate call stacks from a .prof file; weights are self time in microseconds."""
+    stats = pstats.Stats(str(path)).stats
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+    out = Counter()
+
+    def walk(func, path, on_path, scale):
+        _, _, tt, ct, _ = stats[func]
+        path = path + (_pstats_label(func),)
+        weight = int(tt * scale * 1e6)
+        if weight >= MIN_WEIGHT_US:
+            out[';'.join(path)] += weight
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for child, edge_ct in children.get(func, ()):
+            child_ct = stats[child][3]
+            if child in on_path or not child_ct:
+                continue
+            child_scale = scale * min(edge_ct / child_ct, 1.0)
+            if child_ct * child_scale * 1e6 >= MIN_WEIGHT_US:
+                walk(child, path, on_path | {child}, child_scale)
+
+    for root in (f for f, v in stats.items() if not v[4]):
+        walk(root, (), frozenset([root]), 1.0)
+    return ''.join(f'{stack} {weight}\n' for stack, weight in out.most_common())
+
+
+def merge_collapsed(texts):
+    """Sum collapsed-stack texts (e.g. the per-worker sample files) into one."""
+    total = Counter()
+    for text in texts:
+        for line in text.splitlines():
+            stack, _, weight = line.rpartition(' ')
+            if stack and weight.isdigit():
+                total[stack] += int(weight)
+    return ''.join(f'{stack} {weight}\n' for stack, weight in total.most_common())
+
+
+def top_functions(path, limit=40):
+    buf = io.StringIO()
+    pstats.Stats(str(path), stream=buf).strip_dirs().sort_stats('cumulative').print_stats(limit)
+    return buf.getvalue()
+
+
+class SamplingProfiler:
+    """
+    Every `interval` seconds, record the stack of each thread registered with track() (the threads
+    serving requests; idle workers are never sampled). Counts accumulate in memory and are written
+    to dump_path every `flush_every` seconds and on stop(), so every worker process leaves one file.
+    """
+
+    def __init__(self, interval=0.02, flush_every=15.0):
+        self.interval = interval
+        self.flush_every = flush_every
+        self.counts = Counter()
+        self.dump_path = None
+        self._active = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def track(self, ident):
+        self._active.add(ident)
+
+    def untrack(self, ident):
+        self._active.discard(ident)
+
+    def start(self, dump_path=None):
+        if self.running:
+            return
+        self.dump_path = dump_path
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout=2)
+        self._thread = None
+        self.flush()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident in list(self._active):
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                with self._lock:
+                    self.counts[';'.join(reversed(stack))] += 1
+
+    def _run(self):
+        ticks_per_flush = max(int(self.flush_every / self.interval), 1)
+        ticks = 0
+        while not self._stop.wait(self.interval):
+            self._sample()
+            ticks += 1
+            if ticks % ticks_per_flush == 0:
+                self.flush()
+
+    def collapsed(self):
+        with self._lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+    def flush(self):
+        if not self.dump_path:
+            return
+        tmp = f'{self.dump_path}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                fh.write(self.collapsed())
+            os.replace(tmp, self.dump_path)
+        except OSError:
+            pass
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
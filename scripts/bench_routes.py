@@ -0,0 +1,173 @@
+"""
+Benchmark the hot routes through the Flask test client against a generated scratch database.
+
+    python scripts/generate_farm_data.py --db /tmp/farm-bench.db
+    python scripts/bench_routes.py --db /tmp/farm-bench.db                          # report
+    python scripts/bench_routes.py --db /tmp/farm-bench.db --json bench.json        # save results
+    python scripts/bench_routes.py --db /tmp/farm-bench.db --baseline bench.json    # fail on regressions
+
+Each route is warmed up, then timed --repeat times (p50 / p95 wall time). Query count and DB time
+come from the Server-Timing header the app sets, and peak Python memory from one extra request
+under tracemalloc. With --baseline, a route whose p95 grows by more than --tolerance (and by more
+than --noise-ms), or that issues more queries than before, is a regression and the exit status is 1.
+inventory_tx posts alternating check-ins/check-outs of one unit, so stock levels end where they began.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+LIST_PAGES = ['animals', 'sales', 'customers', 'suppliers', 'financial', 'production', 'inventory', 'stores',
+              'staff', 'tasks', 'medical', 'breeding', 'feed', 'attendance', 'payroll']
+REPORT_PAGES = ['sales/analytics', 'feed/analytics', 'customers/aging', 'financial/statements', 'inventory/alerts',
+                'suppliers/ranking', 'medical/followups', 'tasks/templates']
+
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def build_routes(item_id):
+    routes = [('dashboard', 'GET', '/dashboard', None)]
+    routes += [(page, 'GET', f'/{page}', None) for page in LIST_PAGES + REPORT_PAGES]
+    routes += [
+        ('production/export', 'GET', '/production/export', None),
+        ('inventory/export', 'GET', '/inventory/export', None),
+        ('sales/invoices.zip', 'GET', f"/sales/invoices.zip?month={date.today().strftime('%Y-%m')}", None),
+    ]
+    if item_id:
+        routes.append(('inventory_tx', 'POST', f'/inventory/{item_id}/tx', 'tx'))
+    return routes
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)]
+
+
+def bench_route(client, method, url, body, repeat, warmup, memory):
+    counter = {'n': 0}
+
+    def call():
+        kwargs = {}
+        if body == 'tx':
+            counter['n'] += 1
+            kwargs['json'] = {'tx_type': 'in' if counter['n'] % 2 else 'out', 'quantity': 1, 'reference': 'bench'}
+        resp = client.open(url, method=method, **kwargs)
+        resp.get_data()
+        return resp
+
+    for _ in range(warmup):
+        call()
+    times, db_ms, queries, status = [], [], [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        resp = call()
+        times.append((time.perf_counter() - started) * 1000.0)
+        status = resp.status_code
+        m = SERVER_TIMING_DB.search(resp.headers.get('Server-Timing', ''))
+        if m:
+            db_ms.append(float(m.group(1)))
+            queries.append(int(m.group(2)))
+    peak_kb = None
+    if memory:
+        tracemalloc.start()
+        call()
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024.0
+        tracemalloc.stop()
+    return {
+        'status': status,
+        'p50_ms': round(percentile(times, 50), 2),
+        'p95_ms': round(percentile(times, 95), 2),
+        'db_ms': round(percentile(db_ms, 50), 2) if db_ms else None,
+        'queries': max(queries) if queries else None,
+        'peak_kb': round(peak_kb, 1) if peak_kb is not None else None,
+    }
+
+
+def compare(results, baseline, tolerance, noise_ms):
+    problems = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        grew = r['p95_ms'] - base['p95_ms']
+        if grew > noise_ms and r['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            problems.append(f"{name}: p95 {base['p95_ms']} -> {r['p95_ms']} ms")
+        if r['queries'] is not None and base.get('queries') is not None and r['queries'] > base['queries']:
+            problems.append(f"{name}: queries {base['queries']} -> {r['queries']}")
+    return problems
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', required=True, help='scratch database from scripts/generate_farm_data.py')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--only', help='regex; benchmark only the routes whose name matches')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative p95 growth (default 0.25)')
+    parser.add_argument('--noise-ms', type=float, default=2.0, help='ignore p95 growth below this many ms')
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin123')
+    args = parser.parse_args(argv)
+
+    db = os.path.abspath(args.db)
+    if db == os.path.abspath(os.path.join(ROOT, 'database', 'farm.db')):
+        parser.error('refusing to benchmark against the live database/farm.db (inventory_tx writes to it)')
+    if not os.path.exists(db):
+        parser.error(f'{db} does not exist; run scripts/generate_farm_data.py first')
+    os.environ['DATABASE'] = db
+    os.environ.setdefault('SLOW_QUERY_MS', '1e9')
+    os.environ.setdefault('REQUEST_LOG_LEVEL', 'WARNING')
+    import app as farm  # noqa: E402
+
+    farm.app.config['TESTING'] = True
+    client = farm.app.test_client()
+    resp = client.post('/login', data={'username': args.user, 'password': args.password})
+    if resp.status_code != 302 or '/login' in resp.headers.get('Location', ''):
+        print(f'login as {args.user} failed', file=sys.stderr)
+        return 2
+    conn = farm.get_db_connection()
+    try:
+        row = conn.execute('SELECT MIN(id) FROM inventory').fetchone()
+    finally:
+        conn.close()
+
+    results = {}
+    print(f"{'route':<24}{'status':>7}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'db ms':>9}{'peak KB':>10}")
+    for name, method, url, body in build_routes(row[0] if row else None):
+        if args.only and not re.search(args.only, name):
+            continue
+        r = results[name] = bench_route(client, method, url, body, args.repeat, args.warmup, not args.no_memory)
+        print(f"{name:<24}{r['status']:>7}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['queries'] if r['queries'] is not None else '-':>9}{r['db_ms'] if r['db_ms'] is not None else '-':>9}"
+              f"{r['peak_kb'] if r['peak_kb'] is not None else '-':>10}")
+
+    failed = [name for name, r in results.items() if r['status'] is None or r['status'] >= 400]
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    status = 0
+    if failed:
+        print(f"error responses: {', '.join(failed)}", file=sys.stderr)
+        status = 1
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as fh:
+            problems = compare(results, json.load(fh), args.tolerance, args.noise_ms)
+        for p in problems:
+            print(f'REGRESSION {p}', file=sys.stderr)
+        status = status or (1 if problems else 0)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
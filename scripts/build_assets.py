@@ -0,0 +1,170 @@
+"""
+Build the static assets: minify, bundle and fingerprint everything under static/ into static/dist.
+
+    python scripts/build_assets.py            # build (run on every deploy, before the workers restart)
+    python scripts/build_assets.py --clean    # also delete dist files the new manifest no longer uses
+
+Every CSS/JS file is minified and every static file is copied to dist/<dir>/<name>.<hash>.<ext>;
+the bundles in assets.BUNDLES are concatenated from the minified sources. static/dist/manifest.json
+maps original names and bundle names to the fingerprinted files, which the app serves with
+far-future cache headers (url_for('static', ...) and asset_urls() resolve through the manifest).
+Old fingerprinted files are kept unless --clean is given, so pages already rendered with the
+previous names keep working until they are reloaded.
+Finally every compressible file in dist/, reports/ and exports/ gets .gz (and, with brotli
+installed, .br) siblings at maximum compression, which the compression middleware serves as is.
+JS is minified with rjsmin when installed; otherwise only indentation, blank lines and whole-line
+comments are dropped (no tokenizer, so nothing inside strings or regexes is touched).
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from assets import BUNDLES, DIST_DIR, MANIFEST_NAME  # noqa: E402
+from compression import COMPRESSIBLE_TYPES, SUFFIXES, brotli, precompress  # noqa: E402
+
+STATIC = os.path.join(ROOT, 'static')
+# generated content, not assets: reports/ and exports/ are written at run time
+SKIP_DIRS = {DIST_DIR, 'reports', 'exports'}
+PRECOMPRESS_DIRS = (DIST_DIR, 'reports', 'exports')
+HASH_LEN = 10
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+CSS_STRING = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    parts = CSS_STRING.split(text)
+    for i in range(0, len(parts), 2):  # odd indexes are string literals; leave them alone
+        chunk = re.sub(r'\s+', ' ', parts[i])
+        chunk = re.sub(r'\s*([{};,>])\s*', r'\1', chunk)
+        parts[i] = re.sub(r':\s+', ':', chunk).replace(';}', '}')
+    return ''.join(parts).strip() + '\n'
+
+
+def minify_js(text):
+    if rjsmin is not None:
+        return rjsmin.jsmin(text) + '\n'
+    out, in_template = [], False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not in_template and (not stripped or stripped.startswith('//')):
+            continue
+        out.append(line if in_template else stripped)
+        # a line with an odd number of unescaped backticks opens or closes a template literal
+        if len(re.findall(r'(?<!\\)`', line)) % 2:
+            in_template = not in_template
+    return '\n'.join(out) + '\n'
+
+
+def _minified(rel, data):
+    if rel.endswith('.css'):
+        return minify_css(data.decode('utf-8')).encode('utf-8')
+    if rel.endswith('.js'):
+        return minify_js(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def _fingerprinted(rel, data):
+    stem, ext = os.path.splitext(rel)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LEN]
+    return f'{DIST_DIR}/{stem}.{digest}{ext}'
+
+
+def _write(rel, data):
+    path = os.path.join(STATIC, *rel.split('/'))
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+        fh.write(data)
+
+
+def static_sources():
+    for dirpath, dirnames, filenames in os.walk(STATIC):
+        if os.path.samefile(dirpath, STATIC):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for name in sorted(filenames):
+            yield os.path.relpath(os.path.join(dirpath, name), STATIC).replace(os.sep, '/')
+
+
+def build(clean=False):
+    files, bundles, minified = {}, {}, {}
+    for rel in static_sources():
+        with open(os.path.join(STATIC, rel), 'rb') as fh:
+            data = _minified(rel, fh.read())
+        minified[rel] = data
+        files[rel] = _fingerprinted(rel, data)
+        _write(files[rel], data)
+    for name, sources in BUNDLES.items():
+        missing = [s for s in sources if s not in minified]
+        if missing:
+            raise SystemExit(f'bundle {name}: missing {", ".join(missing)}')
+        data = b''.join(minified[s] for s in sources)
+        bundles[name] = _fingerprinted(f'bundles/{name}', data)
+        _write(bundles[name], data)
+
+    build_id = hashlib.sha256(json.dumps([files, bundles], sort_keys=True).encode()).hexdigest()[:HASH_LEN]
+    manifest = {'build': build_id, 'files': files, 'bundles': bundles}
+    path = os.path.join(STATIC, DIST_DIR, MANIFEST_NAME)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+    removed = 0
+    if clean:
+        keep = set(files.values()) | set(bundles.values()) | {f'{DIST_DIR}/{MANIFEST_NAME}'}
+        for dirpath, _, filenames in os.walk(os.path.join(STATIC, DIST_DIR)):
+            for name in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, name), STATIC).replace(os.sep, '/')
+                base, ext = os.path.splitext(rel)
+                if rel not in keep and not (ext in SUFFIXES.values() and base in keep):
+                    os.remove(os.path.join(dirpath, name))
+                    removed += 1
+    return manifest, removed
+
+
+def precompress_static():
+    """Write .gz/.br siblings for the compressible files under PRECOMPRESS_DIRS; returns how many."""
+    count = 0
+    for top in PRECOMPRESS_DIRS:
+        for dirpath, _, filenames in os.walk(os.path.join(STATIC, top)):
+            for name in filenames:
+                if name == MANIFEST_NAME or os.path.splitext(name)[1] in SUFFIXES.values() or name.endswith('.tmp'):
+                    continue
+                if mimetypes.guess_type(name)[0] in COMPRESSIBLE_TYPES:
+                    count += len(precompress(os.path.join(dirpath, name)))
+    return count
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clean', action='store_true', help='delete dist files not in the new manifest')
+    args = parser.parse_args(argv)
+    manifest, removed = build(args.clean)
+    compressed = precompress_static()
+    for name, built in sorted(manifest['bundles'].items()):
+        source = sum(os.path.getsize(os.path.join(STATIC, s)) for s in BUNDLES[name])
+        size = os.path.getsize(os.path.join(STATIC, built))
+        print(f'{name:<16}{source:>9} -> {size:>8} bytes  {built}')
+    print(f"{len(manifest['files'])} files fingerprinted, build {manifest['build']}"
+          + (f', {removed} stale files removed' if args.clean else '')
+          + ('' if rjsmin else ' (rjsmin not installed: JS only whitespace-trimmed)'))
+    print(f"{compressed} precompressed copies written" + ('' if brotli else ' (brotli not installed: gzip only)'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,45 @@
+"""
+Precompile every template into the Jinja bytecode cache that the workers load at startup.
+
+    python scripts/compile_templates.py            # run on every deploy, before the workers restart
+    python scripts/compile_templates.py --clean    # drop the old cache first
+    python scripts/compile_templates.py --strict   # exit 1 when a template does not compile
+
+Templates are compiled through the app's own Jinja environment (same extensions, globals and
+TEMPLATE_CACHE_DIR), so the cached code is exactly what the workers would have produced. Cache
+entries are keyed by template name and source checksum: a stale entry is never used, it is just
+recompiled on first load.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clean', action='store_true', help='empty the bytecode cache before compiling')
+    parser.add_argument('--strict', action='store_true', help='exit 1 if any template fails to compile')
+    args = parser.parse_args(argv)
+
+    os.environ['TEMPLATE_WARMUP'] = '0'  # compile here, with timing, rather than during the import
+    import app as farm  # noqa: E402
+
+    if args.clean:
+        farm.app.jinja_env.bytecode_cache.clear()
+    started = time.perf_counter()
+    errors = farm.warm_templates()
+    elapsed = (time.perf_counter() - started) * 1000.0
+    compiled = sum(1 for n in farm.template_names() if n.endswith('.html')) - len(errors)
+    for name, error in sorted(errors.items()):
+        print(f'FAILED {name}: {error}', file=sys.stderr)
+    print(f'{compiled} templates compiled in {elapsed:.0f} ms into {farm.TEMPLATE_CACHE_DIR}'
+          + (f', {len(errors)} failed' if errors else ''))
+    return 1 if errors and args.strict else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
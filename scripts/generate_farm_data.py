@@ -0,0 +1,281 @@
+"""
+Fill a scratch SQLite database with deterministic synthetic farm data for benchmarking.
+
+    python scripts/generate_farm_data.py --db /tmp/farm-bench.db                  # full scale
+    python scripts/generate_farm_data.py --db /tmp/farm-small.db --preset small   # quick runs
+    python scripts/generate_farm_data.py --db /tmp/farm-bench.db --seed 7 --years 2 --overwrite
+
+The schema is the checked-in database/farm.db's (DDL only: some tables, e.g. inventory, are
+never created by app.py itself), brought up to date by importing app.py with DATABASE pointed at
+--db, so it always matches the app. Raw rows are bulk-inserted in one transaction; derived tables (ledger, sales cube, feed/milk
+aggregates, customer/supplier stats, low-stock) are then rebuilt with the app's own functions.
+The same seed and sizes always produce the same data.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PRESETS = {
+    'full': dict(animals=500, years=5, financial=100000, sales=50000, customers=400, staff=40, suppliers=30,
+                 items=150, inventory_tx=20000, tasks=5000, medical=4000, breeding=1500),
+    'small': dict(animals=60, years=1, financial=5000, sales=3000, customers=60, staff=12, suppliers=8,
+                  items=40, inventory_tx=1500, tasks=400, medical=300, breeding=120),
+}
+
+BREEDS = ['Friesian', 'Ayrshire', 'Jersey', 'Guernsey', 'Sahiwal', 'Boran']
+GROUPS = ['Milking Cows', 'Dry Cows', 'Heifers', 'Calves (Male)', 'Calves (Female)', 'Bulls']
+FEEDS = ['Dairy Meal', 'Napier Grass', 'Hay', 'Silage', 'Maize Germ', 'Mineral Lick']
+PRODUCTS = [('Milk', 60.0, (5, 400)), ('Yoghurt', 150.0, (1, 40)), ('Manure', 25.0, (10, 200)),
+            ('Heifer', 85000.0, (1, 1)), ('Bull Calf', 18000.0, (1, 2))]
+EXPENSE_CATEGORIES = ['Feed', 'Veterinary', 'Labour', 'Utilities', 'Fuel', 'Repairs', 'Transport']
+INCOME_CATEGORIES = ['Milk Contract', 'Grants', 'Hire Services']
+CONDITIONS = [('Mastitis', 'Antibiotic intramammary', 4), ('Foot rot', 'Foot bath + oxytetracycline', 7),
+              ('Worms', 'Deworming', 0), ('ECF', 'Buparvaquone', 28), ('Bloat', 'Anti-bloat drench', 0)]
+FIRST_NAMES = ['John', 'Mary', 'Peter', 'Grace', 'James', 'Faith', 'David', 'Mercy', 'Joseph', 'Esther',
+               'Samuel', 'Ruth', 'Daniel', 'Ann', 'Paul', 'Lucy', 'Moses', 'Joy', 'Brian', 'Irene']
+LAST_NAMES = ['Kamau', 'Otieno', 'Wanjiru', 'Mutua', 'Achieng', 'Kiprop', 'Njeri', 'Omondi', 'Chebet', 'Mwangi']
+
+
+def _ts(day, rng):
+    return datetime.combine(day, datetime.min.time()).replace(hour=rng.randint(5, 19), minute=rng.randint(0, 59)) \
+        .strftime('%Y-%m-%d %H:%M:%S')
+
+
+def generate(cur, sizes, seed, today):
+    """Insert every raw table; returns {table: rows inserted}."""
+    rng = random.Random(seed)
+    start = today - timedelta(days=365 * sizes['years'])
+    days = [start + timedelta(days=i) for i in range((today - start).days + 1)]
+    counts = {}
+
+    def bulk(table, cols, rows):
+        cur.executemany(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})", rows)
+        counts[table] = counts.get(table, 0) + len(rows)
+
+    # animals; roughly 55% are milking cows that feed the production table
+    animals = []
+    for i in range(1, sizes['animals'] + 1):
+        group = 'Milking Cows' if rng.random() < 0.55 else rng.choice(GROUPS[1:])
+        born = start - timedelta(days=rng.randint(400, 2500)) if group in ('Milking Cows', 'Dry Cows', 'Bulls') \
+            else today - timedelta(days=rng.randint(30, 700))
+        animals.append((f'GF{i:04d}', group, rng.choice(BREEDS), born.isoformat(), round(rng.uniform(80, 650), 1),
+                        'Active' if rng.random() < 0.95 else 'Sold', f'P{rng.randint(1, 12)}',
+                        'Healthy' if rng.random() < 0.9 else 'Under Treatment', _ts(start, rng)))
+    bulk('animal', ['tag_number', 'pen_number', 'breed', 'birth_date', 'weight', 'status', 'health_status',
+                    'created_at'], [(a[0], a[6], a[2], a[3], a[4], a[5], a[7], a[8]) for a in animals])
+    milkers = [a for a in animals if a[1] == 'Milking Cows']
+
+    # twice-daily milk per milking cow
+    rows = []
+    for day in days:
+        iso = day.isoformat()
+        for tag, group, *_ in milkers:
+            for hour in (5, 16):
+                litres = round(max(rng.gauss(9.0 if hour == 5 else 7.0, 2.0), 0.5), 1)
+                rows.append((tag, tag, group, 'milk', litres, litres, 'L', iso, 'staff', f'{iso} {hour:02d}:30:00'))
+        if len(rows) >= 50000:
+            bulk('production', ['animal_tag', 'tag', 'category', 'production_type', 'quantity', 'liters', 'unit',
+                                'production_date', 'recorded_by', 'created_at'], rows)
+            rows = []
+    bulk('production', ['animal_tag', 'tag', 'category', 'production_type', 'quantity', 'liters', 'unit',
+                        'production_date', 'recorded_by', 'created_at'], rows)
+
+    # feed: two rations per group per day
+    bulk('feed', ['feed_type', 'quantity', 'animal_group', 'feeding_time', 'created_at'],
+         [(rng.choice(FEEDS), round(rng.uniform(20, 250), 1), group, slot, f'{day.isoformat()} {hour:02d}:00:00')
+          for day in days for group in GROUPS for slot, hour in (('Morning', 6), ('Evening', 17))])
+
+    bulk('medical', ['animal_id', 'treatment_date', 'condition', 'treatment', 'veterinarian', 'next_checkup',
+                     'withdrawal_days', 'withdrawal_until', 'created_at'],
+         [(a[0], d.isoformat(), cond, treat, f'Dr. {rng.choice(LAST_NAMES)}', (d + timedelta(days=14)).isoformat(),
+           wd, (d + timedelta(days=wd)).isoformat() if wd else None, _ts(d, rng))
+          for a, d, (cond, treat, wd) in ((rng.choice(animals), rng.choice(days), rng.choice(CONDITIONS))
+                                          for _ in range(sizes['medical']))])
+
+    females = [a[0] for a in animals if a[1] in ('Milking Cows', 'Dry Cows', 'Heifers')] or [animals[0][0]]
+    bulls = [a[0] for a in animals if a[1] == 'Bulls'] or ['AI-Straw']
+    bulk('breeding', ['female_id', 'male_id', 'breeding_date', 'expected_birth', 'status', 'created_at'],
+         [(rng.choice(females), rng.choice(bulls), d.isoformat(), (d + timedelta(days=283)).isoformat(),
+           'Confirmed' if d + timedelta(days=283) > today else rng.choice(['Calved', 'Failed']), _ts(d, rng))
+          for d in (rng.choice(days) for _ in range(sizes['breeding']))])
+
+    bulk('staff', ['first_name', 'last_name', 'position', 'department', 'phone', 'date_employed', 'status', 'salary'],
+         [(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice(['Herder', 'Milker', 'Vet Assistant', 'Driver', 'Clerk']),
+           rng.choice(['management', 'medical', 'nutrition', 'breeding', 'general']), f'07{rng.randint(10000000, 99999999)}',
+           rng.choice(days).isoformat(), 'Active' if rng.random() < 0.9 else 'On Leave', rng.choice([18000, 22000, 30000, 45000]))
+          for _ in range(sizes['staff'])])
+    cur.execute('SELECT id FROM staff')
+    staff_ids = [r[0] for r in cur.fetchall()]
+    recent = [d for d in days if (today - d).days <= 60 and d.weekday() < 6]
+    bulk('attendance', ['staff_id', 'work_date', 'status', 'clock_in', 'clock_out', 'hours'],
+         [(sid, d.isoformat(), 'present', '07:00', '16:00', 9.0) for sid in staff_ids for d in recent if rng.random() < 0.9])
+    bulk('task', ['title', 'assigned_to', 'status', 'priority', 'due_date', 'category', 'created_at'],
+         [(rng.choice(['Clean milking parlour', 'Repair fence', 'Spray pens', 'Collect feed', 'Weigh calves']),
+           str(rng.choice(staff_ids)) if staff_ids and rng.random() < 0.85 else 'manager',
+           rng.choice(['Pending', 'In Progress', 'Completed', 'Completed']), rng.choice(['High', 'Normal', 'Low']),
+           (d + timedelta(days=rng.randint(0, 10))).isoformat(), 'general', _ts(d, rng))
+          for d in (rng.choice(days) for _ in range(sizes['tasks']))])
+
+    bulk('supplier', ['company_name', 'contact_person', 'phone', 'products', 'payment_terms', 'quoted_lead_time'],
+         [(f'{rng.choice(LAST_NAMES)} {rng.choice(["Agrovet", "Feeds", "Supplies", "Traders"])} {i}',
+           f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', f'07{rng.randint(10000000, 99999999)}',
+           rng.choice(FEEDS), rng.choice(['Cash', 'Net 30']), rng.randint(2, 10)) for i in range(1, sizes['suppliers'] + 1)])
+    cur.execute('SELECT id, company_name FROM supplier')
+    suppliers = cur.fetchall()
+
+    items = [(name if i < len(FEEDS) else f'{name} {i}', rng.randint(0, 500), 'kg', round(rng.uniform(20, 120), 2),
+              f'SKU-{i:05d}', rng.choice(['Main Store', 'Feed Shed']), rng.randint(20, 120))
+             for i, name in ((i, FEEDS[i % len(FEEDS)]) for i in range(sizes['items']))]
+    bulk('inventory', ['name', 'quantity', 'unit', 'price', 'sku', 'location', 'min_level'], items)
+    cur.execute('SELECT id FROM inventory')
+    item_ids = [r[0] for r in cur.fetchall()]
+    tx_rows, fin_rows = [], []
+    for n in range(sizes['inventory_tx']):
+        d = rng.choice(days)
+        if rng.random() < 0.4 and suppliers:
+            sid, sname = rng.choice(suppliers)
+            ref = f'PO-{n:06d}'
+            qty = rng.randint(50, 500)
+            tx_rows.append((rng.choice(item_ids), 'in', qty, f'From: {sname} | Ref: {ref}', 'delivery', 'storekeeper',
+                            _ts(d + timedelta(days=rng.randint(1, 9)), rng), sid, ref))
+            fin_rows.append(('expense', 'expense', round(qty * rng.uniform(20, 80), 2), 'Feed', f'{ref} from {sname}',
+                             d.isoformat(), None, _ts(d, rng), sid, ref))
+        else:
+            tx_rows.append((rng.choice(item_ids), 'out', rng.randint(1, 40), 'ration', '', 'storekeeper', _ts(d, rng), None, None))
+    bulk('inventory_transactions', ['item_id', 'tx_type', 'quantity', 'reference', 'notes', 'performed_by', 'created_at',
+                                    'supplier_id', 'purchase_ref'], tx_rows)
+
+    for _ in range(max(sizes['financial'] - len(fin_rows), 0)):
+        d = rng.choice(days)
+        if rng.random() < 0.7:
+            fin_rows.append(('expense', 'expense', round(rng.uniform(200, 40000), 2), rng.choice(EXPENSE_CATEGORIES),
+                             'Farm expense', d.isoformat(), None, _ts(d, rng), None, None))
+        else:
+            fin_rows.append(('income', 'income', round(rng.uniform(1000, 90000), 2), rng.choice(INCOME_CATEGORIES),
+                             'Farm income', d.isoformat(), None, _ts(d, rng), None, None))
+    bulk('financial', ['transaction_type', 'txn_kind', 'amount', 'category', 'description', 'transaction_date',
+                       'reference', 'created_at', 'supplier_id', 'purchase_ref'], fin_rows)
+
+    bulk('customer', ['customer_name', 'company', 'phone', 'customer_type'],
+         [(f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}', None, f'07{rng.randint(10000000, 99999999)}',
+           rng.choice(['retail', 'retail', 'wholesale', 'hotel'])) for i in range(1, sizes['customers'] + 1)])
+    cur.execute('SELECT id, customer_name FROM customer')
+    customers = cur.fetchall()
+
+    # sales with explicit ids so their SALE-<id> income entries can be written in the same pass
+    cur.execute('SELECT COALESCE(MAX(id), 0) FROM sale')
+    next_id = cur.fetchone()[0] + 1
+    sale_rows, income_rows = [], []
+    for sale_id in range(next_id, next_id + sizes['sales']):
+        d = rng.choice(days)
+        product, price, (lo, hi) = rng.choice(PRODUCTS)
+        qty = rng.randint(lo, hi)
+        total = round(qty * price, 2)
+        cid, cname = rng.choice(customers) if customers and rng.random() < 0.8 else (None, 'Walk-in')
+        tag = rng.choice(animals)[0] if product in ('Heifer', 'Bull Calf') else None
+        sale_rows.append((sale_id, cname, product, qty, price, total, d.isoformat(),
+                          'Paid' if (today - d).days > 60 or rng.random() < 0.7 else 'Pending', _ts(d, rng), tag, cid))
+        income_rows.append(('income', 'income', total, 'Sales', f'Sale S-{sale_id}: {qty} x {product} to {cname}',
+                            d.isoformat(), f'SALE-{sale_id}', _ts(d, rng)))
+    bulk('sale', ['id', 'customer_name', 'product', 'quantity', 'price_per_unit', 'total_amount', 'sale_date',
+                  'payment_status', 'created_at', 'animal_tag', 'customer_id'], sale_rows)
+    bulk('financial', ['transaction_type', 'txn_kind', 'amount', 'category', 'description', 'transaction_date',
+                       'reference', 'created_at'], income_rows)
+    return counts
+
+
+def copy_schema(src, dst):
+    """Create src's tables, indexes and triggers (no rows) in the empty database dst."""
+    if not os.path.exists(src):
+        return
+    source = sqlite3.connect(f'file:{src}?mode=ro', uri=True)
+    try:
+        ddl = source.execute("""SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+                                ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END""").fetchall()
+    finally:
+        source.close()
+    target = sqlite3.connect(dst)
+    try:
+        for (sql,) in ddl:
+            target.execute(sql)
+        target.commit()
+    finally:
+        target.close()
+
+
+def rebuild_derived(farm, conn):
+    """Bring every maintained summary in line with the raw rows, using the app's own rebuilders."""
+    cur = conn.cursor()
+    farm.rebuild_general_ledger(cur)
+    farm.rebuild_sales_summary(cur)
+    farm.refresh_customer_totals(cur)
+    farm.refresh_supplier_stats(cur)
+    farm.refresh_low_stock(cur)
+    farm.refresh_feed_aggregates(conn)
+    farm.refresh_staff_workload(cur)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', required=True, help='scratch database file to create')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='full')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--today', help='anchor date (YYYY-MM-DD); defaults to today')
+    parser.add_argument('--overwrite', action='store_true', help='replace --db if it exists')
+    for key, value in PRESETS['full'].items():
+        parser.add_argument(f'--{key.replace("_", "-")}', type=int, dest=key,
+                            help=f'override the preset (full: {value})'
+                                 + ('; sales add their own SALE- income rows on top' if key == 'financial' else ''))
+    args = parser.parse_args(argv)
+
+    db = os.path.abspath(args.db)
+    if db == os.path.abspath(os.path.join(ROOT, 'database', 'farm.db')):
+        parser.error('refusing to generate into the live database/farm.db')
+    if os.path.exists(db):
+        if not args.overwrite:
+            parser.error(f'{db} exists (pass --overwrite to replace it)')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db + suffix):
+                os.remove(db + suffix)
+    sizes = dict(PRESETS[args.preset], **{k: getattr(args, k) for k in PRESETS['full'] if getattr(args, k) is not None})
+    today = date.fromisoformat(args.today) if args.today else date.today()
+
+    os.makedirs(os.path.dirname(db), exist_ok=True)
+    copy_schema(os.path.join(ROOT, 'database', 'farm.db'), db)
+    os.environ['DATABASE'] = db
+    os.environ.setdefault('SLOW_QUERY_MS', '1e9')  # bulk loading is slow by design; keep it out of the log
+    import app as farm  # noqa: E402  (creates the schema in the scratch DB)
+    # production is created lazily by its routes; create it now, then re-run init so the
+    # indexes and aggregates that depend on it are in place
+    with farm.app.app_context():
+        farm.ensure_production_table_and_columns()
+    farm.init_database()
+
+    started = time.perf_counter()
+    conn = farm.get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute('PRAGMA synchronous = OFF')
+        counts = generate(cur, sizes, args.seed, today)
+        rebuild_derived(farm, conn)
+        conn.commit()
+        cur.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+    for table, n in counts.items():
+        print(f'{table:<24} {n:>10,}')
+    print(f'Generated {db} (seed {args.seed}, {args.preset}) in {time.perf_counter() - started:.1f}s, '
+          f'{os.path.getsize(db) / 1e6:.1f} MB')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
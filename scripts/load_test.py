@@ -0,0 +1,197 @@
+"""
+Concurrent load test: N worker processes drive a mixed read/write workload through the WSGI app
+against one SQLite file, the way several gunicorn workers do in production.
+
+    python scripts/generate_farm_data.py --db /tmp/farm-load.db --preset small
+    python scripts/load_test.py --db /tmp/farm-load.db --workers 8 --duration 20
+    python scripts/load_test.py --db /tmp/farm-load.db --workers 8 --busy-timeout-ms 0 --retries 0   # no protection
+
+Each worker imports app.py in its own process (own connections, own locks) and logs in through the
+test client. Writes are add_sale, inventory_tx and production_create; reads are the dashboard and
+list pages. Lock waits come from the app's Server-Timing "lock" entry. Afterwards the row counts of
+sale / inventory_transactions / production are checked against the writes that reported success,
+so a write that was silently lost also fails the run.
+Exit status 1 when the error rate exceeds --max-error-rate or the row counts do not match.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+READS = {
+    'dashboard': '/dashboard',
+    'sales': '/sales',
+    'inventory': '/inventory',
+    'tasks': '/tasks',
+}
+# write op -> table that gains exactly one row per successful call
+WRITES = {
+    'add_sale': 'sale',
+    'inventory_tx': 'inventory_transactions',
+    'production_create': 'production',
+}
+LOCK_TIMING = re.compile(r'lock;dur=([\d.]+);desc="(\d+) retries, (\d+) failed"')
+
+
+def _table_counts(db):
+    conn = sqlite3.connect(db, timeout=30)
+    try:
+        return {t: conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in WRITES.values()}
+    finally:
+        conn.close()
+
+
+def _write_request(client, op, rng, item_ids, tags):
+    today = date.today().isoformat()
+    if op == 'add_sale':
+        return client.post('/add_sale', data={'customer_name': f'Load {rng.randint(1, 50)}', 'product': 'Milk',
+                                              'quantity': rng.randint(1, 40), 'price_per_unit': 60,
+                                              'sale_date': today, 'payment_status': 'Paid'})
+    if op == 'inventory_tx':
+        return client.post(f'/inventory/{rng.choice(item_ids)}/tx',
+                           json={'tx_type': 'in', 'quantity': rng.randint(1, 5), 'reference': 'load-test'})
+    return client.post('/production/create', data={'animal_tag': rng.choice(tags), 'production_type': 'milk',
+                                                   'quantity': round(rng.uniform(3, 12), 1), 'unit': 'L',
+                                                   'production_date': today})
+
+
+def worker(index, args, env, start, results):
+    os.environ.update(env)
+    import app as farm  # noqa: E402  (imported here so every process opens its own connections)
+
+    farm.app.config['TESTING'] = True
+    client = farm.app.test_client()
+    client.post('/login', data={'username': args.user, 'password': args.password})
+    conn = farm.get_db_connection()
+    try:
+        item_ids = [r[0] for r in conn.execute('SELECT id FROM inventory LIMIT 50')] or [1]
+        tags = [r[0] for r in conn.execute('SELECT tag_number FROM animal LIMIT 50')] or ['LOAD-1']
+    finally:
+        conn.close()
+
+    rng = random.Random(args.seed * 1000 + index)
+    stats = {op: {'n': 0, 'errors': 0, 'ms': [], 'lock_ms': 0.0, 'retries': 0} for op in list(READS) + list(WRITES)}
+    start.wait()
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        is_write = rng.random() < args.write_ratio
+        op = rng.choice(list(WRITES) if is_write else list(READS))
+        started = time.perf_counter()
+        error = False
+        try:
+            resp = _write_request(client, op, rng, item_ids, tags) if is_write else client.get(READS[op])
+            body = resp.get_data(as_text=True)
+            m = LOCK_TIMING.search(resp.headers.get('Server-Timing', ''))
+            if m:
+                stats[op]['lock_ms'] += float(m.group(1))
+                stats[op]['retries'] += int(m.group(2))
+            error = resp.status_code >= 400 or (m is not None and int(m.group(3)) > 0) or 'database is locked' in body
+        except Exception:
+            error = True
+        stats[op]['ms'].append((time.perf_counter() - started) * 1000.0)
+        stats[op]['n'] += 1
+        stats[op]['errors'] += error
+    results.put(stats)
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)] if ordered else 0.0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', required=True, help='scratch database (see scripts/generate_farm_data.py)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds of load per worker')
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--busy-timeout-ms', type=int, help='override DB_BUSY_TIMEOUT_MS for the workers')
+    parser.add_argument('--retries', type=int, help='override DB_LOCK_RETRIES')
+    parser.add_argument('--backoff-ms', type=float, help='override DB_RETRY_BACKOFF_MS')
+    parser.add_argument('--journal-mode', help='override DB_JOURNAL_MODE (wal, delete, ...)')
+    parser.add_argument('--max-error-rate', type=float, default=0.0)
+    parser.add_argument('--json', help='write the summary to this file')
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin123')
+    args = parser.parse_args(argv)
+
+    db = os.path.abspath(args.db)
+    if db == os.path.abspath(os.path.join(ROOT, 'database', 'farm.db')):
+        parser.error('refusing to load-test the live database/farm.db')
+    if not os.path.exists(db):
+        parser.error(f'{db} does not exist; run scripts/generate_farm_data.py first')
+    env = {'DATABASE': db, 'SLOW_QUERY_MS': '1e9', 'REQUEST_LOG_LEVEL': 'WARNING'}
+    for opt, var in (('busy_timeout_ms', 'DB_BUSY_TIMEOUT_MS'), ('retries', 'DB_LOCK_RETRIES'),
+                     ('backoff_ms', 'DB_RETRY_BACKOFF_MS'), ('journal_mode', 'DB_JOURNAL_MODE')):
+        if getattr(args, opt) is not None:
+            env[var] = str(getattr(args, opt))
+
+    before = _table_counts(db)
+    ctx = multiprocessing.get_context('spawn')
+    start, results = ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(i, args, env, start, results)) for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    time.sleep(1.0)  # let every worker import the app before the clock starts
+    started = time.perf_counter()
+    start.set()
+    merged = {}
+    for _ in procs:
+        for op, s in results.get(timeout=args.duration + 300).items():
+            m = merged.setdefault(op, {'n': 0, 'errors': 0, 'ms': [], 'lock_ms': 0.0, 'retries': 0})
+            for key in ('n', 'errors', 'lock_ms', 'retries'):
+                m[key] += s[key]
+            m['ms'] += s['ms']
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    after = _table_counts(db)
+
+    total = sum(m['n'] for m in merged.values())
+    errors = sum(m['errors'] for m in merged.values())
+    print(f"{'op':<20}{'count':>8}{'errors':>8}{'err %':>8}{'p50 ms':>10}{'p95 ms':>10}{'lock ms':>11}{'retries':>9}")
+    summary = {'ops': {}}
+    for op, m in merged.items():
+        if not m['n']:
+            continue
+        row = summary['ops'][op] = {
+            'count': m['n'], 'errors': m['errors'], 'error_rate': round(m['errors'] / m['n'], 4),
+            'p50_ms': round(_percentile(m['ms'], 50), 2), 'p95_ms': round(_percentile(m['ms'], 95), 2),
+            'lock_ms': round(m['lock_ms'], 1), 'retries': m['retries'],
+        }
+        print(f"{op:<20}{row['count']:>8}{row['errors']:>8}{row['error_rate'] * 100:>8.2f}{row['p50_ms']:>10.1f}"
+              f"{row['p95_ms']:>10.1f}{row['lock_ms']:>11.1f}{row['retries']:>9}")
+
+    mismatched = []
+    for op, table in WRITES.items():
+        ok = merged.get(op, {}).get('n', 0) - merged.get(op, {}).get('errors', 0)
+        if after[table] - before[table] != ok:
+            mismatched.append(f'{table}: +{after[table] - before[table]} rows for {ok} successful {op} calls')
+    error_rate = errors / total if total else 0.0
+    summary.update({'workers': args.workers, 'seconds': round(elapsed, 2), 'requests': total,
+                    'throughput_rps': round(total / elapsed, 1) if elapsed else 0.0, 'error_rate': round(error_rate, 4),
+                    'lock_ms': round(sum(m['lock_ms'] for m in merged.values()), 1),
+                    'retries': sum(m['retries'] for m in merged.values()), 'row_count_mismatches': mismatched})
+    print(f"\n{total} requests from {args.workers} workers in {elapsed:.1f}s = {summary['throughput_rps']} req/s; "
+          f"errors {errors} ({error_rate * 100:.2f}%); lock wait {summary['lock_ms']} ms over {summary['retries']} retries")
+    for line in mismatched:
+        print(f'ROW COUNT MISMATCH {line}', file=sys.stderr)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump(summary, fh, indent=2)
+    return 1 if mismatched or error_rate > args.max_error_rate else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
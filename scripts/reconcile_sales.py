@@ -0,0 +1,38 @@
+"""
+Compare sales with their SALE-<id> financial entries and optionally repair them.
+
+    python scripts/reconcile_sales.py          # report only
+    python scripts/reconcile_sales.py --fix    # post missing entries, re-post mismatches, reverse orphans
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as farm  # noqa: E402  (importing app.py also verifies the schema)
+
+
+def main(argv):
+    fix = '--fix' in argv
+    conn = farm.get_db_connection()
+    try:
+        report = farm.reconcile_sales_ledger(conn.cursor(), fix=fix)
+        if fix:
+            conn.commit()
+    finally:
+        conn.close()
+
+    for r in report['missing']:
+        print(f"missing    S-{r['sale_id']}: sale {r['total_amount']} on {r['sale_date']} has no financial entry")
+    for r in report['mismatched']:
+        print(f"mismatched S-{r['sale_id']}: sale {r['total_amount']} on {r['sale_date']} "
+              f"vs F-{r['financial_id']} {r['amount']} on {r['transaction_date']}")
+    for r in report['orphaned']:
+        print(f"orphaned   F-{r['financial_id']}: {r['reference']} ({r['amount']}) has no sale")
+    total = sum(len(v) for v in report.values())
+    print(f"{total} discrepancies{' fixed' if fix and total else ''}.")
+    return 1 if total and not fix else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
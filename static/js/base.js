@@ -0,0 +1,197 @@
+// static/js/base.js - UI helpers shared by every page (was inline in base.html)
+
+// UI support, toast & global handlers (now runs after bootstrap is available)
+(function(){
+  // safe showToast
+  function showToast(msg, type='info') {
+    const typeClass = (type === 'success') ? 'text-bg-success' : (type === 'error' ? 'text-bg-danger' : 'text-bg-info');
+    const id = 't' + Date.now();
+    const wrapper = document.getElementById('global-toast-container');
+    const html = `
+      <div id="${id}" class="toast align-items-center ${typeClass} border-0 mb-2" role="alert" aria-live="polite" aria-atomic="true" data-bs-delay="3500">
+        <div class="d-flex">
+          <div class="toast-body">${msg}</div>
+          <button type="button" class="btn-close btn-close-white me-2 m-auto" data-bs-dismiss="toast" aria-label="Close"></button>
+        </div>
+      </div>`;
+    wrapper.insertAdjacentHTML('beforeend', html);
+    const el = document.getElementById(id);
+    const bs = new bootstrap.Toast(el);
+    bs.show();
+    el.addEventListener('hidden.bs.toast', () => el.remove());
+  }
+
+  // safe modal factory
+  function getModalById(id) {
+    const el = document.getElementById(id);
+    if (!el) return null;
+    try {
+      return bootstrap.Modal.getOrCreateInstance(el);
+    } catch (e) {
+      console.warn('Modal init error for', id, e);
+      return null;
+    }
+  }
+
+  // Global delegated click handler for data-action attributes
+  document.addEventListener('click', function(e){
+    const btn = e.target.closest('[data-action]');
+    if (!btn) return;
+    e.preventDefault();
+
+    const action = btn.getAttribute('data-action');
+
+    if (action === 'open-modal') {
+      const target = btn.getAttribute('data-bs-target') || btn.getAttribute('data-target');
+      if (!target) { showToast('Modal target missing', 'error'); return; }
+      const id = target.replace(/^#/, '');
+      const modal = getModalById(id);
+      if (!modal) { showToast('Modal not found: ' + id, 'error'); return; }
+      modal.show();
+      return;
+    }
+
+    if (action === 'update-status') {
+      const taskId = btn.getAttribute('data-task-id');
+      const status = btn.getAttribute('data-status');
+      if (!taskId || !status) { showToast('Missing taskId or status', 'error'); return; }
+
+      fetch('/update_task_status', {
+        method: 'POST',
+        headers: { 'Content-Type':'application/json' },
+        body: JSON.stringify({ task_id: taskId, status: status })
+      })
+      .then(r => r.json().catch(()=>({success:false,message:'Invalid JSON'})).then(data => ({ok:r.ok,data})))
+      .then(obj => {
+        const data = obj.data || {};
+        if (data.success) {
+          showToast(data.message || 'Updated', 'success');
+          setTimeout(()=> location.reload(), 700);
+        } else {
+          showToast(data.message || 'Update failed', 'error');
+        }
+      })
+      .catch(err => { console.error(err); showToast('Network or server error', 'error'); });
+      return;
+    }
+
+    if (action === 'view-item' || action === 'edit-item') {
+      const href = btn.getAttribute('data-href') || btn.getAttribute('href');
+      if (!href) { showToast('Missing link for view/edit', 'error'); return; }
+      window.location.href = href;
+      return;
+    }
+  });
+
+  // Expose helper for console testing
+  window._dl_showToast = showToast;
+  window._dl_getModal = getModalById;
+
+})();
+
+// Confirmation helper using Bootstrap 5 API (replaces jQuery .modal calls)
+function confirmAction(message, callback) {
+  const modalEl = document.getElementById('confirmModal');
+  if (!modalEl) { if (callback) callback(false); return; }
+  modalEl.querySelector('.modal-body').textContent = message || 'Are you sure?';
+  const bsModal = bootstrap.Modal.getOrCreateInstance(modalEl);
+  const okBtn = modalEl.querySelector('#confirmOk');
+
+  function handler() {
+    okBtn.removeEventListener('click', handler);
+    bsModal.hide();
+    if (typeof callback === 'function') callback(true);
+  }
+  okBtn.addEventListener('click', handler);
+  bsModal.show();
+}
+
+// DataTables + Flatpickr initializers (after jQuery & DataTables loaded)
+$(document).ready(function() {
+  // initialize any table with class .data-table
+  $('.data-table').each(function() {
+    $(this).DataTable({
+      dom: 'Bfrtip',
+      buttons: ['copy', 'csv', 'print'],
+      pageLength: 10,
+      lengthMenu: [5,10,25,50],
+      columnDefs: [{ orderable: false, targets: -1 }]
+    });
+  });
+
+  if (window.flatpickr) {
+    flatpickr('.date-picker', { dateFormat: 'Y-m-d' });
+  }
+});
+
+// small utility: auto-dismiss bootstrap alerts
+setTimeout(() => {
+  document.querySelectorAll('.alert').forEach(alert => {
+    try { new bootstrap.Alert(alert).close(); } catch(e) {}
+  });
+}, 5000);
+
+// Print helper: ?print=1 hides the site chrome, adds a print header and opens the print dialog
+(function() {
+    // Helper: get query param
+    function getQueryParam(name) {
+        const params = new URLSearchParams(window.location.search);
+        return params.get(name);
+    }
+
+    if (getQueryParam('print') === '1') {
+        // Add print CSS to hide site chrome and tidy layout
+        const style = document.createElement('style');
+        style.innerHTML = `
+            @media print {
+                /* hide navigation, sticky footers, sidebars if present */
+                nav, .navbar, .sidebar, .page-footer, .btn, .dataTables_length, .dataTables_filter, .dataTables_paginate { display: none !important; }
+                /* keep content full width */
+                .container, .content, .content-card, .page-content { width: auto !important; max-width: 100% !important; padding: 0 !important; margin: 0 !important; box-shadow: none !important; }
+                body { -webkit-print-color-adjust: exact; }
+                /* smaller fonts for printing */
+                body, table, p { font-size: 12px; color: #111; }
+            }
+            /* header for the printed page */
+            #dl-print-header { display: none; }
+            @media print {
+                #dl-print-header { display: block; position:relative; margin-bottom: 12px; border-bottom: 1px solid #ddd; padding-bottom: 8px; }
+            }
+        `;
+        document.head.appendChild(style);
+
+        // Insert a print header (logo + company info)
+        const header = document.createElement('div');
+        header.id = 'dl-print-header';
+        header.innerHTML = `
+            <div style="display:flex;align-items:center;gap:12px;">
+                <div style="width:110px;height:60px;border-radius:6px;background:#f3f4f6;display:flex;align-items:center;justify-content:center;font-weight:700">
+                    <!-- replace with <img src="/static/img/logo.png"> if you have a logo file -->
+                    DL FARM
+                </div>
+                <div>
+                    <div style="font-size:18px;font-weight:700">DL Farm Management System</div>
+                    <div style="color:#666;font-size:12px;">Report / Print - Generated: ${new Date().toLocaleString()}</div>
+                </div>
+            </div>`;
+        // place header at top of main content (attempt several selectors)
+        const main = document.querySelector('.content') || document.querySelector('.content-card') || document.querySelector('#content') || document.body;
+        main.insertBefore(header, main.firstChild);
+
+        // Small delay before printing so CSS and header render
+        setTimeout(function() {
+            try {
+                window.print();
+            } catch (e) {
+                console.warn('Print failed', e);
+            }
+            // if the page was opened in a new tab/window (window.opener exists), try closing after print dialog
+            // NOTE: many browsers block window.close() unless opened by script, but this will attempt it.
+            setTimeout(function() {
+                try {
+                    if (window.opener) window.close();
+                } catch (e) {}
+            }, 800);
+        }, 350);
+    }
+})();
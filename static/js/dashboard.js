@@ -0,0 +1,417 @@
+// static/js/dashboard.js - dashboard charts and period controls (data from #dashboard-data)
+(function(){
+  /***** SANITIZE & ALIGN SERIES (do this before creating any charts) *****/
+
+  // Server data: the #dashboard-data JSON element rendered by dashboard.html
+  const dataEl = document.getElementById('dashboard-data');
+  const DATA = dataEl ? JSON.parse(dataEl.textContent) : {};
+
+  const rawDays = DATA.days || [];
+  const rawIncome = DATA.income_series || [];
+  const rawExpense = DATA.expense_series || [];
+  const rawFeed = DATA.feed_series || [];
+  const rawAvgWeight = DATA.avg_weight_series || [];
+  const taskCounts = DATA.task_counts || {'Pending':0,'In Progress':0,'Completed':0};
+
+  // Optional: latest metrics injected by backend (object) or empty
+  const latestDayFromTemplate = DATA.latest_day || '';
+  const latestMetricsFromTemplate = DATA.latest_metrics || {};
+
+  // Optional production/weekly data from backend (may be undefined/empty)
+  const productionLabelsTemplate = DATA.production_labels || [];
+  const productionValuesTemplate = DATA.production_values || [];
+  const weeklyLabelsTemplate = DATA.weekly_labels || [];
+  const weeklyValuesTemplate = DATA.weekly_values || [];
+
+  // Server-provided reliable totals (use these for displays and the donut)
+  const totalIncomeFromServer = Number(DATA.total_income || 0);
+  const totalExpenseFromServer = Number(DATA.total_expense || 0);
+
+  // Helper: coerce values to numbers, keep 0 for invalid values
+  function toNumberArray(arr){
+    if (!Array.isArray(arr)) return [];
+    return arr.map(v => {
+      if (v === null || v === undefined || v === '') return 0;
+      if (typeof v === 'object') {
+        // If backend accidentally sent small objects (safer to guard), try common numeric props
+        for (const k of ['value','y','amount','qty','count']) {
+          if (v[k] !== undefined && v[k] !== null) return Number(v[k]) || 0;
+        }
+        return 0;
+      }
+      const n = Number(v);
+      return Number.isFinite(n) ? n : 0;
+    });
+  }
+
+  // Detect ISO date-like strings (YYYY-MM-DD)
+  function isLikelyDateString(s){
+    return typeof s === 'string' && /^\d{4}-\d{2}-\d{2}/.test(s);
+  }
+
+  // Normalize: zip arrays, sort by day (if date-like), and return aligned arrays
+  function normalizeSeries(daysArr, incArr, expArr, feedArr, wArr){
+    const daysCopy = Array.isArray(daysArr) ? daysArr.slice() : [];
+    const inc = toNumberArray(incArr);
+    const exp = toNumberArray(expArr);
+    const feed = toNumberArray(feedArr);
+    const w = toNumberArray(wArr);
+
+    if (daysCopy.length && isLikelyDateString(daysCopy[0])) {
+      // Zip up to the max length and allow missing numeric values as 0
+      const maxLen = Math.max(daysCopy.length, inc.length, exp.length, feed.length, w.length);
+      const zipped = [];
+      for (let i=0;i<maxLen;i++){
+        zipped.push({
+          day: daysCopy[i] !== undefined && daysCopy[i] !== null ? String(daysCopy[i]) : null,
+          income: inc[i] !== undefined ? inc[i] : 0,
+          expense: exp[i] !== undefined ? exp[i] : 0,
+          feed: feed[i] !== undefined ? feed[i] : 0,
+          avgWeight: w[i] !== undefined ? w[i] : 0
+        });
+      }
+      // Keep entries that have day defined, sort them, then append any without day (if any)
+      const withDay = zipped.filter(z => z.day);
+      const withoutDay = zipped.filter(z => !z.day);
+      withDay.sort((a,b) => (a.day > b.day ? 1 : (a.day < b.day ? -1 : 0)));
+      const final = withDay.concat(withoutDay);
+      return {
+        days: final.map(x => x.day || ''),
+        income: final.map(x => x.income || 0),
+        expense: final.map(x => x.expense || 0),
+        feed: final.map(x => x.feed || 0),
+        avgWeight: final.map(x => x.avgWeight || 0)
+      };
+    }
+
+    // If days are not date-like: align by shortest length (safer)
+    const minLen = Math.min(
+      Array.isArray(daysCopy) ? daysCopy.length : 0,
+      inc.length,
+      exp.length,
+      feed.length,
+      w.length
+    );
+    if (minLen > 0) {
+      return {
+        days: daysCopy.slice(0,minLen).map(String),
+        income: inc.slice(0,minLen),
+        expense: exp.slice(0,minLen),
+        feed: feed.slice(0,minLen),
+        avgWeight: w.slice(0,minLen)
+      };
+    }
+
+    // Fallback: if days empty but numeric arrays exist, create placeholder labels 'pt1'..'ptN' to preserve indices
+    const maxLen = Math.max(daysCopy.length, inc.length, exp.length, feed.length, w.length);
+    const daysOut = [];
+    const incOut = [], expOut = [], feedOut = [], wOut = [];
+    for (let i=0;i<maxLen;i++){
+      daysOut.push(daysCopy[i] !== undefined && daysCopy[i] !== null ? String(daysCopy[i]) : `pt${i+1}`);
+      incOut.push(inc[i] !== undefined ? inc[i] : 0);
+      expOut.push(exp[i] !== undefined ? exp[i] : 0);
+      feedOut.push(feed[i] !== undefined ? feed[i] : 0);
+      wOut.push(w[i] !== undefined ? w[i] : 0);
+    }
+    return { days: daysOut, income: incOut, expense: expOut, feed: feedOut, avgWeight: wOut };
+  }
+
+  // Run normalization
+  const normalized = normalizeSeries(rawDays, rawIncome, rawExpense, rawFeed, rawAvgWeight);
+
+  // Provide console warnings for debugging on mismatches
+  function logIfMismatch(label, arr, labels){
+    if (!Array.isArray(arr) || !Array.isArray(labels)) return;
+    if (arr.length !== labels.length) {
+      console.warn(`${label} length (${arr.length}) != labels length (${labels.length}). Data was sanitized/trimmed/padded by normalizer.`);
+    }
+    console.debug(`${label} preview:`, arr.slice(0,8));
+  }
+  logIfMismatch('income', normalized.income, normalized.days);
+  logIfMismatch('expense', normalized.expense, normalized.days);
+  logIfMismatch('feed', normalized.feed, normalized.days);
+  logIfMismatch('avgWeight', normalized.avgWeight, normalized.days);
+
+  // Final arrays used by chart creation below
+  const days = normalized.days;
+  const income = normalized.income;
+  const expense = normalized.expense;
+  const feed = normalized.feed;
+  const avgWeight = normalized.avgWeight;
+
+  /***** END SANITIZATION; NOW CREATE BAR CHARTS (using sanitized arrays) *****/
+
+  /* ----- Label formatting + axis options to avoid overcrowding ----- */
+  const monthNames = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec'];
+  function shortLabelFromISO(iso){
+    if (!iso || typeof iso !== 'string') return String(iso || '');
+    const parts = iso.split('-'); // expecting YYYY-MM-DD
+    if (parts.length < 3) return iso;
+    const d = parts[2].replace(/^0/, '');
+    const m = monthNames[Number(parts[1]) - 1] || parts[1];
+    return `${d} ${m}`;
+  }
+  // displayLabels used for x-axis text. Keep it in sync when appending points.
+  const displayLabels = (days.length && isLikelyDateString(days[0])) ? days.map(shortLabelFromISO) : days.slice();
+
+  // adapt ticks to viewport width, but keep within sensible bounds
+  const maxTicksToShow = Math.min(12, Math.max(5, Math.floor((window.innerWidth || 1000) / 100)));
+  const commonXAxisOptions = {
+    ticks: {
+      autoSkip: true,
+      maxTicksLimit: maxTicksToShow,
+      maxRotation: 45,
+      minRotation: 0,
+      callback: function(value) { return value; }
+    },
+    grid: { display: false }
+  };
+
+  /* 1) Financial trend -> grouped bar (Income, Expense) */
+  const finCtx = document.getElementById('chartFinancial');
+  if (finCtx) {
+    window.finChart = new Chart(finCtx, {
+      type: 'bar',
+      data: {
+        labels: displayLabels,
+        datasets: [
+          { label: 'Income', data: income, backgroundColor: '#16a34a' },
+          { label: 'Expense', data: expense, backgroundColor: '#ef4444' }
+        ]
+      },
+      options: {
+        maintainAspectRatio:false,
+        plugins: { legend: { position: 'bottom' }, tooltip: { mode: 'index', intersect:false,
+          callbacks: {
+            title: function(items) {
+              if (!items || !items.length) return '';
+              const idx = items[0].dataIndex;
+              return days[idx] || '';
+            }
+          }
+        } },
+        scales: { x: commonXAxisOptions, y: { beginAtZero:true } }
+      }
+    });
+  }
+
+  /* 2) Tasks -> horizontal bar showing counts */
+  const tCtx = document.getElementById('chartTasks');
+  if (tCtx) {
+    window.tasksChart = new Chart(tCtx, {
+      type: 'bar',
+      data: {
+        labels: ['Pending','In Progress','Completed'],
+        datasets: [{ label:'Tasks', data: [taskCounts.Pending||0, taskCounts['In Progress']||0, taskCounts.Completed||0], backgroundColor:['#f59e0b','#3b82f6','#10b981'] }]
+      },
+      options: {
+        indexAxis: 'y',
+        maintainAspectRatio:false,
+        plugins:{ legend:{ display:false } },
+        scales: { x:{ beginAtZero:true } }
+      }
+    });
+  }
+
+  /* 3) Feed -> vertical bar by day (displayLabels) */
+  const fCtx = document.getElementById('chartFeed');
+  if (fCtx) {
+    window.feedChart = new Chart(fCtx, {
+      type: 'bar',
+      data: { labels: displayLabels, datasets: [{ label:'Feed (kg)', data: feed, backgroundColor:'#f97316' }] },
+      options: { maintainAspectRatio:false, plugins:{ legend:{ display:false } }, scales:{ x: commonXAxisOptions, y:{ beginAtZero:true } } }
+    });
+  }
+
+  /* 4) Weight -> vertical bar by day (displayLabels) */
+  const wCtx = document.getElementById('chartWeight');
+  if (wCtx) {
+    window.weightChart = new Chart(wCtx, {
+      type: 'bar',
+      data: { labels: displayLabels, datasets: [{ label:'Avg weight (kg)', data: avgWeight, backgroundColor:'#7c3aed' }] },
+      options: { maintainAspectRatio:false, plugins:{ legend:{ display:false } }, scales:{ x: commonXAxisOptions, y:{ beginAtZero:true } } }
+    });
+  }
+
+  /* 5) Performance (right rail) -> horizontal two-bar showing Income vs Expense */
+  const perfCtx = document.getElementById('performanceDonut');
+  if (perfCtx) {
+    window.perfChart = new Chart(perfCtx, {
+      type: 'bar',
+      data: {
+        labels: ['Income','Expense'],
+        datasets: [{ label: 'Ksh', data: [totalIncomeFromServer || 0, totalExpenseFromServer || 0], backgroundColor:['#10b981','#ef4444'] }]
+      },
+      options: { indexAxis:'y', maintainAspectRatio:false, plugins:{ legend:{ display:false } }, scales:{ x:{ beginAtZero:true } } }
+    });
+  }
+
+  /* 6) Production chart (if provided) -> vertical bar */
+  if (Array.isArray(productionLabelsTemplate) && productionLabelsTemplate.length
+      && Array.isArray(productionValuesTemplate) && productionValuesTemplate.length) {
+    const prodCtx = document.getElementById('chartProduction');
+    if (prodCtx) {
+      const prodVals = toNumberArray(productionValuesTemplate);
+      window.prodChart = new Chart(prodCtx, {
+        type: 'bar',
+        data: { labels: productionLabelsTemplate, datasets: [{ label:'Value', data: prodVals, backgroundColor:'#f59e0b' }] },
+        options: { maintainAspectRatio:false, plugins:{ legend:{ display:false } }, scales:{ y:{ beginAtZero:true } } }
+      });
+    }
+  } else {
+    console.debug('Production chart not rendered: production_labels/production_values not provided by backend.');
+  }
+
+  /* 7) Weekly chart (if provided) -> vertical bar */
+  if (Array.isArray(weeklyLabelsTemplate) && weeklyLabelsTemplate.length
+      && Array.isArray(weeklyValuesTemplate) && weeklyValuesTemplate.length) {
+    const weeklyCtx = document.getElementById('chartWeekly');
+    if (weeklyCtx) {
+      const wVals = toNumberArray(weeklyValuesTemplate);
+      window.weeklyChart = new Chart(weeklyCtx, {
+        type: 'bar',
+        data: { labels: weeklyLabelsTemplate, datasets: [{ label:'Activity', data: wVals, backgroundColor:'#3b82f6' }] },
+        options: { maintainAspectRatio:false, plugins:{ legend:{ display:false } }, scales:{ y:{ beginAtZero:true } } }
+      });
+    }
+  } else {
+    console.debug('Weekly chart not rendered: weekly_labels/weekly_values not provided by backend.');
+  }
+
+  // EXPORT helper - neutralised to avoid server url_for lookups
+  window.postReport = function(format){
+    const start = document.getElementById('startDate')?.value || '';
+    const end = document.getElementById('endDate')?.value || '';
+    const type = document.getElementById('reportType')?.value || 'comprehensive';
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '#';  // neutralised: no server endpoint called
+    form.style.display='none';
+    [['start_date',start],['end_date',end],['report_type',type],['format',format]].forEach(([n,v]) => {
+      const i=document.createElement('input'); i.type='hidden'; i.name=n; i.value=v; form.appendChild(i);
+    });
+    document.body.appendChild(form); form.submit();
+  };
+
+  document.getElementById('exportCsv')?.addEventListener('click', ()=>postReport('csv'));
+  document.getElementById('exportExcel')?.addEventListener('click', ()=>postReport('excel'));
+  document.getElementById('exportPdf')?.addEventListener('click', ()=>postReport('pdf'));
+  document.getElementById('printBtn')?.addEventListener('click', ()=> window.print());
+
+  // Apply filter (reload with params so backend re-renders)
+  document.getElementById('generateBtn')?.addEventListener('click', function(){
+    const s = document.getElementById('startDate')?.value;
+    const e = document.getElementById('endDate')?.value;
+    const p = new URLSearchParams();
+    if (s) p.set('start', s);
+    if (e) p.set('end', e);
+    const url = window.location.pathname + (p.toString() ? ('?' + p.toString()) : '');
+    window.location.href = url;
+  });
+
+  /***** OPTIONAL: Append latest single-day metrics if backend provided them *****/
+  // Updated to keep displayLabels in sync with days[]
+  function tryAppendLatestPoint(latestObj){
+    try {
+      if (!latestObj) return;
+      const newDay = latestObj.day || latestObj.date;
+      if (!newDay) return;
+      const lastDisplayed = (days && days.length) ? days[days.length-1] : null;
+      // Only append if different/newer than last displayed
+      if (newDay && newDay !== lastDisplayed) {
+        days.push(newDay);
+        income.push(Number(latestObj.income || 0));
+        expense.push(Number(latestObj.expense || 0));
+        feed.push(Number(latestObj.feed || 0));
+        avgWeight.push(Number(latestObj.avgWeight || 0));
+        // also push formatted label
+        displayLabels.push(isLikelyDateString(newDay) ? shortLabelFromISO(newDay) : String(newDay));
+
+        // Update bar charts that rely on these arrays
+        if (window.finChart) {
+          window.finChart.data.labels = displayLabels;
+          window.finChart.data.datasets[0].data = income;
+          window.finChart.data.datasets[1].data = expense;
+          window.finChart.update();
+        }
+        if (window.feedChart) {
+          window.feedChart.data.labels = displayLabels;
+          window.feedChart.data.datasets[0].data = feed;
+          window.feedChart.update();
+        }
+        if (window.weightChart) {
+          window.weightChart.data.labels = displayLabels;
+          window.weightChart.data.datasets[0].data = avgWeight;
+          window.weightChart.update();
+        }
+      }
+    } catch (e) {
+      console.warn('Error appending latest metrics:', e);
+    }
+  }
+
+  // Try template-provided latest metrics first
+  if (latestDayFromTemplate && latestMetricsFromTemplate && latestMetricsFromTemplate.day === latestDayFromTemplate) {
+    tryAppendLatestPoint(Object.assign({}, latestMetricsFromTemplate, { day: latestDayFromTemplate }));
+  } else if (latestMetricsFromTemplate && latestMetricsFromTemplate.day) {
+    tryAppendLatestPoint(latestMetricsFromTemplate);
+  } else if (latestDayFromTemplate && !latestMetricsFromTemplate.day) {
+    // Backend provided latest day string only: append a zero-valued point (safer than faking data)
+    tryAppendLatestPoint({ day: latestDayFromTemplate, income:0, expense:0, feed:0, avgWeight:0 });
+  }
+
+  // If latest_metrics provided production/weekly overrides, update those charts (safe guard)
+  if (latestMetricsFromTemplate && typeof latestMetricsFromTemplate === 'object') {
+    try {
+      if (latestMetricsFromTemplate.production_labels && latestMetricsFromTemplate.production_values && window.prodChart) {
+        window.prodChart.data.labels = latestMetricsFromTemplate.production_labels;
+        window.prodChart.data.datasets[0].data = toNumberArray(latestMetricsFromTemplate.production_values);
+        window.prodChart.update();
+      }
+      if (latestMetricsFromTemplate.weekly_labels && latestMetricsFromTemplate.weekly_values && window.weeklyChart) {
+        window.weeklyChart.data.labels = latestMetricsFromTemplate.weekly_labels;
+        window.weeklyChart.data.datasets[0].data = toNumberArray(latestMetricsFromTemplate.weekly_values);
+        window.weeklyChart.update();
+      }
+      // update perfChart if provided
+      if ((latestMetricsFromTemplate.total_income !== undefined || latestMetricsFromTemplate.total_expense !== undefined) && window.perfChart) {
+        const inc = Number(latestMetricsFromTemplate.total_income || totalIncomeFromServer || 0);
+        const exp = Number(latestMetricsFromTemplate.total_expense || totalExpenseFromServer || 0);
+        window.perfChart.data.datasets[0].data = [inc, exp];
+        window.perfChart.update();
+      }
+      // update tasks if counts provided
+      if (latestMetricsFromTemplate.task_counts && window.tasksChart) {
+        const tc = latestMetricsFromTemplate.task_counts;
+        window.tasksChart.data.datasets[0].data = [tc.Pending||0, tc['In Progress']||0, tc.Completed||0];
+        window.tasksChart.update();
+      }
+    } catch(e) { console.warn('Error applying latest metrics production/weekly overrides', e); }
+  }
+
+  // Expose safe function to manually append metrics from other client code (e.g., after an AJAX post)
+  window.appendLatestMetrics = function(obj){
+    // expects { day: 'YYYY-MM-DD', income: n, expense: n, feed: n, avgWeight: n, production_labels:[], production_values:[], weekly_labels:[], weekly_values:[] }
+    tryAppendLatestPoint(obj);
+    if (obj.production_labels && obj.production_values && window.prodChart) {
+      window.prodChart.data.labels = obj.production_labels;
+      window.prodChart.data.datasets[0].data = toNumberArray(obj.production_values);
+      window.prodChart.update();
+    }
+    if (obj.weekly_labels && obj.weekly_values && window.weeklyChart) {
+      window.weeklyChart.data.labels = obj.weekly_labels;
+      window.weeklyChart.data.datasets[0].data = toNumberArray(obj.weekly_values);
+      window.weeklyChart.update();
+    }
+    if (obj.total_income !== undefined && obj.total_expense !== undefined && window.perfChart) {
+      window.perfChart.data.datasets[0].data = [Number(obj.total_income||0), Number(obj.total_expense||0)];
+      window.perfChart.update();
+    }
+    if (obj.task_counts && window.tasksChart) {
+      window.tasksChart.data.datasets[0].data = [obj.task_counts.Pending||0, obj.task_counts['In Progress']||0, obj.task_counts.Completed||0];
+      window.tasksChart.update();
+    }
+  };
+
+  /***** END JS *****/
+})();